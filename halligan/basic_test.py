@@ -7,6 +7,7 @@ import pytest
 from dotenv import load_dotenv
 from playwright.sync_api import sync_playwright
 
+from halligan.utils.readiness import prepare_captcha
 from samples import SAMPLES
 
 # Load environment variables
@@ -124,19 +125,7 @@ def test_captchas(captcha, sample_id):
                     f"Endpoint not available for {captcha}/{sample_id}: status={getattr(response, 'status', None)}"
                 )
 
-            if "recaptchav2" in captcha:
-                checkbox = page.frame_locator("#checkbox")
-                checkbox.locator("#recaptcha-anchor").click()
-                page.wait_for_timeout(2000)
-            elif "hcaptcha" in captcha:
-                checkbox = page.frame_locator("#checkbox")
-                checkbox.locator("#anchor").click()
-                page.wait_for_timeout(2000)
-            elif "arkose" in captcha:
-                frame = page.frame_locator("#funcaptcha")
-                frame.locator(".start-button").click()
-            elif "mtcaptcha" in captcha:
-                page.wait_for_timeout(2000)
+            prepare_captcha(captcha, page, SAMPLES[captcha]["region"])
 
             # Get snapshot of main frame
             full_snapshot = [page.locator("body").aria_snapshot()]
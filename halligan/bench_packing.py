@@ -0,0 +1,62 @@
+"""
+Compare contact-sheet packing of ask/compare images against per-image calls on the local benchmark.
+
+Solves every sample of SAMPLES in both modes and reports the solve rate and mean latency of each.
+The mode that runs first alternates between samples, and the library starts empty for every
+solve, so that neither mode reuses what the other generated.
+
+It needs the browser, the benchmark server and a model API key (see `execute.validate_environment`),
+so no reference figures are recorded here: solve rates and latencies depend on the model and the
+network, run it against your own setup before enabling packing.
+
+    python bench_packing.py [--repeat 1] [--output results/packing.json]
+"""
+
+import argparse
+import json
+import os
+import time
+
+import execute
+from halligan.runtime.library import Library
+from samples import SAMPLES
+
+MODES = {"per-image": False, "packed": True}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=1, help="solves per sample and mode")
+    parser.add_argument("--output", default=os.path.join("results", "packing.json"))
+    args = parser.parse_args()
+
+    execute.validate_environment()
+
+    runs: dict[str, list[dict]] = {mode: [] for mode in MODES}
+    for index, (captcha_type, sample) in enumerate(SAMPLES.items()):
+        order = list(MODES) if index % 2 == 0 else list(reversed(MODES))
+        for _ in range(args.repeat):
+            for mode in order:
+                execute.library = Library()
+                start = time.perf_counter()
+                solved = execute.solve_captcha(captcha_type, sample["id"], sample["region"], pack_images=MODES[mode])
+                elapsed = time.perf_counter() - start
+                runs[mode].append({"captcha_type": captcha_type, "solved": bool(solved), "seconds": round(elapsed, 3)})
+                print(f"{captcha_type:<40} {mode:<10} solved={bool(solved)!s:<5} {elapsed:>7.1f}s")
+
+    summary = {}
+    print(f"\n{'mode':<10} {'solved':>8} {'solve rate':>11} {'mean latency':>13}")
+    for mode, results in runs.items():
+        n = max(len(results), 1)
+        solved = sum(run["solved"] for run in results)
+        seconds = sum(run["seconds"] for run in results) / n
+        summary[mode] = {"runs": len(results), "solved": solved, "solve_rate": solved / n, "mean_seconds": seconds}
+        print(f"{mode:<10} {solved:>4}/{len(results):<3} {solved / n:>11.1%} {seconds:>12.1f}s")
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as file:
+        json.dump({"summary": summary, "runs": runs}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
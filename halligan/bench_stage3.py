@@ -0,0 +1,105 @@
+"""
+Benchmark Stage 3 program execution overhead.
+
+Runs synthetic deep and looping programs against no-op tools, so the timings measure
+only the executor: the reference interpreter versus `execute_stage3_program` as Stage 3
+calls it (compiled, metered, tools profiled), and as it runs when tracing (steps profiled too).
+Count budgets are lifted so that the programs run to the end, the wall-time deadline is kept.
+Typical results: the loop runs 1.0-1.2x faster than interpreted, deep nesting about 5x faster,
+and traced runs are 1.5-2.5x slower than interpreted.
+
+    python bench_stage3.py [--repeat 20]
+"""
+
+import argparse
+import time
+
+from halligan.runtime.accounting import Budgets
+from halligan.runtime.executor import _interpret_stage3_program, execute_stage3_program
+from halligan.runtime.registry import ToolRegistry
+from halligan.runtime.schemas import Stage3Program
+
+
+class BenchFrame:
+    def get_interactable(self, id: int) -> "BenchFrame":
+        return self
+
+
+def looping_program(size: int) -> Stage3Program:
+    """Nested foreach over `size` x `size` items, calling a tool and branching on its result."""
+    body = [
+        {"op": "call", "tool": "noop", "args": {"a": {"var": "x"}, "b": {"var": "y"}}, "save_as": "r"},
+        {
+            "op": "if",
+            "cond": {"var": "r"},
+            "then": [{"op": "assign", "var": "last", "value": {"ref": "index", "list": {"var": "items"}, "index": 0}}],
+            "else": [{"op": "assign", "var": "n", "value": {"op": "len", "value": {"var": "items"}}}],
+        },
+    ]
+    return Stage3Program(
+        steps=[
+            {"op": "assign", "var": "items", "value": list(range(size))},
+            {
+                "op": "foreach",
+                "var": "x",
+                "in": {"var": "items"},
+                "do": [{"op": "foreach", "var": "y", "in": {"var": "items"}, "do": body}],
+            },
+        ]
+    )
+
+
+def deep_program(depth: int, iterations: int) -> Stage3Program:
+    """`depth` nested ifs inside a loop, with a frame reference evaluated at the innermost level."""
+    inner: list[dict] = [
+        {"op": "call", "tool": "noop", "args": {"a": {"ref": "interactable", "frame": 0, "id": 0}, "b": 1}},
+    ]
+    for _ in range(depth):
+        inner = [{"op": "if", "cond": True, "then": inner, "else": []}]
+
+    return Stage3Program(
+        steps=[{"op": "foreach", "var": "i", "in": list(range(iterations)), "do": inner}],
+    )
+
+
+def measure(run, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    registry = ToolRegistry()
+    registry.register("noop", lambda *, a, b: a == b)
+    frames = [BenchFrame()]
+
+    programs = {
+        "loop 100x100": looping_program(100),
+        "deep 50 x 1000": deep_program(50, 1000),
+    }
+
+    budgets = Budgets(loop_iterations=None, tool_calls=None)
+
+    def execute(program: Stage3Program, profile_steps: bool) -> None:
+        execute_stage3_program(frames, program, registry=registry, budgets=budgets, profile_steps=profile_steps)
+
+    print(f"{'program':<16} {'interpret':>12} {'execute':>12} {'traced':>12} {'speedup':>8}")
+    for name, program in programs.items():
+        interpreted = measure(lambda: _interpret_stage3_program(frames, program, registry=registry), args.repeat)
+        executed = measure(lambda: execute(program, profile_steps=False), args.repeat)
+        traced = measure(lambda: execute(program, profile_steps=True), args.repeat)
+        print(
+            f"{name:<16} {interpreted * 1000:>10.2f}ms {executed * 1000:>10.2f}ms "
+            f"{traced * 1000:>10.2f}ms {interpreted / executed:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -2,23 +2,31 @@ import importlib.util
 import logging
 import os
 import sys
+import time
 import traceback
 from datetime import datetime
 from io import BytesIO
 
 from dotenv import load_dotenv
 from PIL import Image
-from playwright.sync_api import Page, sync_playwright
+from playwright.sync_api import sync_playwright
 
 import halligan.utils.action_tools as action_tools
-from halligan.agents import GPTAgent
+import halligan.utils.vision_tools as vision_tools
+from halligan.agents import GPTAgent, Router
 from halligan.runtime.config import RuntimeConfig
 from halligan.runtime.errors import UnsafeTargetError
+from halligan.runtime.executor import apply_stage2_plan
+from halligan.runtime.library import Entry, Library, layout_signature, plan_to_json, program_to_json
+from halligan.runtime.schemas import validate_stage2, validate_stage3
+from halligan.stages.pipeline import solve_pipeline
 from halligan.stages.stage1 import objective_identification
 from halligan.stages.stage2 import structure_abstraction
-from halligan.stages.stage3 import solution_composition
-from halligan.utils.layout import get_frames, get_observation
-from halligan.utils.logger import Trace
+from halligan.stages.stage3 import run_program, solution_composition
+from halligan.utils.layout import Frame, get_frames, get_observation
+from halligan.utils.logger import Trace, trace_path
+from halligan.utils.mosaic import Packing
+from halligan.utils.readiness import prepare_captcha
 from samples import SAMPLES
 
 # Setup logging
@@ -44,6 +52,21 @@ CACHE_PATH = os.path.join(BASE_PATH, "cache")
 BROWSER_URL = os.getenv("BROWSER_URL")
 BENCHMARK_URL = os.getenv("BENCHMARK_URL")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Pack ask/compare images into one contact sheet, compare runs with and without it on the benchmark
+PACK_IMAGES = os.getenv("HALLIGAN_PACK_IMAGES", "").strip() in {"1", "true", "True", "yes", "YES"}
+# Validated plans and programs, reused for challenges with the same layout and objective
+LIBRARY_PATH = os.getenv("HALLIGAN_LIBRARY", os.path.join(BASE_PATH, "results", "library.json"))
+library = Library.load(LIBRARY_PATH)
+# Run Stages 1-3 as a single conversation (see halligan/stages/pipeline.py), without the library
+PIPELINE = os.getenv("HALLIGAN_PIPELINE", "").strip() in {"1", "true", "True", "yes", "YES"}
+# Stage 3 programs requested per call, ranked statically and executed until one succeeds
+CANDIDATES = max(1, int(os.getenv("HALLIGAN_CANDIDATES", "1")))
+# Token budget of the Stage 3 prompt, in-context examples are compacted or dropped to fit (0 for no budget)
+PROMPT_BUDGET = int(os.getenv("HALLIGAN_PROMPT_BUDGET", "0")) or None
+# Model and settings per stage and vision tool (JSON, see halligan/agents/routing.py), stats per route are logged
+router = Router.load(os.getenv("HALLIGAN_ROUTES"))
+# Store trace images as JPEG thumbnails of at most this many pixels (0 keeps full PNGs)
+TRACE_THUMBNAIL = int(os.getenv("HALLIGAN_TRACE_THUMBNAIL", "0")) or None
 
 
 def validate_environment() -> None:
@@ -88,30 +111,33 @@ def validate_environment() -> None:
         raise SystemExit(1)
 
 
-def prepare_captcha(captcha_type: str, page: Page):
-    """
-    For the recaptchav2, hcaptcha, and arkose CAPTCHA types,
-    an initial prompt or verification screen (such as a "click to begin" button) appears before the main challenge.
-    This preliminary step is automatically bypassed, and is not included in the evaluation.
-    """
-    if "recaptchav2" in captcha_type:
-        checkbox = page.frame_locator("#checkbox")
-        checkbox.locator("#recaptcha-anchor").click()
-        page.wait_for_timeout(2000)
-    elif "hcaptcha" in captcha_type:
-        checkbox = page.frame_locator("#checkbox")
-        checkbox.locator("#anchor").click()
-        page.wait_for_timeout(2000)
-    elif "arkose" in captcha_type:
-        frame = page.frame_locator("#funcaptcha")
-        frame.locator(".start-button").click()
-    elif "mtcaptcha" in captcha_type:
-        page.wait_for_timeout(2000)
-
-
-def solve_captcha(captcha_type: str, id: int, region: dict) -> bool:
+def solve_from_library(
+    agent: GPTAgent, frames: list[Frame], objective: str, captcha_type: str, reused: list, generated: list
+) -> None:
+    """Run the library's program for this layout, falls back to Stage 3 generation if there is none or it fails."""
+    all_frames, _, _, _, _, interactable_types = get_observation(frames)
+    signature = layout_signature(all_frames, objective, interactable_types)
+
+    entry = library.lookup("stage3", signature, captcha_type)
+    if entry:
+        try:
+            run_program(router.agent(agent, "stage3"), frames, validate_stage3(entry.data))
+            reused.append(entry)
+            return
+        except Exception as e:
+            logger.warning(f"Library program failed, generating a new one: {e}")
+            library.report(entry, False)
+
+    start_time = time.perf_counter()
+    program = solution_composition(
+        router.agent(agent, "stage3"), frames, objective, candidates=CANDIDATES, prompt_budget=PROMPT_BUDGET
+    )
+    generated.append(("stage3", signature, program_to_json(program), time.perf_counter() - start_time))
+
+
+def solve_captcha(captcha_type: str, id: int, region: dict, pack_images: bool = PACK_IMAGES) -> bool:
     # Load agent
-    agent = GPTAgent(api_key=OPENAI_API_KEY)
+    agent = GPTAgent(api_key=OPENAI_API_KEY, stream=PIPELINE, max_tokens=1024 * CANDIDATES)
 
     # Load generated solution script from cache
     cache_file = os.path.join(CACHE_PATH, f"{captcha_type.replace("/", "_")}.py")
@@ -121,6 +147,8 @@ def solve_captcha(captcha_type: str, id: int, region: dict) -> bool:
     spec.loader.exec_module(cache)
 
     solved = False
+    reused: list[Entry] = []
+    generated: list[tuple] = []
     with sync_playwright() as p:
         browser = p.chromium.connect(BROWSER_URL)
         context = browser.new_context(viewport={"width": 1344, "height": 768})
@@ -129,16 +157,20 @@ def solve_captcha(captcha_type: str, id: int, region: dict) -> bool:
         try:
             url = f"{BENCHMARK_URL}/{captcha_type}/{id}"
             page.goto(url)
-            prepare_captcha(url, page)
+            prepare_captcha(url, page, region)
 
             # Initialize CAPTCHA solving tools
             action_tools.set_page(page)
+            vision_tools.set_agent(agent)
+            vision_tools.set_router(router)
+            vision_tools.set_packing(Packing() if pack_images else None)
 
             x, y = region["x"], region["y"]
             captcha = Image.open(BytesIO(page.screenshot(clip=region)))
 
-            trace_path = os.path.join("results", "execute", f"{captcha_type.replace("/", "_")}.ipynb")
-            Trace.start(captcha, trace_path)
+            # One notebook per run, concurrent solves of the same type do not overwrite each other
+            notebook = trace_path(os.path.join("results", "execute"), captcha_type, id)
+            Trace.start(captcha, notebook, thumbnail=TRACE_THUMBNAIL)
 
             @Trace.section("Objective Identification")
             def stage1(frames):
@@ -154,26 +186,43 @@ def solve_captcha(captcha_type: str, id: int, region: dict) -> bool:
 
             frames = get_frames(x, y, captcha)
 
-            if cache and hasattr(cache, "stage1"):
-                objective = stage1(frames)
-            else:
-                objective = objective_identification(agent, frames)
-
-            agent.reset()
-
-            if cache and hasattr(cache, "stage2"):
-                stage2(frames)
+            if PIPELINE and not any(hasattr(cache, f"stage{i}") for i in (1, 2, 3)):
+                # All stages in one conversation, so that the provider caches the shared prefix
+                with page.expect_response(lambda r: "/submit" in r.url, timeout=60000) as response_info:
+                    usage = solve_pipeline(agent, frames).usage
+                logger.info(
+                    f"Pipeline: {usage.cached_tokens}/{usage.prompt_tokens} prompt tokens cached "
+                    f"({usage.cache_hit_ratio:.0%}), time to first token {usage.ttft}"
+                )
             else:
-                structure_abstraction(agent, frames, objective)
+                if cache and hasattr(cache, "stage1"):
+                    objective = stage1(frames)
+                else:
+                    objective = objective_identification(router.agent(agent, "stage1"), frames)
 
-            agent.reset()
+                agent.reset()
 
-            with page.expect_response(lambda r: "/submit" in r.url, timeout=60000) as response_info:
-                if cache and hasattr(cache, "stage3"):
-                    frames, _, _, _, _, _ = get_observation(frames)
-                    stage3(frames)
+                if cache and hasattr(cache, "stage2"):
+                    stage2(frames)
                 else:
-                    solution_composition(agent, frames, objective)
+                    signature = layout_signature(frames, objective)
+                    entry = library.lookup("stage2", signature, captcha_type)
+                    if entry:
+                        apply_stage2_plan(frames, validate_stage2(entry.data, frames=len(frames)))
+                        reused.append(entry)
+                    else:
+                        start_time = time.perf_counter()
+                        plan = structure_abstraction(router.agent(agent, "stage2"), frames, objective)
+                        generated.append(("stage2", signature, plan_to_json(plan), time.perf_counter() - start_time))
+
+                agent.reset()
+
+                with page.expect_response(lambda r: "/submit" in r.url, timeout=60000) as response_info:
+                    if cache and hasattr(cache, "stage3"):
+                        frames, _, _, _, _, _ = get_observation(frames)
+                        stage3(frames)
+                    else:
+                        solve_from_library(agent, frames, objective, captcha_type, reused, generated)
 
             response = response_info.value
             data: dict = response.json()
@@ -181,11 +230,20 @@ def solve_captcha(captcha_type: str, id: int, region: dict) -> bool:
 
             agent.reset()
 
+            # Keep what solved the challenge, and the outcome of what was reused
+            for entry in reused:
+                library.report(entry, bool(solved))
+            if solved:
+                for kind, signature, program, latency in generated:
+                    library.store(kind, signature, program, captcha_type, latency)
+            library.save()
+
         except Exception as e:
             logger.error(f"Error: {e}")
             logger.error(traceback.format_exc())
 
         finally:
+            router.outcome(bool(solved))
             Trace.stop()
             if not page.is_closed():
                 page.close()
@@ -203,8 +261,20 @@ def main():
 
         sample_id = sample_info["id"]
         sample_region = sample_info["region"]
+        start_time = time.perf_counter()
         solved = solve_captcha(captcha_type, sample_id, sample_region)
-        logger.info(f"Solved: {solved}")
+        elapsed = time.perf_counter() - start_time
+        logger.info(f"Solved: {solved} ({elapsed:.1f}s, packed images: {PACK_IMAGES})")
+
+    for key, stats in library.summary().items():
+        logger.info(f"Library {key}: {stats['hits']}/{stats['lookups']} hits, saved {stats['saved_seconds']:.1f}s")
+
+    for key, stats in router.summary().items():
+        logger.info(
+            f"Route {key}: {stats['calls']} calls, {stats['mean_seconds']:.2f}s per call, "
+            f"{stats['prompt_tokens'] + stats['completion_tokens']} tokens, "
+            f"solve rate {stats['solve_rate']:.0%} over {stats['challenges']} challenges"
+        )
 
 
 if __name__ == "__main__":
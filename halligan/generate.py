@@ -9,7 +9,7 @@ from textwrap import indent
 
 from dotenv import load_dotenv
 from PIL import Image
-from playwright.sync_api import Page, sync_playwright
+from playwright.sync_api import sync_playwright
 
 import halligan.prompts as Prompts
 import halligan.utils.action_tools as action_tools
@@ -22,7 +22,8 @@ from halligan.stages.stage2 import structure_abstraction
 from halligan.utils.action_tools import action_toolkits
 from halligan.utils.constants import InteractableElement, Stage
 from halligan.utils.layout import Frame, get_frames, get_observation
-from halligan.utils.logger import Trace
+from halligan.utils.logger import Trace, trace_path
+from halligan.utils.readiness import prepare_captcha
 from halligan.utils.vision_tools import vision_toolkits
 from samples import SAMPLES
 
@@ -73,27 +74,6 @@ def validate_environment() -> None:
         raise SystemExit(1)
 
 
-def prepare_captcha(captcha_type: str, page: Page):
-    """
-    For the recaptchav2, hcaptcha, and arkose CAPTCHA types,
-    an initial prompt or verification screen (such as a "click to begin" button) appears before the main challenge.
-    This preliminary step is automatically bypassed, and is not included in the evaluation.
-    """
-    if "recaptchav2" in captcha_type:
-        checkbox = page.frame_locator("#checkbox")
-        checkbox.locator("#recaptcha-anchor").click()
-        page.wait_for_timeout(2000)
-    elif "hcaptcha" in captcha_type:
-        checkbox = page.frame_locator("#checkbox")
-        checkbox.locator("#anchor").click()
-        page.wait_for_timeout(2000)
-    elif "arkose" in captcha_type:
-        frame = page.frame_locator("#funcaptcha")
-        frame.locator(".start-button").click()
-    elif "mtcaptcha" in captcha_type:
-        page.wait_for_timeout(2000)
-
-
 @Trace.section("Solution Composition")
 def solution_composition(agent: Agent, frames: list[Frame], objective: str) -> None:
     """
@@ -155,7 +135,7 @@ def generate_script(captcha_type: str, id: int, region: dict):
         try:
             url = f"{BENCHMARK_URL}/{captcha_type}/{id}"
             page.goto(url)
-            prepare_captcha(url, page)
+            prepare_captcha(url, page, region)
 
             # Initialize CAPTCHA solving tools
             action_tools.set_page(page)
@@ -163,8 +143,8 @@ def generate_script(captcha_type: str, id: int, region: dict):
             x, y = region["x"], region["y"]
             captcha = Image.open(BytesIO(page.screenshot(clip=region)))
 
-            trace_path = os.path.join("results", "generate", f"{captcha_type.replace("/", "_")}.ipynb")
-            Trace.start(captcha, trace_path)
+            # One notebook per run, concurrent solves of the same type do not overwrite each other
+            Trace.start(captcha, trace_path(os.path.join("results", "generate"), captcha_type, id))
 
             frames = get_frames(x, y, captcha)
             objective = objective_identification(agent, frames)
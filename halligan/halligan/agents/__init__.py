@@ -1 +1,3 @@
 from .agent import Agent, GPTAgent
+from .images import DEFAULT_POLICY, ImagePolicy, estimate_image_tokens, estimate_tokens, split_by_budget
+from .routing import SITES, Route, RoutedAgent, Router, RouteStats
@@ -1,11 +1,13 @@
-import base64
-import io
+import copy
+import time
 from abc import ABC, abstractmethod
 from typing import Any, Optional, TypeAlias
 
 import openai
 from PIL import Image
 
+from halligan.agents.images import DEFAULT_POLICY, ImagePolicy, encode_image, estimate_tokens
+from halligan.runtime.accounting import record
 from halligan.utils.logger import Trace
 
 Metadata: TypeAlias = dict[str, Any]
@@ -14,14 +16,28 @@ Metadata: TypeAlias = dict[str, Any]
 class Agent(ABC):
     @abstractmethod
     def __call__(
-        self, prompt: str, images: Optional[list[Image.Image]] = None, image_captions: Optional[list[str]] = None
+        self,
+        prompt: str,
+        images: Optional[list[Image.Image]] = None,
+        image_captions: Optional[list[str]] = None,
+        policy: Optional[ImagePolicy] = None,
     ) -> tuple[str, Metadata]:
         pass
 
     @abstractmethod
-    def reset(self) -> None:
+    def reset(self, system: str | None = None) -> None:
+        """Start a new conversation, optionally with a system prompt (a stable prefix for prompt caching)."""
         pass
 
+    def fork(self) -> "Agent":
+        """
+        Get an agent with the same configuration and an empty history.
+        Forks can be called concurrently with each other and with this agent.
+        """
+        agent = copy.copy(self)
+        agent.reset()
+        return agent
+
 
 class GPTAgent(Agent):
     def __init__(
@@ -30,15 +46,28 @@ class GPTAgent(Agent):
         model: str = "gpt-4o-2024-11-20",
         *,
         timeout: int = 30,
+        image_policy: ImagePolicy = DEFAULT_POLICY,
+        stream: bool = False,
+        max_tokens: int = 1024,
+        temperature: float = 0,
     ) -> None:
+        """
+        stream: stream responses, to measure time to first token (`ttft` in the metadata)
+        max_tokens: completion limit, raise it when asking for several candidate programs at once
+        temperature: sampling temperature
+        """
         if not api_key or not isinstance(api_key, str):
             raise ValueError("Missing OPENAI_API_KEY (provide a non-empty string)")
         self.model = model
+        self.image_policy = image_policy
+        self.stream = stream
+        self.max_tokens = max_tokens
+        self.temperature = temperature
         self.client = openai.OpenAI(api_key=api_key, timeout=timeout)
         self.history: list[dict[str, Any]] = []
 
-    def reset(self) -> None:
-        self.history = []
+    def reset(self, system: str | None = None) -> None:
+        self.history = [{"role": "system", "content": system}] if system else []
 
     @Trace.agent()
     def __call__(
@@ -46,34 +75,79 @@ class GPTAgent(Agent):
         prompt: str,
         images: Optional[list[Image.Image]] = None,
         image_captions: Optional[list[str]] = None,
+        policy: Optional[ImagePolicy] = None,
     ) -> tuple[str, Metadata]:
         user_prompt = [{"type": "text", "text": prompt}]
+        policy = policy or self.image_policy
 
         images = images or []
         if image_captions is None or len(image_captions) != len(images):
             image_captions = [f"Image {i}" for i in range(len(images))]
 
+        image_bytes = 0
         for image, image_caption in zip(images, image_captions):
-            buffer = io.BytesIO()
-            image.save(buffer, format="JPEG")
-            image_b64 = base64.b64encode(buffer.getvalue()).decode("ascii")
+            image_url, size = encode_image(image, policy)
+            image_bytes += size
             user_prompt.append({"type": "text", "text": image_caption})
-            user_prompt.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_b64}"}})
+            user_prompt.append({"type": "image_url", "image_url": {"url": image_url, "detail": policy.detail}})
 
         self.history.append({"role": "user", "content": user_prompt})
 
-        response = self.client.chat.completions.create(
-            model=self.model, messages=self.history, max_tokens=1024, temperature=0, top_p=1
-        )
-
-        content = response.choices[0].message.content
+        start = time.perf_counter()
+        if self.stream:
+            content, fingerprint, usage, ttft = self._stream(start)
+        else:
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=self.history,
+                max_tokens=self.max_tokens,
+                temperature=self.temperature,
+                top_p=1,
+            )
+            content, fingerprint, usage = (
+                response.choices[0].message.content,
+                response.system_fingerprint,
+                response.usage,
+            )
+            ttft = time.perf_counter() - start
+
+        record("tokens", usage.total_tokens)
+        details = getattr(usage, "prompt_tokens_details", None)
         metadata = {
-            "fingerprint": response.system_fingerprint,
-            "total_tokens": response.usage.total_tokens,
-            "prompt_tokens": response.usage.prompt_tokens,
-            "completion_tokens": response.usage.completion_tokens,
+            "fingerprint": fingerprint,
+            "total_tokens": usage.total_tokens,
+            "prompt_tokens": usage.prompt_tokens,
+            "cached_tokens": getattr(details, "cached_tokens", None) or 0,
+            "completion_tokens": usage.completion_tokens,
+            "ttft": round(ttft, 3),
+            "image_bytes": image_bytes,
+            "image_tokens_estimate": estimate_tokens(images, policy),
         }
 
         self.history.append({"role": "assistant", "content": content})
 
         return content, metadata
+
+    def _stream(self, start: float) -> tuple[str, str | None, Any, float]:
+        """Streamed completion, returns its content, fingerprint, usage and time to first token."""
+        chunks = self.client.chat.completions.create(
+            model=self.model,
+            messages=self.history,
+            max_tokens=self.max_tokens,
+            temperature=self.temperature,
+            top_p=1,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+
+        parts: list[str] = []
+        fingerprint, usage, ttft = None, None, None
+        for chunk in chunks:
+            fingerprint = chunk.system_fingerprint or fingerprint
+            usage = chunk.usage or usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                parts.append(chunk.choices[0].delta.content)
+
+        return "".join(parts), fingerprint, usage, ttft if ttft is not None else time.perf_counter() - start
@@ -0,0 +1,132 @@
+"""
+How images are encoded before they are sent to an agent.
+
+Every image part costs upload bytes and prompt tokens. A full CAPTCHA screenshot, a grid tile
+and a slider observation do not need the same resolution or codec, so each call can pass an
+`ImagePolicy` that trades size against accuracy.
+"""
+
+from __future__ import annotations
+
+import base64
+import io
+import math
+from dataclasses import dataclass
+from typing import Literal
+
+from PIL import Image
+
+ImageFormat = Literal["JPEG", "WEBP", "PNG"]
+ImageDetail = Literal["auto", "low", "high"]
+
+
+@dataclass(frozen=True)
+class ImagePolicy:
+    """
+    max_side: downscale images so that their longest side fits (None keeps full resolution)
+    format/quality: codec and lossy quality (ignored for PNG)
+    detail: OpenAI image detail level, `low` costs a fixed amount of tokens per image
+    max_tokens_per_call: estimated image token budget of one call, see `split_by_budget`
+    """
+
+    max_side: int | None = None
+    format: ImageFormat = "JPEG"
+    quality: int = 75
+    detail: ImageDetail = "auto"
+    max_tokens_per_call: int | None = None
+
+
+# Full resolution JPEG at PIL's default quality
+DEFAULT_POLICY = ImagePolicy()
+
+_MIME_TYPES: dict[str, str] = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+
+def resize(image: Image.Image, policy: ImagePolicy) -> Image.Image:
+    """Downscale `image` to the policy's `max_side`, keeping the aspect ratio."""
+    if policy.max_side is None or max(image.size) <= policy.max_side:
+        return image
+
+    scale = policy.max_side / max(image.size)
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(size, Image.Resampling.LANCZOS)
+
+
+def encode_image(image: Image.Image, policy: ImagePolicy = DEFAULT_POLICY) -> tuple[str, int]:
+    """
+    Encode an image as a data URL according to `policy`.
+
+    Returns:
+        url (str): base64 data URL
+        size (int): encoded size in bytes
+    """
+    image = resize(image, policy)
+    if policy.format != "PNG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    buffer = io.BytesIO()
+    if policy.format == "PNG":
+        image.save(buffer, format="PNG")
+    else:
+        image.save(buffer, format=policy.format, quality=policy.quality)
+
+    data = buffer.getvalue()
+    image_b64 = base64.b64encode(data).decode("ascii")
+    return f"data:{_MIME_TYPES[policy.format]};base64,{image_b64}", len(data)
+
+
+def estimate_image_tokens(size: tuple[int, int], policy: ImagePolicy = DEFAULT_POLICY) -> int:
+    """
+    Estimate the prompt tokens of one image with OpenAI's tiling rule for GPT-4o models.
+    `auto` detail is counted as `high`, which is an upper bound.
+    """
+    if policy.detail == "low":
+        return 85
+
+    width, height = size
+    if policy.max_side is not None and max(width, height) > policy.max_side:
+        scale = policy.max_side / max(width, height)
+        width, height = width * scale, height * scale
+
+    # Fit within 2048 x 2048, then scale the shortest side down to 768
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+
+def estimate_tokens(images: list[Image.Image], policy: ImagePolicy = DEFAULT_POLICY) -> int:
+    """Estimated image tokens of a call sending `images`."""
+    return sum(estimate_image_tokens(image.size, policy) for image in images)
+
+
+def split_by_budget(
+    images: list[Image.Image], policy: ImagePolicy = DEFAULT_POLICY, reserved: int = 0
+) -> list[list[int]]:
+    """
+    Split image indices into consecutive chunks that each fit `policy.max_tokens_per_call`.
+    `reserved` tokens are counted towards every chunk (e.g., a reference image sent with each chunk).
+    A single image over budget still gets its own chunk.
+    """
+    if policy.max_tokens_per_call is None:
+        return [list(range(len(images)))] if images else []
+
+    chunks: list[list[int]] = []
+    chunk: list[int] = []
+    tokens = reserved
+    for index, image in enumerate(images):
+        cost = estimate_image_tokens(image.size, policy)
+        if chunk and tokens + cost > policy.max_tokens_per_call:
+            chunks.append(chunk)
+            chunk, tokens = [], reserved
+
+        chunk.append(index)
+        tokens += cost
+
+    if chunk:
+        chunks.append(chunk)
+
+    return chunks
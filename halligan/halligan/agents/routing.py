@@ -0,0 +1,161 @@
+"""
+Model routing per call site.
+
+Every stage and every VLM-backed vision tool used to call the same model with the same
+settings, including yes/no `ask` checks. A `Router` maps each call site (see `SITES`) to a
+`Route` (model and parameters), and wraps agents so that every call is recorded per site
+and model: calls, latency and tokens, and the solve rate of the challenges a route took
+part in (reported with `outcome`). Sites without a route keep the agent's own settings.
+
+Routes are loaded from JSON, e.g. `{"ask": {"model": "gpt-4o-mini", "max_tokens": 256}}`.
+"""
+
+from __future__ import annotations
+
+import copy
+import json
+import threading
+import time
+from dataclasses import asdict, dataclass, field, fields
+from typing import Any, Optional
+
+from PIL import Image
+
+from halligan.agents.agent import Agent, Metadata
+from halligan.agents.images import ImagePolicy
+from halligan.runtime.errors import ConfigError
+
+SITES = ("stage1", "stage2", "stage3", "ask", "rank", "compare")
+
+
+@dataclass(frozen=True)
+class Route:
+    """
+    Agent settings of a call site, None keeps the agent's own.
+    image_policy only applies to calls that do not pass a policy (see `vision_tools.set_image_policy`).
+    """
+
+    model: str | None = None
+    temperature: float | None = None
+    max_tokens: int | None = None
+    image_policy: ImagePolicy | None = None
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> Route:
+        unknown = set(data) - {f.name for f in fields(cls)}
+        if unknown:
+            raise ConfigError(f"Unknown route settings: {', '.join(sorted(unknown))}")
+        policy = data.get("image_policy")
+        return cls(**{**data, "image_policy": ImagePolicy(**policy) if policy else None})
+
+
+@dataclass
+class RouteStats:
+    calls: int = 0
+    seconds: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # Challenges this route was called in, and how many of them were solved
+    challenges: int = 0
+    solved: int = 0
+
+    @property
+    def solve_rate(self) -> float:
+        return self.solved / self.challenges if self.challenges else 0.0
+
+
+class RoutedAgent(Agent):
+    """An agent configured for a call site, whose calls are recorded by the router."""
+
+    def __init__(self, base: Agent, agent: Agent, router: Router, site: str) -> None:
+        self.base = base
+        self.agent = agent
+        self.router = router
+        self.site = site
+
+    def __call__(
+        self,
+        prompt: str,
+        images: Optional[list[Image.Image]] = None,
+        image_captions: Optional[list[str]] = None,
+        policy: Optional[ImagePolicy] = None,
+    ) -> tuple[str, Metadata]:
+        start = time.perf_counter()
+        response, metadata = self.agent(prompt, images, image_captions, policy)
+        self.router.record(self.site, getattr(self.agent, "model", "default"), metadata, time.perf_counter() - start)
+        return response, metadata
+
+    def reset(self, system: str | None = None) -> None:
+        self.agent.reset(system)
+
+    def fork(self) -> Agent:
+        return RoutedAgent(self.base, self.agent.fork(), self.router, self.site)
+
+
+@dataclass
+class Router:
+    routes: dict[str, Route] = field(default_factory=dict)
+    stats: dict[str, RouteStats] = field(default_factory=dict)
+    _used: set[str] = field(default_factory=set, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def __post_init__(self) -> None:
+        unknown = set(self.routes) - set(SITES)
+        if unknown:
+            raise ConfigError(f"Unknown call sites: {', '.join(sorted(unknown))} (expected one of {', '.join(SITES)})")
+
+    @classmethod
+    def load(cls, path: str | None) -> Router:
+        """Routes from a JSON file (see the module docstring), no file routes nothing."""
+        if not path:
+            return cls()
+        with open(path) as file:
+            data = json.load(file)
+        return cls(routes={site: Route.from_dict(route) for site, route in data.items()})
+
+    def agent(self, agent: Agent, site: str) -> RoutedAgent:
+        """A fork of `agent` with the settings of `site`."""
+        if site not in SITES:
+            raise ConfigError(f"Unknown call site {site!r}")
+        # Route from the original agent, e.g. vision tools get the agent of Stage 3
+        base = agent.base if isinstance(agent, RoutedAgent) else agent
+        routed = base.fork()
+        route = self.routes.get(site)
+        if route:
+            routed = copy.copy(routed)
+            for name, value in asdict(route).items():
+                if value is not None and hasattr(routed, name):
+                    setattr(routed, name, getattr(route, name))
+        return RoutedAgent(base, routed, self, site)
+
+    def record(self, site: str, model: str, metadata: Metadata, seconds: float) -> None:
+        key = f"{site}:{model}"
+        with self._lock:
+            stats = self.stats.setdefault(key, RouteStats())
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.prompt_tokens += metadata.get("prompt_tokens", 0)
+            stats.completion_tokens += metadata.get("completion_tokens", 0)
+            self._used.add(key)
+
+    def outcome(self, solved: bool) -> None:
+        """End of a challenge, attributes the outcome to every route called since the last one."""
+        with self._lock:
+            for key in self._used:
+                self.stats[key].challenges += 1
+                self.stats[key].solved += int(solved)
+            self._used.clear()
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """Calls, mean latency, tokens and solve rate per `site:model`."""
+        return {
+            key: {
+                "calls": s.calls,
+                "mean_seconds": round(s.seconds / s.calls, 3) if s.calls else 0.0,
+                "prompt_tokens": s.prompt_tokens,
+                "completion_tokens": s.completion_tokens,
+                "challenges": s.challenges,
+                "solve_rate": round(s.solve_rate, 3),
+            }
+            for key, s in sorted(self.stats.items())
+        }
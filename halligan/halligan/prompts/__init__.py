@@ -1,7 +1,9 @@
 import os
 from string import Template
 
+from halligan.prompts import builder
 from halligan.utils.constants import Stage
+from halligan.utils.logger import Trace
 
 
 def _get_template(prompt_name: str) -> Template:
@@ -25,3 +27,21 @@ def get(stage: Stage, **kwargs) -> str:
     Throws KeyError for missing placeholders.
     """
     return _TEMPLATES[stage].substitute({**kwargs})
+
+
+def build(
+    stage: Stage,
+    *,
+    examples: list[tuple[str, str]] | None = None,
+    budget: int | None = None,
+    **kwargs,
+) -> str:
+    """
+    Like `get`, with `examples` (label, text) fitted to a token `budget` (see `builder.build`).
+    The size of the prompt per section is reported in the trace.
+    """
+    prompt, report = builder.build(stage.name, _TEMPLATES[stage], examples=examples, budget=budget, **kwargs)
+    if Trace.tracing:
+        Trace.comment(report.to_markdown())
+        Trace.summary(f"prompt:{stage.name}", report.to_dict())
+    return prompt
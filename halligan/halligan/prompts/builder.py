@@ -0,0 +1,153 @@
+"""
+Token-budgeted prompt assembly.
+
+`Prompts.get` substitutes a template as is. `build` also measures the tokens of every
+section (the template's own text and each substituted value), so that the trace shows
+what a stage's prompt is made of. In-context examples are deduplicated (e.g., SLIDEABLE_X
+and SLIDEABLE_Y share one), and when the prompt exceeds `budget` they are compacted
+(JSON examples without indentation) and then dropped from the last, keeping at least one.
+Examples are whole programs and are never cut in the middle.
+
+Tokens are counted with tiktoken when it is installed, otherwise estimated from the length.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import re
+from dataclasses import asdict, dataclass, field
+from functools import lru_cache
+from string import Template
+from typing import Any
+
+try:
+    import tiktoken
+except ImportError:  # optional, see `count_tokens`
+    tiktoken = None
+
+# Characters per token of English text and JSON, when tiktoken is not available
+CHARS_PER_TOKEN = 4
+
+_PLACEHOLDER_RE = re.compile(r"\$\{(\w+)\}|\$(\w+)")
+_JSON_FENCE_RE = re.compile(r"```json\s*(.*?)\s*```", re.DOTALL)
+
+
+@lru_cache(maxsize=1)
+def _encoding() -> Any:
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:  # the encoding is downloaded on first use
+        return None
+
+
+def count_tokens(text: str) -> int:
+    encoding = _encoding()
+    if encoding is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def compact(example: str) -> str:
+    """An example with its JSON blocks re-serialized without indentation."""
+
+    def minify(match: re.Match) -> str:
+        try:
+            data = json.loads(match.group(1))
+        except json.JSONDecodeError:
+            return match.group(0)
+        return "```json\n" + json.dumps(data, separators=(",", ":")) + "\n```"
+
+    return _JSON_FENCE_RE.sub(minify, example)
+
+
+@dataclass
+class PromptReport:
+    """
+    sections: tokens of the template text ("instructions") and of each substituted value
+    examples: labels of the examples in the prompt, `dropped` those left out to fit `budget`
+    """
+
+    stage: str
+    tokens: int
+    budget: int | None
+    sections: dict[str, int] = field(default_factory=dict)
+    examples: list[str] = field(default_factory=list)
+    dropped: list[str] = field(default_factory=list)
+    compacted: bool = False
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+    def to_markdown(self) -> str:
+        budget = f" of {self.budget}" if self.budget else ""
+        lines = [
+            f"**Prompt ({self.stage}):** {self.tokens}{budget} tokens",
+            "",
+            "| section | tokens |",
+            "|---|---|",
+            *(f"| {name} | {tokens} |" for name, tokens in self.sections.items()),
+        ]
+        if self.compacted:
+            lines.append("\nExamples were compacted to fit the budget.")
+        if self.dropped:
+            lines.append(f"\nDropped examples: {', '.join(self.dropped)}")
+        return "\n".join(lines)
+
+
+def dedupe_examples(examples: list[tuple[str, str]]) -> list[tuple[str, str]]:
+    """Merge examples with the same text, keeping the first position and joining their labels."""
+    merged: dict[str, list[str]] = {}
+    for label, text in examples:
+        merged.setdefault(text, []).append(label)
+    return [(", ".join(labels), text) for text, labels in merged.items()]
+
+
+def build(
+    stage: str,
+    template: Template,
+    *,
+    examples: list[tuple[str, str]] | None = None,
+    budget: int | None = None,
+    **kwargs: Any,
+) -> tuple[str, PromptReport]:
+    """
+    Substitute `template`, with `examples` (label, text) in order of priority joined into `${examples}`.
+
+    Returns:
+        prompt (str): the prompt
+        report (PromptReport): tokens per section, and how examples were fitted to `budget`
+    """
+    used = {a or b for a, b in _PLACEHOLDER_RE.findall(template.template)}
+    values = {key: str(value) for key, value in kwargs.items() if key in used}
+    selected = dedupe_examples(examples or [])
+    report = PromptReport(stage=stage, tokens=0, budget=budget)
+
+    def sections() -> dict[str, int]:
+        instructions = template.safe_substitute({key: "" for key in used})
+        counts = {"instructions": count_tokens(instructions)}
+        counts.update({key: count_tokens(value) for key, value in values.items()})
+        if examples is not None:
+            counts.update({f"example ({label})": count_tokens(text) for label, text in selected})
+        return counts
+
+    counts = sections()
+    if budget is not None and sum(counts.values()) > budget and selected:
+        selected = [(label, compact(text)) for label, text in selected]
+        report.compacted = True
+        counts = sections()
+        while sum(counts.values()) > budget and len(selected) > 1:
+            label, _ = selected.pop()
+            report.dropped.append(label)
+            counts = sections()
+
+    if examples is not None:
+        values["examples"] = "\n\n".join(text for _, text in selected)
+    prompt = template.substitute({**kwargs, **values})
+
+    report.sections = counts
+    report.examples = [label for label, _ in selected]
+    report.tokens = count_tokens(prompt)
+    return prompt, report
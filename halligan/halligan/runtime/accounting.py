@@ -0,0 +1,152 @@
+"""
+Execution budgets for Stage 3 programs.
+
+The executor binds a `Meter` to the running program through a context variable. Tools
+report what they use with `record()` (screenshots, VLM calls) and the executor charges
+tool calls and loop iterations. Every charge, and the start of a program (`checkpoint()`),
+checks the budgets, the wall-time deadline and cancellation. Running over a budget raises
+BudgetExceededError, which is fed back to the agent like any other execution error.
+
+Cancellation is cooperative: `Meter.cancel()` takes effect at the next tool call, loop
+iteration or resource a tool records, blocking calls already in flight are not interrupted.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Iterator
+
+from halligan.runtime.errors import BudgetExceededError, ExecutionCancelledError
+from halligan.runtime.profiler import attribute
+
+
+@dataclass(frozen=True)
+class Budgets:
+    """
+    Per-program limits, None disables a limit.
+
+    wall_time: seconds from the start of the program
+    tool_calls: calls of any single tool, `per_tool` overrides it for specific tools
+    """
+
+    wall_time: float | None = 120.0
+    vlm_calls: int | None = 40
+    screenshots: int | None = 600
+    loop_iterations: int | None = 2000
+    tool_calls: int | None = 100
+    per_tool: dict[str, int] = field(default_factory=dict)
+
+
+# Suggestions added to BudgetExceededError, so that the retried program avoids the same problem
+_HINTS: dict[str, str] = {
+    "vlm_calls": "Batch images into a single ask()/compare()/rank() call instead of calling it per item.",
+    "screenshots": "Avoid sweeping or refining the same slider repeatedly.",
+    "loop_iterations": "Loop over fewer items, and break once a choice is found.",
+    "wall_time": "Use fewer tool calls, and break out of loops once a choice is found.",
+}
+
+
+class Meter:
+    """Resources used by one running program, checked against its budgets."""
+
+    def __init__(self, budgets: Budgets = Budgets()) -> None:
+        self.budgets = budgets
+        self.usage: Counter[str] = Counter()
+        self.started = time.monotonic()
+        self._deadline = None if budgets.wall_time is None else self.started + budgets.wall_time
+        self._cancelled: str | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        """Stop the program at its next tool call or loop iteration (may be called from another thread)."""
+        self._cancelled = reason
+
+    def check(self) -> None:
+        """Raise if the program was cancelled or ran past its wall-time budget."""
+        if self._cancelled is not None:
+            raise ExecutionCancelledError(f"Execution cancelled: {self._cancelled}")
+
+        if self._deadline is not None and time.monotonic() > self._deadline:
+            wall_time = self.budgets.wall_time
+            raise BudgetExceededError("wall_time", wall_time, round(self.elapsed, 1), _HINTS["wall_time"])
+
+    # `charge` and `charge_tool` run for every loop iteration and tool call, so they check
+    # inline and use acquire/release, which is about twice as fast as `with self._lock`.
+
+    def charge(self, resource: str, amount: int = 1, limit: int | None = None) -> None:
+        """Add `amount` of `resource`, raise if it goes over `limit` (the budget of the same name by default)."""
+        if self._cancelled is not None or (self._deadline is not None and time.monotonic() > self._deadline):
+            self.check()
+        if limit is None:
+            limit = getattr(self.budgets, resource, None)
+
+        self._lock.acquire()
+        try:
+            self.usage[resource] = used = self.usage[resource] + amount
+        finally:
+            self._lock.release()
+
+        if limit is not None and used > limit:
+            raise BudgetExceededError(resource, limit, used, _HINTS.get(resource, ""))
+
+    def tally(self, name: str, amount: int = 1) -> None:
+        """Count an event without a budget (e.g., calls saved by batching)."""
+        with self._lock:
+            self.usage[name] += amount
+
+    def charge_tool(self, name: str) -> None:
+        limit = self.budgets.per_tool.get(name, self.budgets.tool_calls)
+        if self._cancelled is not None or (self._deadline is not None and time.monotonic() > self._deadline):
+            self.check()
+
+        key = "tool:" + name
+        self._lock.acquire()
+        try:
+            self.usage[key] = used = self.usage[key] + 1
+        finally:
+            self._lock.release()
+
+        if limit is not None and used > limit:
+            hint = f"Call {name}() fewer times, it accepts lists where possible."
+            raise BudgetExceededError(f"{name} calls", limit, used, hint)
+
+
+_meter: ContextVar[Meter | None] = ContextVar("halligan_meter", default=None)
+
+
+def current_meter() -> Meter | None:
+    return _meter.get()
+
+
+@contextmanager
+def metering(meter: Meter) -> Iterator[Meter]:
+    """Bind `meter` to the current context (threads need `contextvars.copy_context()` to inherit it)."""
+    token = _meter.set(meter)
+    try:
+        yield meter
+    finally:
+        _meter.reset(token)
+
+
+def record(resource: str, amount: int = 1) -> None:
+    """Report resource usage of a tool, a no-op outside of a metered program."""
+    attribute(resource, amount)
+    meter = _meter.get()
+    if meter is not None:
+        meter.charge(resource, amount)
+
+
+def checkpoint() -> None:
+    """Check cancellation and the deadline of the metered program, if any."""
+    meter = _meter.get()
+    if meter is not None:
+        meter.check()
@@ -0,0 +1,514 @@
+"""
+Static analysis of Stage 3 programs.
+
+`validate_stage3` only checks the JSON shape, and the compiler only rejects what it cannot
+compile. Mistakes such as a typo in a variable name, a method that is not allowed on the
+object it is called on, or a missing tool argument would otherwise surface mid-execution,
+after browser actions and paid vision calls already ran. The checker walks the program once
+without running anything and reports every issue it finds in a single ValidationError,
+which is fed back to the agent.
+
+It also estimates what the program will cost (VLM calls, screenshots, browser actions),
+so that runaway programs (e.g., `ask` per item inside nested loops) are rejected up front.
+"""
+
+from __future__ import annotations
+
+import inspect
+import json
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any
+
+from halligan.runtime.compiler import _ALLOWED_METHODS, _PARALLEL_OPS, _batch_call
+from halligan.runtime.errors import ValidationError
+from halligan.runtime.registry import ToolRegistry
+from halligan.runtime.schemas import Stage3Program, validate_stage3
+
+if TYPE_CHECKING:
+    from halligan.utils.layout import Frame
+
+
+@dataclass(frozen=True)
+class Cost:
+    vlm_calls: int = 0
+    screenshots: int = 0
+    actions: int = 0
+
+    def __add__(self, other: Cost) -> Cost:
+        return Cost(
+            self.vlm_calls + other.vlm_calls,
+            self.screenshots + other.screenshots,
+            self.actions + other.actions,
+        )
+
+    def __sub__(self, other: Cost) -> Cost:
+        return Cost(
+            self.vlm_calls - other.vlm_calls,
+            self.screenshots - other.screenshots,
+            self.actions - other.actions,
+        )
+
+    def __mul__(self, times: int) -> Cost:
+        return Cost(self.vlm_calls * times, self.screenshots * times, self.actions * times)
+
+    def max(self, other: Cost) -> Cost:
+        return Cost(
+            max(self.vlm_calls, other.vlm_calls),
+            max(self.screenshots, other.screenshots),
+            max(self.actions, other.actions),
+        )
+
+
+@dataclass(frozen=True)
+class CostLimits:
+    """Programs estimated above any of these limits are rejected."""
+
+    max_vlm_calls: int = 40
+    max_screenshots: int = 500
+    max_actions: int = 500
+
+
+# Estimated cost of one call, for the tools of `build_default_registry`
+TOOL_COSTS: dict[str, Cost] = {
+    "click": Cost(actions=1),
+    "select": Cost(actions=1),
+    "point": Cost(actions=1),
+    "enter": Cost(actions=2),
+    "draw": Cost(actions=10),
+    "drag": Cost(screenshots=1),
+    "slide_x": Cost(screenshots=12, actions=14),
+    "slide_y": Cost(screenshots=12, actions=14),
+    "get_all_choices": Cost(screenshots=8, actions=8),
+    "explore": Cost(),
+    "ask": Cost(vlm_calls=1),
+    "compare": Cost(vlm_calls=1),
+    "rank": Cost(vlm_calls=3),
+    "mark": Cost(),
+    "focus": Cost(),
+    "match": Cost(),
+}
+
+METHOD_COSTS: dict[str, Cost] = {
+    "refine": Cost(screenshots=10, actions=10),
+    "release": Cost(actions=2),
+    "select": Cost(actions=4),
+    "swap": Cost(actions=2),
+    "drop": Cost(actions=4),
+}
+
+# Iterations assumed for loops over lists whose length is unknown statically
+DEFAULT_ITERATIONS = 10
+
+_ANY = "any"
+_METHODS = set().union(*_ALLOWED_METHODS.values())
+
+
+def _literal_type(value: Any) -> str:
+    if value is None:
+        return "None"
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int"
+    if isinstance(value, float):
+        return "float"
+    if isinstance(value, str):
+        return "str"
+    return _ANY
+
+
+def _is_list(type_: str) -> bool:
+    return type_ == _ANY or type_.startswith("list[")
+
+
+def _element_type(type_: str) -> str:
+    return type_[len("list[") : -1] if type_.startswith("list[") else _ANY
+
+
+def _return_type(fn: Any) -> str:
+    """
+    Type of a tool's result from its return annotation, as a string such as `list[SlideChoice]`.
+    Iterators count as lists, the executor materializes them.
+    """
+    try:
+        annotation = inspect.signature(fn).return_annotation
+    except (TypeError, ValueError):
+        return _ANY
+    if annotation is inspect.Signature.empty:
+        return _ANY
+
+    text = annotation if isinstance(annotation, str) else getattr(annotation, "__name__", _ANY)
+    for prefix in ("list[", "List[", "Iterator["):
+        if text.startswith(prefix) and text.endswith("]"):
+            item = text[len(prefix) : -1].split(".")[-1]
+            return f"list[{item if item.isidentifier() and item not in ('Any', 'object') else _ANY}]"
+    if text in ("list", "List"):
+        return "list[any]"
+    return text if text in ("bool", "int", "float", "str", "None") else _ANY
+
+
+class _Analyzer:
+    def __init__(self, registry: ToolRegistry, frames: list["Frame"] | None) -> None:
+        self.registry = registry
+        self.frames = frames
+        self.issues: list[str] = []
+        self.types: dict[str, str] = {}
+        self.parallel = False
+
+    def issue(self, path: str, message: str) -> None:
+        self.issues.append(f"{path}: {message}")
+
+    def parallel_tools(self) -> list[str]:
+        return [name for name in self.registry.names() if self.registry.get(name).parallel]
+
+    def bind(self, name: str, type_: str) -> None:
+        previous = self.types.get(name)
+        self.types[name] = type_ if previous in (None, type_) else _ANY
+
+    # -----------------------------
+    # Expressions
+    # -----------------------------
+
+    def expr(self, expr: Any, defined: set[str], path: str) -> str:
+        """Check an expression, returns its inferred type."""
+        if expr is None or isinstance(expr, (str, int, float, bool)):
+            return _literal_type(expr)
+
+        if isinstance(expr, list):
+            types = {self.expr(item, defined, f"{path}[{i}]") for i, item in enumerate(expr)}
+            return f"list[{types.pop() if len(types) == 1 else _ANY}]"
+
+        if not isinstance(expr, dict):
+            self.issue(path, f"unsupported expression {expr!r}")
+            return _ANY
+
+        if "var" in expr:
+            name = expr["var"]
+            if not isinstance(name, str):
+                self.issue(path, "var name must be a string")
+            elif name not in defined:
+                self.issue(path, f"variable {name!r} is used before it is defined")
+            return self.types.get(name, _ANY) if isinstance(name, str) else _ANY
+
+        ref, op = expr.get("ref"), expr.get("op")
+        if ref == "frame":
+            self.frame(expr.get("id"), path)
+            return "Frame"
+
+        if ref in ("interactable", "keypoint"):
+            self.frame(expr.get("frame"), path)
+            self.id(expr.get("id"), ref, defined, path)
+            return "Point" if ref == "keypoint" else _ANY
+
+        if ref == "neighbour":
+            point = self.expr(expr.get("point"), defined, f"{path}.point")
+            if point not in (_ANY, "Point"):
+                self.issue(path, f"neighbour.point must be a Point, got {point}")
+            self.id(expr.get("id"), ref, defined, path)
+            return "Point"
+
+        if ref == "attr":
+            self.expr(expr.get("obj"), defined, f"{path}.obj")
+            name = expr.get("name")
+            if not isinstance(name, str) or name.startswith("__"):
+                self.issue(path, "attr.name must be a non-dunder string")
+            return _ANY
+
+        if ref == "index":
+            items = self.expr(expr.get("list"), defined, f"{path}.list")
+            index = self.expr(expr.get("index"), defined, f"{path}.index")
+            if not _is_list(items):
+                self.issue(path, f"index.list must be a list, got {items}")
+            if index not in (_ANY, "int"):
+                self.issue(path, f"index.index must be an int, got {index}")
+            return _element_type(items)
+
+        if op == "map_attr":
+            items = self.expr(expr.get("list"), defined, f"{path}.list")
+            if not _is_list(items):
+                self.issue(path, f"map_attr.list must be a list, got {items}")
+            attr = expr.get("attr")
+            if not isinstance(attr, str) or attr.startswith("__"):
+                self.issue(path, "map_attr.attr must be a non-dunder string")
+            return "list[any]"
+
+        if op == "filter_mask":
+            items = self.expr(expr.get("items"), defined, f"{path}.items")
+            mask = self.expr(expr.get("mask"), defined, f"{path}.mask")
+            if not _is_list(items) or not _is_list(mask):
+                self.issue(path, "filter_mask requires list items and list mask")
+            elif _element_type(mask) not in (_ANY, "bool"):
+                self.issue(path, f"filter_mask mask must contain booleans, got {mask}")
+            return items if items != _ANY else "list[any]"
+
+        if op in ("len", "sum"):
+            value = self.expr(expr.get("value"), defined, f"{path}.value")
+            if not _is_list(value) and not (op == "len" and value == "str"):
+                self.issue(path, f"{op}.value must be a list, got {value}")
+            return "int"
+
+        self.issue(path, f"unsupported expression {expr!r}")
+        return _ANY
+
+    def id(self, value: Any, what: str, defined: set[str], path: str) -> None:
+        if isinstance(value, dict):
+            type_ = self.expr(value, defined, f"{path}.id")
+            if type_ not in (_ANY, "int"):
+                self.issue(path, f"{what} id must be an int, got {type_}")
+        elif not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            self.issue(path, f"{what} id must be a non-negative integer")
+
+    def frame(self, frame_id: Any, path: str) -> None:
+        if not isinstance(frame_id, int) or frame_id < 0:
+            self.issue(path, f"invalid frame id {frame_id!r}")
+        elif self.frames is not None and frame_id >= len(self.frames):
+            self.issue(path, f"frame id {frame_id} does not exist ({len(self.frames)} frames)")
+
+    def args(self, step: dict[str, Any], defined: set[str], path: str) -> dict[str, str]:
+        args = step.get("args", {})
+        if not isinstance(args, dict):
+            self.issue(path, "args must be an object")
+            return {}
+        return {key: self.expr(value, defined, f"{path}.args.{key}") for key, value in args.items()}
+
+    def save_as(self, step: dict[str, Any], defined: set[str], type_: str, path: str) -> None:
+        name = step.get("save_as")
+        if name is None:
+            return
+        if not isinstance(name, str) or not name:
+            self.issue(path, "save_as must be a non-empty string")
+            return
+        defined.add(name)
+        self.bind(name, type_)
+
+    # -----------------------------
+    # Statements
+    # -----------------------------
+
+    def block(self, steps: Any, defined: set[str], path: str, in_loop: bool) -> tuple[set[str], Cost]:
+        """
+        Check a list of steps. Variables count as defined after a step if they are
+        defined on at least one path through it, so only names that can never be set are reported.
+        """
+        if not isinstance(steps, list):
+            self.issue(path, "must be a list of steps")
+            return defined, Cost()
+
+        cost = Cost()
+        for i, step in enumerate(steps):
+            defined, step_cost = self.step(step, defined, f"{path}[{i}]", in_loop)
+            cost += step_cost
+        return defined, cost
+
+    def step(self, step: Any, defined: set[str], path: str, in_loop: bool) -> tuple[set[str], Cost]:
+        if not isinstance(step, dict):
+            self.issue(path, "step must be an object")
+            return defined, Cost()
+
+        defined = set(defined)
+        op = step.get("op")
+
+        if self.parallel and op not in _PARALLEL_OPS:
+            self.issue(
+                path, f"pforeach.do cannot contain {op!r} steps, only calls of {', '.join(self.parallel_tools())}"
+            )
+            return defined, Cost()
+
+        if op == "call":
+            tool = step.get("tool")
+            args = self.args(step, defined, path)
+            spec = self.registry.get(tool) if isinstance(tool, str) else None
+            if spec is None:
+                self.issue(path, f"tool {tool!r} is not allowed (available: {', '.join(self.registry.names())})")
+                self.save_as(step, defined, _ANY, path)
+                return defined, Cost()
+            if self.parallel and not spec.parallel:
+                self.issue(path, f"pforeach.do cannot call {tool}, only {', '.join(self.parallel_tools())}")
+
+            try:
+                inspect.signature(spec.fn).bind(**args)
+            except TypeError as exc:
+                self.issue(path, f"invalid arguments for {tool}: {exc}")
+            except ValueError:
+                pass
+
+            self.save_as(step, defined, _return_type(spec.fn), path)
+            return defined, TOOL_COSTS.get(tool, Cost())
+
+        if op == "call_method":
+            target = self.expr(step.get("target"), defined, f"{path}.target")
+            method = step.get("method")
+            self.args(step, defined, path)
+            if not isinstance(method, str) or not method:
+                self.issue(path, "method must be a non-empty string")
+                return defined, Cost()
+
+            allowed = _ALLOWED_METHODS.get(target) if target != _ANY else _METHODS
+            if allowed is None:
+                self.issue(path, f"methods cannot be called on {target}")
+            elif method not in allowed:
+                self.issue(path, f"method {method!r} is not allowed on {target if target != _ANY else 'any object'}")
+
+            self.save_as(step, defined, _ANY, path)
+            return defined, METHOD_COSTS.get(method, Cost())
+
+        if op == "assign":
+            name = step.get("var")
+            value = self.expr(step.get("value"), defined, f"{path}.value")
+            if not isinstance(name, str) or not name:
+                self.issue(path, "assign.var must be a non-empty string")
+            else:
+                defined.add(name)
+                self.bind(name, value)
+            return defined, Cost()
+
+        if op == "foreach":
+            name = step.get("var")
+            items = step.get("in")
+            items_type = self.expr(items, defined, f"{path}.in")
+            if not _is_list(items_type):
+                self.issue(path, f"foreach.in must be a list, got {items_type}")
+            if not isinstance(name, str) or not name:
+                self.issue(path, "foreach.var must be a non-empty string")
+                name = None
+            else:
+                self.bind(name, _element_type(items_type))
+
+            body = step.get("do", [])
+            body_defined, body_cost = self.block(
+                body, defined | ({name} if name else set()), f"{path}.do", in_loop=True
+            )
+            iterations = len(items) if isinstance(items, list) else DEFAULT_ITERATIONS
+
+            # The executor merges loops of per-item vision calls into one call (see `compiler._batch_call`)
+            spec = _batch_call(name, body, self.registry) if name and isinstance(body, list) else None
+            if spec is not None and iterations > 1:
+                once = TOOL_COSTS.get(spec.name, Cost())
+                return defined | body_defined, once + (body_cost - once) * iterations
+            return defined | body_defined, body_cost * iterations
+
+        if op == "pforeach":
+            name = step.get("var")
+            items = step.get("in")
+            items_type = self.expr(items, defined, f"{path}.in")
+            if not _is_list(items_type):
+                self.issue(path, f"pforeach.in must be a list, got {items_type}")
+            if not isinstance(name, str) or not name:
+                self.issue(path, "pforeach.var must be a non-empty string")
+                name = None
+            else:
+                self.bind(name, _element_type(items_type))
+            max_workers = step.get("max_workers", 1)
+            if not isinstance(max_workers, int) or isinstance(max_workers, bool) or max_workers < 1:
+                self.issue(path, "pforeach.max_workers must be a positive integer")
+
+            # Variables of the body stay local to each iteration, only `collect` comes out (as a list)
+            body_scope = defined | ({name} if name else set())
+            self.parallel, parallel = True, self.parallel
+            try:
+                body_defined, body_cost = self.block(step.get("do", []), body_scope, f"{path}.do", in_loop=False)
+            finally:
+                self.parallel = parallel
+            collected = self.expr(step["collect"], body_defined, f"{path}.collect") if "collect" in step else "None"
+            self.save_as(step, defined, f"list[{collected}]", path)
+
+            iterations = len(items) if isinstance(items, list) else DEFAULT_ITERATIONS
+            return defined, body_cost * iterations
+
+        if op == "if":
+            self.expr(step.get("cond"), defined, f"{path}.cond")
+            then_defined, then_cost = self.block(step.get("then", []), defined, f"{path}.then", in_loop)
+            else_defined, else_cost = self.block(step.get("else", []), defined, f"{path}.else", in_loop)
+            return then_defined | else_defined, then_cost.max(else_cost)
+
+        if op == "break":
+            if not in_loop:
+                self.issue(path, "break outside of foreach")
+            return defined, Cost()
+
+        self.issue(path, f"unknown op {op!r}")
+        return defined, Cost()
+
+
+def estimate_stage3_cost(
+    program: Stage3Program,
+    *,
+    registry: ToolRegistry,
+    frames: list["Frame"] | None = None,
+) -> tuple[Cost, list[str]]:
+    """
+    Statically check a program without running it.
+
+    Returns:
+        cost (Cost): estimated VLM calls, screenshots and browser actions (loops over
+            non-literal lists count as DEFAULT_ITERATIONS iterations)
+        issues (list[str]): problems found, prefixed with the JSON path of the step
+    """
+    analyzer = _Analyzer(registry, frames)
+    _, cost = analyzer.block(program.steps, set(), "$.steps", in_loop=False)
+    return cost, analyzer.issues
+
+
+def analyze_stage3_program(
+    program: Stage3Program,
+    *,
+    registry: ToolRegistry,
+    frames: list["Frame"] | None = None,
+    limits: CostLimits = CostLimits(),
+) -> Cost:
+    """
+    Reject a program with static issues or an estimated cost over `limits` (ValidationError).
+    Returns the estimated cost.
+    """
+    cost, issues = estimate_stage3_cost(program, registry=registry, frames=frames)
+
+    for estimate, limit, label in (
+        (cost.vlm_calls, limits.max_vlm_calls, "VLM calls"),
+        (cost.screenshots, limits.max_screenshots, "screenshots"),
+        (cost.actions, limits.max_actions, "browser actions"),
+    ):
+        if estimate > limit:
+            issues.append(
+                f"$: estimated {estimate} {label} exceeds the limit of {limit}, "
+                "batch images into a single call instead of calling tools per item in loops"
+            )
+
+    if issues:
+        raise ValidationError("Stage 3 program failed static analysis:\n" + "\n".join(f"- {i}" for i in issues))
+
+    return cost
+
+
+def rank_stage3_programs(
+    candidates: list[Any],
+    *,
+    registry: ToolRegistry,
+    frames: list["Frame"] | None = None,
+    limits: CostLimits = CostLimits(),
+) -> list[tuple[Stage3Program, Cost]]:
+    """
+    Validate and analyze candidate programs (JSON), keeping the valid ones in the order given
+    (the model's, most likely to succeed first). Static analysis only filters: programs with
+    issues or an estimated cost over `limits` are dropped, and so are duplicates.
+    Raises ValidationError with the issues of every candidate if none is valid.
+    """
+    ranked: list[tuple[Stage3Program, Cost]] = []
+    issues: list[str] = []
+    seen: set[str] = set()
+    for i, data in enumerate(candidates):
+        try:
+            program = validate_stage3(data)
+            cost = analyze_stage3_program(program, registry=registry, frames=frames, limits=limits)
+        except ValidationError as exc:
+            issues.append(f"candidate {i}: {exc}")
+            continue
+
+        key = json.dumps(program.steps, sort_keys=True, default=str)
+        if key not in seen:
+            seen.add(key)
+            ranked.append((program, cost))
+
+    if not ranked:
+        raise ValidationError("No valid candidate program:\n" + "\n".join(issues))
+
+    return ranked
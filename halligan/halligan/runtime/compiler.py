@@ -0,0 +1,702 @@
+"""
+Compile Stage 3 programs into closures.
+
+Interpreting the JSON program dispatches on raw dicts for every step and expression,
+re-validates names and types, and looks tools up again on every `foreach` iteration.
+Compiling does all of that once: tools are bound, variables are assigned slots in a
+list, and every step or expression becomes a closure over its compiled children.
+Checks that depend on runtime values (list types, method allowlists on the actual
+target, undefined variables on untaken branches) stay in the closures.
+
+`pforeach` runs its body for every item concurrently. The body may only call tools
+registered as `parallel` (side-effect free vision tools), assign and branch, and every
+iteration works on its own copy of the environment: only the collected results are kept.
+
+A `foreach` whose only effect is calling a batchable tool (see `ToolSpec.batch_arg`) on each
+item, e.g. `ask(images=[choice.image], ...)` followed by assignments, is rewritten into one
+call over all items. The results are scattered back, each iteration sees what the per-item call
+would have returned, and the rest of the body runs as before. Loops that act on the page, call
+other tools or `break` are not batched: they must not see results, or spend calls, ahead of time.
+Calls saved are tallied on the meter.
+"""
+
+from __future__ import annotations
+
+import logging
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Callable
+
+from halligan.runtime.accounting import checkpoint, current_meter
+from halligan.runtime.errors import BudgetExceededError, ExecutionCancelledError, ToolError
+from halligan.runtime.profiler import count_images, current_profile
+from halligan.runtime.registry import ToolRegistry, ToolSpec
+from halligan.runtime.schemas import Stage3Program
+
+if TYPE_CHECKING:
+    from halligan.utils.layout import Frame
+
+logger = logging.getLogger(__name__)
+
+Env = list[Any]
+Expr = Callable[[Env], Any]
+Block = Callable[[Env], None]
+
+
+class _Unset:
+    def __repr__(self) -> str:
+        return "<unset>"
+
+
+_UNSET = _Unset()
+
+
+class _Break(Exception):
+    pass
+
+
+_ALLOWED_METHODS: dict[str, set[str]] = {
+    # Layout / selection helpers
+    "Frame": {"show_keypoints", "get_keypoint", "get_interactable"},
+    "Point": {"show_neighbours", "get_neighbour"},
+    # Action choice objects
+    "SelectChoice": {"select"},
+    "SlideChoice": {"refine", "release"},
+    "SwapChoice": {"swap"},
+    "DragChoice": {"drop"},
+    "Choice": {"release"},
+}
+
+
+# Concurrency of `pforeach`, programs may ask for less with `max_workers`
+PFOREACH_WORKERS = 4
+PFOREACH_MAX_WORKERS = 8
+
+# Steps allowed in a `pforeach` body (calls are further restricted to parallel tools)
+_PARALLEL_OPS = {"call", "assign", "if"}
+
+
+def _vars_in(expr: Any) -> set[str]:
+    """Names of the variables an expression reads."""
+    if isinstance(expr, list):
+        return set().union(*(_vars_in(x) for x in expr))
+    if isinstance(expr, dict):
+        if isinstance(expr.get("var"), str):
+            return {expr["var"]}
+        return set().union(*(_vars_in(x) for x in expr.values()))
+    return set()
+
+
+def _assigned_in(steps: Any) -> set[str]:
+    """Names of the variables a list of steps may assign, including nested blocks."""
+    names: set[str] = set()
+    if not isinstance(steps, list):
+        return names
+    for step in steps:
+        if not isinstance(step, dict):
+            continue
+        for key in ("save_as", "var"):
+            if isinstance(step.get(key), str):
+                names.add(step[key])
+        for key in ("do", "then", "else"):
+            names |= _assigned_in(step.get(key))
+    return names
+
+
+def _only_assigns(steps: Any) -> bool:
+    """Whether `steps` only assign and branch: no calls, methods, loops or `break`."""
+    if not isinstance(steps, list):
+        return steps is None
+    return all(
+        isinstance(step, dict)
+        and step.get("op") in {"assign", "if"}
+        and _only_assigns(step.get("then"))
+        and _only_assigns(step.get("else"))
+        for step in steps
+    )
+
+
+def _batch_call(var: str, body: list[Any], registry: ToolRegistry) -> ToolSpec | None:
+    """
+    The tool of a `foreach` body that can be batched, if any: the body's only effect is one
+    call per item of a batchable, side-effect free tool. It starts with that call, on a single
+    item that depends on the loop variable only, with other arguments that do not change between
+    iterations, and the rest of the body only assigns and branches. Anything else (browser
+    actions, methods, other calls, `break`) must see the results one item at a time.
+    """
+    if not body or not isinstance(body[0], dict) or body[0].get("op") != "call":
+        return None
+    tool = body[0].get("tool")
+    spec = registry.get(tool) if isinstance(tool, str) else None
+    args = body[0].get("args", {})
+    if spec is None or spec.batch_arg is None or not spec.parallel or not isinstance(args, dict):
+        return None
+    if not _only_assigns(body[1:]):
+        return None
+
+    items = args.get(spec.batch_arg)
+    if not isinstance(items, list) or len(items) != 1:
+        return None
+
+    assigned = _assigned_in(body)
+    if _vars_in(items) & (assigned - {var}):
+        return None
+    if any(_vars_in(value) & (assigned | {var}) for key, value in args.items() if key != spec.batch_arg):
+        return None
+    return spec
+
+
+def _class_name(obj: Any) -> str:
+    return obj.__class__.__name__
+
+
+def _ensure_allowed_method(obj: Any, method: str) -> None:
+    cls = _class_name(obj)
+    allowed = _ALLOWED_METHODS.get(cls, set())
+    if method not in allowed:
+        raise ToolError(f"Method not allowed: {cls}.{method}")
+
+
+# Tool results that cannot hold images
+_SCALARS = (type(None), bool, int, float, str)
+
+
+def _collect(fn: Callable[..., Any], kwargs: dict[str, Any]) -> Any:
+    result = fn(**kwargs)
+    # Tools may stream results lazily (e.g., explore); the DSL indexes and re-iterates lists.
+    if isinstance(result, Iterator):
+        result = list(result)
+    if not isinstance(result, _SCALARS):
+        count_images(result)
+    return result
+
+
+def _invoke(name: str, fn: Callable[..., Any], kwargs: dict[str, Any]) -> Any:
+    """Call a tool or method, in its span when a profile is bound (see `profiler`)."""
+    profile = current_profile()
+    if profile is None:
+        return _collect(fn, kwargs)
+    return profile.call("tool", name, _collect, fn, kwargs)
+
+
+def _profiled(path: str, step: Block) -> Block:
+    """Time `step` under its JSON path when a profile is bound (see `profiler`)."""
+
+    def profiled(env: Env) -> None:
+        profile = current_profile()
+        if profile is None:
+            step(env)
+        else:
+            profile.call("step", path, step, env)
+
+    return profiled
+
+
+@dataclass(frozen=True)
+class CompiledProgram:
+    """
+    A Stage 3 program compiled against a registry and frames.
+    `slots` maps variable names to their index in the environment list.
+    """
+
+    body: Block
+    slots: dict[str, int]
+
+    def run(self) -> dict[str, Any]:
+        """Execute the program, returns the variables it defined."""
+        env: Env = [_UNSET] * len(self.slots)
+        # Tool calls and loop iterations check the meter themselves, the steps in between are cheap
+        checkpoint()
+        self.body(env)
+        return {name: env[slot] for name, slot in self.slots.items() if env[slot] is not _UNSET}
+
+
+class _Compiler:
+    def __init__(self, registry: ToolRegistry, frames: list["Frame"], profiled: bool) -> None:
+        self.registry = registry
+        self.frames = frames
+        self.profiled = profiled
+        self.slots: dict[str, int] = {}
+
+    def slot(self, name: str) -> int:
+        return self.slots.setdefault(name, len(self.slots))
+
+    def frame(self, frame_id: Any) -> "Frame":
+        if not isinstance(frame_id, int) or not (0 <= frame_id < len(self.frames)):
+            raise ToolError(f"Invalid frame id: {frame_id}")
+        return self.frames[frame_id]
+
+    def id(self, value: Any, what: str) -> Expr:
+        """
+        Ids are literal integers, or expressions such as an index into an `ask` answer
+        (e.g., the keypoint picked by the agent), checked when evaluated.
+        """
+        if isinstance(value, dict):
+            expr = self.expr(value)
+
+            def id_(env: Env) -> int:
+                result = expr(env)
+                if not isinstance(result, int) or isinstance(result, bool) or result < 0:
+                    raise ToolError(f"Invalid {what} id: {result!r}")
+                return result
+
+            return id_
+
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            raise ToolError(f"Invalid {what} id: {value}")
+        return lambda env: value
+
+    # -----------------------------
+    # Expressions
+    # -----------------------------
+
+    def expr(self, expr: Any) -> Expr:
+        """
+        Compile an expression, see `executor._eval_expr` for the supported forms.
+        """
+        if expr is None or isinstance(expr, (str, int, float, bool)):
+            return lambda env: expr
+
+        if isinstance(expr, list):
+            items = [self.expr(x) for x in expr]
+            return lambda env: [item(env) for item in items]
+
+        if isinstance(expr, dict):
+            if "var" in expr:
+                return self.var(expr["var"])
+
+            ref = expr.get("ref")
+            if ref is not None:
+                return self.ref(ref, expr)
+
+            op = expr.get("op")
+            if op is not None:
+                return self.op(op, expr)
+
+        raise ToolError(f"Unsupported expression: {expr}")
+
+    def var(self, name: Any) -> Expr:
+        if not isinstance(name, str):
+            raise ToolError("Expression var name must be string")
+        slot = self.slot(name)
+
+        def var(env: Env) -> Any:
+            value = env[slot]
+            if value is _UNSET:
+                raise ToolError(f"Undefined variable: {name}")
+            return value
+
+        return var
+
+    def ref(self, ref: Any, expr: dict[str, Any]) -> Expr:
+        if ref == "frame":
+            frame = self.frame(expr.get("id"))
+            return lambda env: frame
+
+        if ref == "interactable":
+            frame = self.frame(expr.get("frame"))
+            interactable_id = self.id(expr.get("id"), "interactable")
+            return lambda env: frame.get_interactable(interactable_id(env))
+
+        if ref == "keypoint":
+            frame = self.frame(expr.get("frame"))
+            keypoint_id = self.id(expr.get("id"), "keypoint")
+            return lambda env: frame.get_keypoint(keypoint_id(env))
+
+        if ref == "neighbour":
+            point = self.expr(expr.get("point"))
+            neighbour_id = self.id(expr.get("id"), "neighbour")
+
+            def neighbour(env: Env) -> Any:
+                value = point(env)
+                if not hasattr(value, "get_neighbour"):
+                    raise ToolError("neighbour.point must evaluate to a Point-like object with get_neighbour()")
+                return value.get_neighbour(neighbour_id(env))
+
+            return neighbour
+
+        if ref == "attr":
+            obj = self.expr(expr.get("obj"))
+            name = expr.get("name")
+            if not isinstance(name, str):
+                raise ToolError("attr.name must be string")
+            if name.startswith("__"):
+                raise ToolError("Dunder attribute access is not allowed")
+            return lambda env: getattr(obj(env), name)
+
+        if ref == "index":
+            items = self.expr(expr.get("list"))
+            index = self.expr(expr.get("index"))
+
+            def indexed(env: Env) -> Any:
+                lst = items(env)
+                idx = index(env)
+                if not isinstance(idx, int):
+                    raise ToolError("index.index must evaluate to int")
+                return lst[idx]
+
+            return indexed
+
+        raise ToolError(f"Unsupported expression: {expr}")
+
+    def op(self, op: Any, expr: dict[str, Any]) -> Expr:
+        if op == "map_attr":
+            items = self.expr(expr.get("list"))
+            attr = expr.get("attr")
+            if not isinstance(attr, str) or attr.startswith("__"):
+                raise ToolError("map_attr.attr must be a non-dunder string")
+            return lambda env: [getattr(item, attr) for item in items(env)]
+
+        if op == "filter_mask":
+            items_expr = self.expr(expr.get("items"))
+            mask_expr = self.expr(expr.get("mask"))
+
+            def filter_mask(env: Env) -> list[Any]:
+                items = items_expr(env)
+                mask = mask_expr(env)
+                if not isinstance(items, list) or not isinstance(mask, list):
+                    raise ToolError("filter_mask requires list items and list mask")
+                if len(items) != len(mask):
+                    raise ToolError("filter_mask items and mask must be same length")
+                out: list[Any] = []
+                for item, flag in zip(items, mask):
+                    if not isinstance(flag, bool):
+                        raise ToolError("filter_mask mask must contain booleans")
+                    if flag:
+                        out.append(item)
+                return out
+
+            return filter_mask
+
+        if op == "len":
+            value = self.expr(expr.get("value"))
+            return lambda env: len(value(env))
+
+        if op == "sum":
+            value = self.expr(expr.get("value"))
+            return lambda env: sum(value(env))
+
+        raise ToolError(f"Unsupported expression: {expr}")
+
+    def args(self, args_obj: Any, op: str) -> Callable[[Env], dict[str, Any]]:
+        if not isinstance(args_obj, dict):
+            raise ToolError(f"{op}.args must be object")
+        args = [(key, self.expr(value)) for key, value in args_obj.items()]
+        return lambda env: {key: value(env) for key, value in args}
+
+    def save_as(self, step: dict[str, Any], op: str) -> int | None:
+        save_as = step.get("save_as")
+        if save_as is None:
+            return None
+        if not isinstance(save_as, str) or not save_as:
+            raise ToolError(f"{op}.save_as must be non-empty string")
+        return self.slot(save_as)
+
+    # -----------------------------
+    # Statements
+    # -----------------------------
+
+    def block(self, steps: list[Any], path: str, start: int = 0) -> Block:
+        """Compile `steps`, `path` is their JSON path in the program (for errors and the profile)."""
+        compiled = tuple(self.step(step, f"{path}[{i}]") for i, step in enumerate(steps, start))
+        if self.profiled:
+            compiled = tuple(_profiled(f"{path}[{i}]", step) for i, step in enumerate(compiled, start))
+        if len(compiled) == 1:
+            return compiled[0]
+
+        def block(env: Env) -> None:
+            for step in compiled:
+                step(env)
+
+        return block
+
+    def step(self, step: Any, path: str) -> Block:
+        if not isinstance(step, dict):
+            raise ToolError(f"Step must be an object ({path})")
+
+        op = step.get("op")
+        if op == "call":
+            return self.call(step)
+        if op == "call_method":
+            return self.call_method(step)
+        if op == "assign":
+            return self.assign(step)
+        if op == "foreach":
+            return self.foreach(step, path)
+        if op == "pforeach":
+            return self.pforeach(step, path)
+        if op == "if":
+            return self.if_(step, path)
+        if op == "break":
+            return self.break_(step)
+
+        raise ToolError(f"Unknown step op: {op!r} ({path})")
+
+    def call(self, step: dict[str, Any]) -> Block:
+        tool_name = step.get("tool")
+        if not isinstance(tool_name, str):
+            raise ToolError("call.tool must be string")
+        spec = self.registry.get(tool_name)
+        if not spec:
+            raise ToolError(f"Tool not allowed: {tool_name}")
+
+        fn = spec.fn
+        args = self.args(step.get("args", {}), "call")
+        slot = self.save_as(step, "call")
+
+        def call(env: Env) -> None:
+            kwargs = args(env)
+            meter = current_meter()
+            if meter is not None:
+                meter.charge_tool(tool_name)
+            try:
+                result = _invoke(tool_name, fn, kwargs)
+            except (BudgetExceededError, ExecutionCancelledError):
+                raise
+            except Exception as exc:
+                raise ToolError(f"Tool call failed: {tool_name}: {exc}") from exc
+
+            if slot is not None:
+                env[slot] = result
+
+        return call
+
+    def call_method(self, step: dict[str, Any]) -> Block:
+        target = self.expr(step.get("target"))
+        method = step.get("method")
+        if not isinstance(method, str) or not method:
+            raise ToolError("call_method.method must be string")
+        args = self.args(step.get("args", {}), "call_method")
+        slot = self.save_as(step, "call_method")
+
+        def call_method(env: Env) -> None:
+            obj = target(env)
+            _ensure_allowed_method(obj, method)
+            fn = getattr(obj, method)
+            kwargs = args(env)
+            try:
+                result = _invoke(f"{_class_name(obj)}.{method}", fn, kwargs)
+            except (BudgetExceededError, ExecutionCancelledError):
+                raise
+            except Exception as exc:
+                raise ToolError(f"Method call failed: {_class_name(obj)}.{method}: {exc}") from exc
+
+            if slot is not None:
+                env[slot] = result
+
+        return call_method
+
+    def assign(self, step: dict[str, Any]) -> Block:
+        name = step.get("var")
+        if not isinstance(name, str) or not name:
+            raise ToolError("assign.var must be non-empty string")
+        value = self.expr(step.get("value"))
+        slot = self.slot(name)
+
+        def assign(env: Env) -> None:
+            env[slot] = value(env)
+
+        return assign
+
+    def foreach(self, step: dict[str, Any], path: str) -> Block:
+        var = step.get("var")
+        if not isinstance(var, str) or not var:
+            raise ToolError("foreach.var must be non-empty string")
+        items = self.expr(step.get("in"))
+        body_steps = step.get("do", [])
+        if not isinstance(body_steps, list):
+            raise ToolError("foreach.do must be a list of steps")
+        slot = self.slot(var)
+        body = self.block(body_steps, f"{path}.do")
+        batch = self.batch(var, slot, body_steps)
+        rest = self.block(body_steps[1:], f"{path}.do", start=1) if batch is not None else body
+
+        def foreach(env: Env) -> None:
+            iterable = items(env)
+            if not isinstance(iterable, list):
+                raise ToolError("foreach.in must evaluate to a list")
+            meter = current_meter()
+            scatter = batch(env, iterable) if batch is not None and len(iterable) > 1 else None
+            try:
+                for i, item in enumerate(iterable):
+                    if meter is not None:
+                        meter.charge("loop_iterations")
+                    env[slot] = item
+                    if scatter is None:
+                        body(env)
+                        continue
+                    scatter(env, i)
+                    rest(env)
+            except _Break:
+                pass
+
+        return foreach
+
+    def batch(
+        self, var: str, var_slot: int, body_steps: list[Any]
+    ) -> Callable[[Env, list[Any]], Callable[[Env, int], None] | None] | None:
+        """
+        Compile the batched form of the first step of a `foreach` body (see `_batch_call`).
+        At runtime it makes one call over all items and returns a function that stores the
+        result of item i, or None to fall back to per-item calls.
+
+        A batched call whose result does not have one entry per item is discarded, but it is
+        still charged (tool call, and the VLM calls it made): the cost was paid. The fallback
+        is logged and tallied as `batch_fallback:<tool>` on the meter.
+        """
+        spec = _batch_call(var, body_steps, self.registry)
+        if spec is None:
+            return None
+
+        step = body_steps[0]
+        fn, tool_name, batch_arg = spec.fn, spec.name, spec.batch_arg
+        item = self.expr(step["args"][batch_arg][0])
+        args = self.args({k: v for k, v in step["args"].items() if k != batch_arg}, "call")
+        slot = self.save_as(step, "call")
+
+        def batch(env: Env, iterable: list[Any]) -> Callable[[Env, int], None] | None:
+            scratch = list(env)
+            try:
+                batched = []
+                for value in iterable:
+                    scratch[var_slot] = value
+                    batched.append(item(scratch))
+                kwargs = args(env)
+            except Exception:
+                return None
+
+            meter = current_meter()
+            if meter is not None:
+                meter.charge_tool(tool_name)
+            try:
+                result = _invoke(tool_name, fn, {**kwargs, batch_arg: batched})
+            except (BudgetExceededError, ExecutionCancelledError):
+                raise
+            except Exception as exc:
+                raise ToolError(f"Tool call failed: {tool_name}: {exc}") from exc
+
+            # The tool must answer per item, anything else cannot be scattered back
+            if not isinstance(result, list) or len(result) != len(batched):
+                got = len(result) if isinstance(result, list) else type(result).__name__
+                logger.warning(f"Batched {tool_name} returned {got} results for {len(batched)} items, calling per item")
+                if meter is not None:
+                    meter.tally(f"batch_fallback:{tool_name}")
+                return None
+            if meter is not None:
+                meter.tally(f"batched:{tool_name}", len(batched) - 1)
+
+            def scatter(env: Env, i: int) -> None:
+                if slot is not None:
+                    env[slot] = [result[i]]
+
+            return scatter
+
+        return batch
+
+    def parallel_body(self, steps: list[Any]) -> None:
+        """Reject steps that must not run concurrently (browser actions, methods, break)."""
+        for step in steps:
+            if not isinstance(step, dict):
+                continue
+            op = step.get("op")
+            if op not in _PARALLEL_OPS:
+                raise ToolError(f"pforeach.do cannot contain {op!r} steps")
+            if op == "call":
+                spec = self.registry.get(step.get("tool"))
+                if spec is not None and not spec.parallel:
+                    raise ToolError(f"pforeach.do cannot call {spec.name}, it is not a parallel tool")
+            if op == "if":
+                self.parallel_body(step.get("then", []))
+                self.parallel_body(step.get("else", []))
+
+    def pforeach(self, step: dict[str, Any], path: str) -> Block:
+        var = step.get("var")
+        if not isinstance(var, str) or not var:
+            raise ToolError("pforeach.var must be non-empty string")
+        items = self.expr(step.get("in"))
+        body_steps = step.get("do", [])
+        if not isinstance(body_steps, list):
+            raise ToolError("pforeach.do must be a list of steps")
+        max_workers = step.get("max_workers", PFOREACH_WORKERS)
+        if not isinstance(max_workers, int) or isinstance(max_workers, bool) or max_workers < 1:
+            raise ToolError("pforeach.max_workers must be a positive integer")
+        max_workers = min(max_workers, PFOREACH_MAX_WORKERS)
+
+        self.parallel_body(body_steps)
+        var_slot = self.slot(var)
+        body = self.block(body_steps, f"{path}.do")
+        collect = self.expr(step["collect"]) if "collect" in step else None
+        slot = self.save_as(step, "pforeach")
+
+        def iteration(env: Env, item: Any) -> Any:
+            env = list(env)
+            env[var_slot] = item
+            body(env)
+            return collect(env) if collect is not None else None
+
+        def pforeach(env: Env) -> None:
+            iterable = items(env)
+            if not isinstance(iterable, list):
+                raise ToolError("pforeach.in must evaluate to a list")
+            meter = current_meter()
+            if meter is not None:
+                meter.charge("loop_iterations", len(iterable))
+
+            if len(iterable) <= 1:
+                results = [iteration(env, item) for item in iterable]
+            else:
+                # Threads run in a copy of the caller's context, so budgets still apply
+                with ThreadPoolExecutor(max_workers=min(max_workers, len(iterable))) as pool:
+                    futures = [pool.submit(copy_context().run, iteration, env, item) for item in iterable]
+                    try:
+                        results = [future.result() for future in futures]
+                    finally:
+                        for future in futures:
+                            future.cancel()
+
+            if slot is not None:
+                env[slot] = results
+
+        return pforeach
+
+    def if_(self, step: dict[str, Any], path: str) -> Block:
+        cond = self.expr(step.get("cond"))
+        then_steps = step.get("then", [])
+        else_steps = step.get("else", [])
+        if not isinstance(then_steps, list) or not isinstance(else_steps, list):
+            raise ToolError("if.then/if.else must be list of steps")
+        then_block = self.block(then_steps, f"{path}.then")
+        else_block = self.block(else_steps, f"{path}.else")
+
+        def if_(env: Env) -> None:
+            if cond(env):
+                then_block(env)
+            else:
+                else_block(env)
+
+        return if_
+
+    def break_(self, step: dict[str, Any]) -> Block:
+        def break_(env: Env) -> None:
+            raise _Break()
+
+        return break_
+
+
+def compile_stage3_program(
+    program: Stage3Program,
+    *,
+    registry: ToolRegistry,
+    frames: list["Frame"],
+    profiled: bool = False,
+) -> CompiledProgram:
+    """
+    Compile a validated Stage 3 program. Malformed steps, unknown tools and invalid
+    frame references raise ToolError here, before any step is executed.
+    With `profiled`, steps are timed when run under `profiler.profiling` (tool calls always are).
+    """
+    compiler = _Compiler(registry, frames, profiled)
+    body = compiler.block(program.steps, "$.steps")
+    return CompiledProgram(body=body, slots=dict(compiler.slots))
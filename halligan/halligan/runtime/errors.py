@@ -23,3 +23,19 @@ class UnsafeTargetError(HalliganError):
 
 class ToolError(HalliganError):
     """Raised when a tool invocation fails or is invalid."""
+
+
+class BudgetExceededError(ToolError):
+    """Raised when a Stage 3 program runs over one of its execution budgets."""
+
+    def __init__(self, resource: str, limit: float, used: float, hint: str = "") -> None:
+        self.resource = resource
+        self.limit = limit
+        self.used = used
+        self.hint = hint
+        message = f"Budget exceeded: {resource} used {used:g} of {limit:g}"
+        super().__init__(f"{message}. {hint}" if hint else message)
+
+
+class ExecutionCancelledError(ToolError):
+    """Raised at the next tool call or loop iteration after a running Stage 3 program was cancelled."""
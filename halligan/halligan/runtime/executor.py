@@ -1,8 +1,12 @@
 from __future__ import annotations
 
+from collections.abc import Iterator
 from typing import TYPE_CHECKING, Any
 
+from halligan.runtime.accounting import Budgets, Meter, metering
+from halligan.runtime.compiler import _Break, _class_name, _ensure_allowed_method, compile_stage3_program
 from halligan.runtime.errors import ToolError, ValidationError
+from halligan.runtime.profiler import Profile, profiling
 from halligan.runtime.registry import ToolRegistry
 from halligan.runtime.schemas import Stage2Plan, Stage3Program
 
@@ -85,34 +89,6 @@ def apply_stage2_plan(frames: list["Frame"], plan: Stage2Plan) -> None:
         raise ValidationError("Stage 2 must have at most one NEXT interactable")
 
 
-class _Break(Exception):
-    pass
-
-
-_ALLOWED_METHODS: dict[str, set[str]] = {
-    # Layout / selection helpers
-    "Frame": {"show_keypoints", "get_keypoint", "get_interactable"},
-    "Point": {"show_neighbours", "get_neighbour"},
-    # Action choice objects
-    "SelectChoice": {"select"},
-    "SlideChoice": {"refine", "release"},
-    "SwapChoice": {"swap"},
-    "DragChoice": {"drop"},
-    "Choice": {"release"},
-}
-
-
-def _class_name(obj: Any) -> str:
-    return obj.__class__.__name__
-
-
-def _ensure_allowed_method(obj: Any, method: str) -> None:
-    cls = _class_name(obj)
-    allowed = _ALLOWED_METHODS.get(cls, set())
-    if method not in allowed:
-        raise ToolError(f"Method not allowed: {cls}.{method}")
-
-
 def _eval_expr(expr: Any, *, env: dict[str, Any], frames: list["Frame"]) -> Any:
     """
     Evaluate an expression used by the Stage 3 restricted DSL.
@@ -236,9 +212,35 @@ def execute_stage3_program(
     program: Stage3Program,
     *,
     registry: ToolRegistry,
-) -> None:
+    budgets: Budgets | None = None,
+    meter: Meter | None = None,
+    profile: Profile | None = None,
+    profile_steps: bool = False,
+) -> Profile:
     """
     Execute the Stage 3 restricted program.
+    The program is compiled first (see `compiler`), so malformed steps fail before any tool runs.
+    It runs under `budgets` (see `accounting`), pass a `meter` to inspect usage or cancel it from another thread.
+    Returns the per-tool profile of the run (see `profiler`), pass `profile` to keep it on errors.
+    Steps are only profiled with `profile_steps`, a span per step costs more than most steps do.
+    """
+    compiled = compile_stage3_program(program, registry=registry, frames=frames, profiled=profile_steps)
+    meter = meter or Meter(budgets or Budgets())
+    profile = profile or Profile()
+    with metering(meter), profiling(profile):
+        compiled.run()
+    return profile
+
+
+def _interpret_stage3_program(
+    frames: list["Frame"],
+    program: Stage3Program,
+    *,
+    registry: ToolRegistry,
+) -> None:
+    """
+    Reference interpreter of Stage 3 programs, evaluating raw steps as they are reached.
+    Kept to check the compiler against (tests, bench_stage3.py).
     """
     env: dict[str, Any] = {}
 
@@ -260,6 +262,9 @@ def execute_stage3_program(
                 args: dict[str, Any] = {k: _eval_expr(v, env=env, frames=frames) for k, v in args_obj.items()}
                 try:
                     result = spec.fn(**args)
+                    # Tools may stream results lazily (e.g., explore); the DSL indexes and re-iterates lists.
+                    if isinstance(result, Iterator):
+                        result = list(result)
                 except Exception as exc:
                     raise ToolError(f"Tool call failed: {tool_name}: {exc}") from exc
 
@@ -0,0 +1,231 @@
+"""
+Library of validated Stage 2 plans and Stage 3 programs.
+
+Challenges of the same provider are often structurally identical: same frames at the same
+place, same interactables, and an objective worded the same way. Generating a plan or a
+program for them again costs several VLM calls. The library stores what solved a challenge,
+keyed by a layout signature, and the runner looks it up before generating.
+
+The signature is matched exactly: frame count, quantized geometry, interactable types, and
+the objective as a set of normalized words (lowercase, singular, without stopwords). The
+objective is not matched by similarity: objectives that differ only in the target object
+("... a bus ..." and "... a motorcycle ...") share almost all of their words, and replaying
+a program whose `ask` questions name the wrong object loses the solve. Entries that keep
+failing are dropped. Lookups, hits and the generation time saved by hits
+are counted per captcha type and stored with the entries.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Literal
+
+from halligan.runtime.schemas import Stage2Plan, Stage3Program
+
+if TYPE_CHECKING:
+    from halligan.utils.layout import Frame
+
+Kind = Literal["stage2", "stage3"]
+
+# Geometry is compared on a grid of this many pixels, so that 1px jitter of frame detection does not matter
+GRID = 8
+
+# Entries that failed this many times, and more often than they succeeded, are dropped
+MAX_FAILURES = 2
+
+_STOPWORDS = {"a", "an", "the", "all", "of", "to", "in", "on", "with", "that", "and", "or", "is", "are", "this"}
+
+
+def _singular(word: str) -> str:
+    if len(word) <= 3 or not word.endswith("s") or word.endswith("ss"):
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("ses", "xes", "ches", "shes")):
+        return word[:-2]
+    return word[:-1]
+
+
+def objective_words(objective: str) -> frozenset[str]:
+    """Normalized words of an objective (lowercase, singular, without stopwords)."""
+    words = re.findall(r"[a-z0-9]+", objective.lower())
+    return frozenset(_singular(word) for word in words if word not in _STOPWORDS)
+
+
+@dataclass(frozen=True)
+class LayoutSignature:
+    """
+    frames: number of (leaf) frames
+    geometry: quantized (x, y, w, h) of each frame, relative to the top-left frame
+    interactables: interactable types, empty before Stage 2
+    objective: normalized objective words
+    """
+
+    frames: int
+    geometry: tuple[tuple[int, int, int, int], ...]
+    interactables: tuple[str, ...]
+    objective: frozenset[str]
+
+    @property
+    def key(self) -> str:
+        geometry = ";".join(",".join(map(str, box)) for box in self.geometry)
+        return f"{self.frames}|{geometry}|{','.join(self.interactables)}|{' '.join(sorted(self.objective))}"
+
+
+def layout_signature(frames: list["Frame"], objective: str, interactables: set[str] | None = None) -> LayoutSignature:
+    """Signature of `frames` (use the leaf frames of `get_observation` after Stage 2)."""
+    x0 = min((frame.x for frame in frames), default=0)
+    y0 = min((frame.y for frame in frames), default=0)
+    geometry = tuple(
+        (
+            round((frame.x - x0) / GRID),
+            round((frame.y - y0) / GRID),
+            round(frame.w / GRID),
+            round(frame.h / GRID),
+        )
+        for frame in frames
+    )
+    return LayoutSignature(
+        frames=len(frames),
+        geometry=geometry,
+        interactables=tuple(sorted(interactables or ())),
+        objective=objective_words(objective),
+    )
+
+
+def plan_to_json(plan: Stage2Plan) -> dict[str, Any]:
+    """Inverse of `validate_stage2`."""
+    return {"actions": [{"type": action.type, **action.payload} for action in plan.actions]}
+
+
+def program_to_json(program: Stage3Program) -> dict[str, Any]:
+    """Inverse of `validate_stage3`."""
+    return {"steps": program.steps}
+
+
+@dataclass
+class Entry:
+    kind: Kind
+    objective: list[str]
+    data: dict[str, Any]
+    captcha_type: str
+    # Seconds it took to generate `data`, saved by every hit
+    latency: float
+    successes: int = 0
+    failures: int = 0
+    id: str = ""
+
+
+@dataclass
+class Stats:
+    lookups: int = 0
+    hits: int = 0
+    saved_seconds: float = 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
+
+
+@dataclass
+class Library:
+    """
+    JSON-backed library (see `load`), `lookup` before generating and `report` the outcome.
+
+    path: JSON file, None keeps the library in memory
+    """
+
+    path: str | None = None
+    entries: dict[str, list[Entry]] = field(default_factory=dict)
+    stats: dict[str, Stats] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @classmethod
+    def load(cls, path: str) -> Library:
+        library = cls(path=path)
+        if not os.path.exists(path):
+            return library
+        with open(path) as file:
+            data = json.load(file)
+        library.entries = {key: [Entry(**entry) for entry in entries] for key, entries in data["entries"].items()}
+        library.stats = {key: Stats(**stats) for key, stats in data["stats"].items()}
+        return library
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        with self._lock:
+            data = {
+                "entries": {key: [vars(e) for e in entries] for key, entries in self.entries.items() if entries},
+                "stats": {key: vars(stats) for key, stats in self.stats.items()},
+            }
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as file:
+            json.dump(data, file, indent=2)
+        os.replace(tmp, self.path)
+
+    def _stats(self, kind: Kind, captcha_type: str) -> Stats:
+        return self.stats.setdefault(f"{kind}:{captcha_type}", Stats())
+
+    def lookup(self, kind: Kind, signature: LayoutSignature, captcha_type: str) -> Entry | None:
+        """The most successful entry for `signature` (including its objective), counted as a hit."""
+        with self._lock:
+            stats = self._stats(kind, captcha_type)
+            stats.lookups += 1
+
+            entries = self.entries.get(f"{kind}|{signature.key}", [])
+            if not entries:
+                return None
+            best = max(entries, key=lambda entry: entry.successes)
+            stats.hits += 1
+            stats.saved_seconds += best.latency
+            return best
+
+    def store(
+        self, kind: Kind, signature: LayoutSignature, data: dict[str, Any], captcha_type: str, latency: float
+    ) -> Entry:
+        """Add what solved a challenge (`latency` is the time it took to generate)."""
+        entry = Entry(
+            kind=kind,
+            objective=sorted(signature.objective),
+            data=data,
+            captcha_type=captcha_type,
+            latency=round(latency, 3),
+            successes=1,
+            id=f"{kind}-{time.time_ns():x}",
+        )
+        with self._lock:
+            self.entries.setdefault(f"{kind}|{signature.key}", []).append(entry)
+        return entry
+
+    def report(self, entry: Entry, solved: bool) -> None:
+        """Record the outcome of a reused entry, entries that keep failing are dropped."""
+        with self._lock:
+            if solved:
+                entry.successes += 1
+                return
+            entry.failures += 1
+            if entry.failures >= MAX_FAILURES and entry.failures > entry.successes:
+                for entries in self.entries.values():
+                    if entry in entries:
+                        entries.remove(entry)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """Hit rate and saved seconds per `kind:captcha_type`."""
+        return {
+            key: {
+                "lookups": s.lookups,
+                "hits": s.hits,
+                "hit_rate": round(s.hit_rate, 3),
+                "saved_seconds": s.saved_seconds,
+            }
+            for key, s in sorted(self.stats.items())
+        }
@@ -0,0 +1,169 @@
+"""
+Profiling of Stage 3 programs.
+
+The compiler wraps every tool or method call in a span keyed by its name, and, when steps are
+profiled (e.g. for a trace), every step in a span keyed by its JSON path (`$.steps[2].do[0]`).
+Resources that tools report through `accounting.record()` (screenshots, VLM calls, tokens) are
+attributed to all spans active in the reporting context, so a step's numbers include the steps
+nested in it. Image bytes are the raw pixel bytes of the images a call returns.
+
+Spans are on the path of every tool call: `Profile.call` runs the function inside the span
+instead of going through a context manager, and appends its timing to a list (atomic) that is
+folded into the stats when they are read, rather than taking a lock.
+
+The profile is rendered as a markdown table for the trace, and as a dict for JSON summaries.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, TypeVar
+
+T = TypeVar("T")
+
+# Resources attributed from `accounting.record()` and `count_images()`
+_RESOURCES = ("screenshots", "vlm_calls", "tokens", "image_bytes")
+
+
+@dataclass
+class Stats:
+    calls: int = 0
+    seconds: float = 0.0
+    screenshots: int = 0
+    vlm_calls: int = 0
+    tokens: int = 0
+    image_bytes: int = 0
+
+
+def _image_bytes(value: Any, depth: int = 2) -> int:
+    """Raw pixel bytes of the PIL images in a result (lists and `.image` attributes are followed)."""
+    if hasattr(value, "getbands") and hasattr(value, "size"):
+        width, height = value.size
+        return width * height * len(value.getbands())
+    if depth == 0:
+        return 0
+    if isinstance(value, (list, tuple)):
+        return sum(_image_bytes(item, depth - 1) for item in value)
+    image = getattr(value, "image", None)
+    return _image_bytes(image, 0) if image is not None else 0
+
+
+class Profile:
+    """Per-step and per-tool stats of one program run, safe to update from `pforeach` threads."""
+
+    def __init__(self) -> None:
+        self.steps: dict[str, Stats] = {}
+        self.tools: dict[str, Stats] = {}
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+        # (stats, seconds) of finished spans, see `_fold`
+        self._timings: list[tuple[Stats, float]] = []
+
+    def call(self, kind: str, key: str, fn: Callable[..., T], /, *args: Any) -> T:
+        """
+        Call `fn(*args)` in the span of a step (`kind="step"`) or a tool call (`kind="tool"`):
+        time it, and attribute the resources it records to it.
+        """
+        table = self.steps if kind == "step" else self.tools
+        stats = table.get(key)
+        if stats is None:
+            with self._lock:
+                stats = table.setdefault(key, Stats())
+
+        token = _spans.set(_spans.get() + (stats,))
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self._timings.append((stats, time.perf_counter() - start))
+            _spans.reset(token)
+
+    def _fold(self) -> None:
+        with self._lock:
+            count = len(self._timings)
+            timings = self._timings[:count]
+            del self._timings[:count]
+            for stats, seconds in timings:
+                stats.calls += 1
+                stats.seconds += seconds
+
+    def add(self, stats: Stats, resource: str, amount: int) -> None:
+        with self._lock:
+            setattr(stats, resource, getattr(stats, resource) + amount)
+
+    def finish(self) -> None:
+        self.seconds = time.perf_counter() - self.started
+        self._fold()
+
+    def to_dict(self) -> dict[str, Any]:
+        self._fold()
+        return {
+            "seconds": round(self.seconds, 4),
+            "steps": {key: asdict(stats) for key, stats in self.steps.items()},
+            "tools": {key: asdict(stats) for key, stats in self.tools.items()},
+        }
+
+    def to_markdown(self, top: int = 10) -> str:
+        """Tools, then the `top` slowest steps, as markdown tables."""
+        self._fold()
+        header = "| {} | calls | seconds | screenshots | VLM calls | tokens | image KB |\n|---|---|---|---|---|---|---|"
+
+        def rows(table: dict[str, Stats]) -> list[str]:
+            ranked = sorted(table.items(), key=lambda item: item[1].seconds, reverse=True)[:top]
+            return [
+                f"| `{key}` | {s.calls} | {s.seconds:.3f} | {s.screenshots} | {s.vlm_calls} | {s.tokens} "
+                f"| {s.image_bytes / 1024:.0f} |"
+                for key, s in ranked
+            ]
+
+        return "\n".join(
+            [
+                f"**Profile:** {self.seconds:.3f} seconds",
+                "",
+                header.format("tool"),
+                *rows(self.tools),
+                "",
+                header.format("step"),
+                *rows(self.steps),
+            ]
+        )
+
+
+_profile: ContextVar[Profile | None] = ContextVar("halligan_profile", default=None)
+_spans: ContextVar[tuple[Stats, ...]] = ContextVar("halligan_spans", default=())
+
+
+def current_profile() -> Profile | None:
+    return _profile.get()
+
+
+@contextmanager
+def profiling(profile: Profile) -> Iterator[Profile]:
+    """Bind `profile` to the current context, like `accounting.metering`."""
+    token = _profile.set(profile)
+    try:
+        yield profile
+    finally:
+        profile.finish()
+        _profile.reset(token)
+
+
+def attribute(resource: str, amount: int = 1) -> None:
+    """Add resource usage to the active spans, a no-op outside of a profiled program."""
+    profile = _profile.get()
+    if profile is None or resource not in _RESOURCES:
+        return
+    for stats in _spans.get():
+        profile.add(stats, resource, amount)
+
+
+def count_images(result: Any) -> None:
+    """Attribute the image bytes of a call's result to the active spans."""
+    if _profile.get() is not None and (amount := _image_bytes(result)):
+        attribute("image_bytes", amount)
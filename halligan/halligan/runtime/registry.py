@@ -8,8 +8,17 @@ ToolFn = Callable[..., Any]
 
 @dataclass(frozen=True)
 class ToolSpec:
+    """
+    parallel: the tool has no side effects on the page or on other calls,
+        so it may run concurrently inside `pforeach`
+    batch_arg: argument taking a list of items, with one result per item,
+        so that per-item calls in a `foreach` can be merged into one call
+    """
+
     name: str
     fn: ToolFn
+    parallel: bool = False
+    batch_arg: str | None = None
 
 
 class ToolRegistry:
@@ -23,8 +32,8 @@ class ToolRegistry:
     def __init__(self) -> None:
         self._tools: dict[str, ToolSpec] = {}
 
-    def register(self, name: str, fn: ToolFn) -> None:
-        self._tools[name] = ToolSpec(name=name, fn=fn)
+    def register(self, name: str, fn: ToolFn, *, parallel: bool = False, batch_arg: str | None = None) -> None:
+        self._tools[name] = ToolSpec(name=name, fn=fn, parallel=parallel, batch_arg=batch_arg)
 
     def get(self, name: str) -> ToolSpec | None:
         return self._tools.get(name)
@@ -60,12 +69,12 @@ def build_default_registry() -> ToolRegistry:
     reg.register("slide_y", action_tools.slide_y)
     reg.register("explore", action_tools.explore)
 
-    # Vision tools (visual reasoning helpers)
-    reg.register("mark", vision_tools.mark)
-    reg.register("focus", vision_tools.focus)
-    reg.register("ask", vision_tools.ask)
+    # Vision tools (visual reasoning helpers), only read the images they are given
+    reg.register("mark", vision_tools.mark, parallel=True, batch_arg="images")
+    reg.register("focus", vision_tools.focus, parallel=True)
+    reg.register("ask", vision_tools.ask, parallel=True, batch_arg="images")
     reg.register("rank", vision_tools.rank)
-    reg.register("compare", vision_tools.compare)
-    reg.register("match", vision_tools.match)
+    reg.register("compare", vision_tools.compare, parallel=True, batch_arg="images")
+    reg.register("match", vision_tools.match, parallel=True)
 
     return reg
@@ -222,3 +222,17 @@ def validate_stage3(data: Any) -> Stage3Program:
         _require_dict(step, f"$.steps[{i}]")
         _require_str(step.get("op"), f"$.steps[{i}].op")
     return Stage3Program(steps=steps)  # type: ignore[arg-type]
+
+
+def validate_stage3_candidates(data: Any) -> list[Any]:
+    """
+    Split `{"candidates": [<program>, ...]}` into the candidate programs, still unvalidated
+    (see `rank_stage3_programs`). A single program is accepted as one candidate.
+    """
+    obj = _require_dict(data, "$")
+    if "candidates" not in obj:
+        return [obj]
+    candidates = _require_list(obj.get("candidates"), "$.candidates")
+    if not candidates:
+        raise ValidationError("$.candidates: expected at least one program")
+    return candidates
@@ -0,0 +1,215 @@
+"""
+Single-conversation pipeline.
+
+Stages 1, 2 and 3 normally reset the agent and send the frames with a fresh prompt each,
+so no request is a prefix of the next and providers cannot reuse a cached prefix. The
+pipeline runs all three stages as one conversation instead:
+
+    system:    instructions, tool docs and every in-context example (identical for all challenges)
+    user:      frames + Stage 1 prompt                  assistant: descriptions, relations, objective
+    user:      Stage 2 prompt                           assistant: plan
+    user:      frames/elements after Stage 2 + Stage 3  assistant: program
+
+Every request extends the previous one, so the system prompt is cached across challenges and
+the frames across stages (OpenAI caches prefixes of 1024+ tokens). Cached tokens and time to
+first token are read from the agent's metadata and summarized in `PipelineUsage`.
+"""
+
+from __future__ import annotations
+
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, TypeVar
+
+import halligan.prompts as Prompts
+import halligan.utils.examples as Examples
+from halligan.agents import Agent
+from halligan.runtime.errors import ExecutionCancelledError, ParseError, ToolError, ValidationError
+from halligan.runtime.executor import apply_stage2_plan
+from halligan.runtime.parser import parse_json_from_response
+from halligan.runtime.registry import build_default_registry
+from halligan.runtime.schemas import Stage2Plan, Stage3Program, validate_stage1, validate_stage2, validate_stage3
+from halligan.stages.stage1 import annotate_frames
+from halligan.stages.stage3 import ACTION_TOOL_DOCS, VISION_TOOL_DOCS, execute_program
+from halligan.utils.constants import InteractableElement, Stage
+from halligan.utils.layout import Frame, get_observation
+from halligan.utils.logger import Trace
+
+_T = TypeVar("_T")
+
+_FEEDBACK = (
+    "Your previous output failed to parse/validate/execute.\n"
+    "Error: {error}\n\n"
+    "Please output ONLY valid JSON that matches the required schema.\n"
+    "Do not include markdown fences or any extra text."
+)
+
+
+def system_prompt() -> str:
+    """The stable prefix of every pipeline conversation, it must not depend on the challenge."""
+    examples = "\n\n".join(
+        f"### Example ({', '.join(interactables) or 'other interactables'})\n{example}"
+        for interactables, example in Examples.get_all()
+    )
+    return (
+        "You solve visual tasks in three steps, each answered with a single JSON object:\n"
+        "1. Objective identification: describe the frames, their relations and the task objective.\n"
+        "2. Structure abstraction: identify the interactable frames and elements.\n"
+        "3. Solution composition: compose a restricted JSON program that solves the task.\n\n"
+        "## Action tools (step 3)\n"
+        f"{ACTION_TOOL_DOCS}\n\n"
+        "## Vision tools (step 3)\n"
+        f"{VISION_TOOL_DOCS}\n\n"
+        "## Solution examples (step 3)\n"
+        f"{examples}"
+    )
+
+
+SYSTEM_PROMPT = system_prompt()
+
+
+@dataclass
+class PipelineUsage:
+    calls: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+    ttft: list[float] = field(default_factory=list)
+
+    def add(self, metadata: dict[str, Any]) -> None:
+        self.calls += 1
+        self.prompt_tokens += metadata.get("prompt_tokens", 0)
+        self.cached_tokens += metadata.get("cached_tokens", 0)
+        self.completion_tokens += metadata.get("completion_tokens", 0)
+        if "ttft" in metadata:
+            self.ttft.append(metadata["ttft"])
+
+    @property
+    def cache_hit_ratio(self) -> float:
+        """Share of prompt tokens served from the provider's prompt cache."""
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def summary(self) -> dict[str, Any]:
+        return {**asdict(self), "cache_hit_ratio": round(self.cache_hit_ratio, 3)}
+
+
+@dataclass(frozen=True)
+class PipelineResult:
+    objective: str
+    plan: Stage2Plan
+    program: Stage3Program
+    usage: PipelineUsage
+
+
+def _converse(
+    agent: Agent,
+    prompt: str,
+    images: list,
+    image_captions: list[str],
+    usage: PipelineUsage,
+    handle: Callable[[Any], _T],
+    attempts: int,
+) -> _T:
+    """
+    Send `prompt` and pass the parsed JSON to `handle`. Errors are answered with feedback in
+    the same conversation (without resending images), up to `attempts` times.
+    """
+    error: Exception | None = None
+    for _ in range(attempts):
+        response, metadata = agent(prompt, images, image_captions)
+        usage.add(metadata)
+        try:
+            return handle(parse_json_from_response(response))
+        except ExecutionCancelledError:
+            raise
+        except (ParseError, ValidationError, ToolError, Exception) as exc:
+            error = exc
+            prompt, images, image_captions = _FEEDBACK.format(error=exc), [], []
+
+    raise error if error else RuntimeError("Pipeline stage failed without a captured error")
+
+
+@Trace.section("Pipeline (Objective Identification, Structure Abstraction, Solution Composition)")
+def solve_pipeline(agent: Agent, frames: list[Frame]) -> PipelineResult:
+    """
+    Run Stages 1-3 as a single conversation, see the module docstring.
+    The Stage 3 program is executed with a fork of the agent, so tool calls stay out of the conversation.
+    """
+    usage = PipelineUsage()
+    agent.reset(system=SYSTEM_PROMPT)
+
+    # Stage 1: the frames go first, every later request shares them as a prefix
+    def identify(data: Any) -> str:
+        result = validate_stage1(data, frames=len(frames))
+        annotate_frames(frames, result)
+        return result.objective
+
+    objective = _converse(
+        agent,
+        Prompts.get(stage=Stage.OBJECTIVE_IDENTIFICATION, frames=len(frames)),
+        [frame.image for frame in frames],
+        [f"Frame {i}" for i in range(len(frames))],
+        usage,
+        identify,
+        attempts=3,
+    )
+
+    # Stage 2
+    _, _, _, descriptions, relations, _ = get_observation(frames)
+
+    def abstract(data: Any) -> Stage2Plan:
+        plan = validate_stage2(data, frames=len(frames))
+        apply_stage2_plan(frames, plan)
+        return plan
+
+    plan = _converse(
+        agent,
+        Prompts.get(
+            stage=Stage.STRUCTURE_ABSTRACTION,
+            descriptions="\n".join(descriptions),
+            relations="\n".join(relations),
+            objective=objective,
+        ),
+        [],
+        [],
+        usage,
+        abstract,
+        attempts=3,
+    )
+
+    # Stage 3: only the observation after Stage 2 is new, tools and examples are in the system prompt
+    all_frames, images, image_captions, descriptions, relations, interactable_types = get_observation(frames)
+    registry = build_default_registry()
+    interactables = sorted(t for t in interactable_types if t != InteractableElement.NEXT.name)
+
+    def compose(data: Any) -> Stage3Program:
+        program = validate_stage3(data)
+        execute_program(agent.fork(), all_frames, program, registry)
+        return program
+
+    program = _converse(
+        agent,
+        Prompts.get(
+            stage=Stage.SOLUTION_COMPOSITION,
+            descriptions="\n".join(descriptions),
+            relations="\n".join(relations),
+            objective=objective,
+            examples=f"(see the solution examples for {', '.join(interactables)} in the system prompt)",
+            action_tools="(see the action tools in the system prompt)",
+            vision_tools="(see the vision tools in the system prompt)",
+        ),
+        images,
+        image_captions,
+        usage,
+        compose,
+        attempts=4,
+    )
+
+    agent.reset()
+    if Trace.tracing:
+        Trace.comment(
+            f"**Prompt cache:** {usage.cached_tokens} of {usage.prompt_tokens} prompt tokens cached "
+            f"({usage.cache_hit_ratio:.0%}) over {usage.calls} calls"
+        )
+        Trace.summary("pipeline", usage.summary())
+
+    return PipelineResult(objective=objective, plan=plan, program=program, usage=usage)
@@ -2,7 +2,7 @@ import halligan.prompts as Prompts
 from halligan.agents import Agent
 from halligan.runtime.errors import ParseError, ValidationError
 from halligan.runtime.parser import parse_json_from_response
-from halligan.runtime.schemas import validate_stage1
+from halligan.runtime.schemas import Stage1Result, validate_stage1
 from halligan.utils.constants import Stage
 from halligan.utils.layout import Frame
 from halligan.utils.logger import Trace
@@ -10,6 +10,15 @@ from halligan.utils.logger import Trace
 stage = Stage.OBJECTIVE_IDENTIFICATION
 
 
+def annotate_frames(frames: list[Frame], result: Stage1Result) -> None:
+    """Store the descriptions and relations of a Stage 1 result in the frames."""
+    for i, desc in enumerate(result.descriptions):
+        frames[i].description = desc
+
+    for rel in result.relations:
+        frames[rel.src].relations[rel.dst] = rel.relationship
+
+
 @Trace.section("Objective Identification")
 def objective_identification(agent: Agent, frames: list[Frame]) -> str:
     """
@@ -24,7 +33,7 @@ def objective_identification(agent: Agent, frames: list[Frame]) -> str:
         objective (str): The inferred task objective.
     """
     # Prepare prompt
-    prompt = Prompts.get(stage=stage, frames=len(frames))
+    prompt = Prompts.build(stage=stage, frames=len(frames))
     print(prompt)
 
     # Request structured JSON from agent
@@ -37,12 +46,7 @@ def objective_identification(agent: Agent, frames: list[Frame]) -> str:
             data = parse_json_from_response(response)
             result = validate_stage1(data, frames=len(frames))
 
-            for i, desc in enumerate(result.descriptions):
-                frames[i].description = desc
-
-            for rel in result.relations:
-                frames[rel.src].relations[rel.dst] = rel.relationship
-
+            annotate_frames(frames, result)
             agent.reset()
             return result.objective
 
@@ -3,7 +3,7 @@ from halligan.agents import Agent
 from halligan.runtime.errors import ParseError, ValidationError
 from halligan.runtime.executor import apply_stage2_plan
 from halligan.runtime.parser import parse_json_from_response
-from halligan.runtime.schemas import validate_stage2
+from halligan.runtime.schemas import Stage2Plan, validate_stage2
 from halligan.utils.constants import Stage
 from halligan.utils.layout import Frame, get_observation
 from halligan.utils.logger import Trace
@@ -12,18 +12,18 @@ stage = Stage.STRUCTURE_ABSTRACTION
 
 
 @Trace.section("Structure Abstraction")
-def structure_abstraction(agent: Agent, frames: list[Frame], objective: str) -> None:
+def structure_abstraction(agent: Agent, frames: list[Frame], objective: str) -> Stage2Plan:
     """
     Instruct the agent to annotate interactable Frames and Elements.
     Frames can be further divided into subframes.
     The agent can segment specific Elements or extract a grid of evenly-sized Elements from Frames.
 
     Returns:
-        None: all annotations are stored in the Frame instances (e.g., Frame.interactables).
+        Stage2Plan: the applied plan, all annotations are stored in the Frame instances (e.g., Frame.interactables).
     """
     # Prepare prompt
     _, images, image_captions, descriptions, relations, _ = get_observation(frames)
-    prompt = Prompts.get(
+    prompt = Prompts.build(
         stage=stage,
         descriptions="\n".join(descriptions),
         relations="\n".join(relations),
@@ -39,7 +39,7 @@ def structure_abstraction(agent: Agent, frames: list[Frame], objective: str) ->
             plan = validate_stage2(data, frames=len(frames))
             apply_stage2_plan(frames, plan)
             agent.reset()
-            return
+            return plan
 
         except (ParseError, ValidationError) as exc:
             last_error = exc
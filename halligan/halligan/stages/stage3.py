@@ -1,70 +1,164 @@
+from typing import Any
+
 import halligan.prompts as Prompts
 import halligan.utils.examples as Examples
+import halligan.utils.vision_tools as vision_tools
 from halligan.agents import Agent
-from halligan.runtime.errors import ParseError, ToolError, ValidationError
+from halligan.runtime.accounting import Meter
+from halligan.runtime.analysis import analyze_stage3_program, rank_stage3_programs
+from halligan.runtime.errors import ExecutionCancelledError, ParseError, ToolError, ValidationError
 from halligan.runtime.executor import execute_stage3_program
 from halligan.runtime.parser import parse_json_from_response
-from halligan.runtime.registry import build_default_registry
-from halligan.runtime.schemas import validate_stage3
+from halligan.runtime.profiler import Profile
+from halligan.runtime.registry import ToolRegistry, build_default_registry
+from halligan.runtime.schemas import Stage3Program, validate_stage3, validate_stage3_candidates
 from halligan.utils.constants import InteractableElement, Stage
 from halligan.utils.layout import Frame, get_observation
 from halligan.utils.logger import Trace
 
 stage = Stage.SOLUTION_COMPOSITION
 
+# Tools exposed to the JSON program (functions only)
+ACTION_TOOL_DOCS = "\n".join(
+    [
+        "- click(target)",
+        "- get_all_choices(prev_arrow, next_arrow, observe)",
+        "- drag(start, end)",
+        "- slide_x(handle, direction, observe_frame)",
+        "- slide_y(handle, direction, observe_frame)",
+        "- explore(grid)",
+        "- select(choice)",
+        "- point(to)",
+        "- enter(field, text)",
+        "- draw(path)",
+    ]
+)
+VISION_TOOL_DOCS = "\n".join(
+    [
+        "- mark(images, object)",
+        "- focus(image, description)",
+        "- ask(images, question, answer_type)",
+        "- compare(images, task_objective, reference)",
+        "- rank(images, task_objective)",
+        "- match(e1, e2)",
+    ]
+)
+
+
+def execute_program(
+    agent: Agent, all_frames: list[Frame], program: Stage3Program, registry: ToolRegistry, meter: Meter | None = None
+) -> None:
+    """
+    Statically check and execute a program, tracing its estimated cost and profile.
+    Usage is counted on `meter` when given, e.g. to see what a failed program did.
+    """
+    # Reject invalid or runaway programs before any tool runs
+    cost = analyze_stage3_program(program, registry=registry, frames=all_frames)
+    if Trace.tracing:
+        Trace.comment(
+            f"**Estimated cost:** {cost.vlm_calls} VLM calls, "
+            f"{cost.screenshots} screenshots, {cost.actions} browser actions"
+        )
+
+    # Vision tools require an injected agent instance.
+    agent.reset()
+    vision_tools.set_agent(agent)
+    meter, profile = meter or Meter(), Profile()
+    try:
+        # Per-step spans are only worth their cost when they are shown
+        execute_stage3_program(
+            all_frames, program, registry=registry, meter=meter, profile=profile, profile_steps=Trace.tracing
+        )
+    finally:
+        saved = {k.split(":", 1)[1]: n for k, n in meter.usage.items() if k.startswith("batched:")}
+        fallbacks = {k.split(":", 1)[1]: n for k, n in meter.usage.items() if k.startswith("batch_fallback:")}
+        if Trace.tracing:
+            if saved:
+                Trace.comment(
+                    "**Batched calls:** saved " + ", ".join(f"{n} {tool}" for tool, n in sorted(saved.items()))
+                )
+            if fallbacks:
+                Trace.comment(
+                    "**Batched calls discarded:** "
+                    + ", ".join(f"{n} {tool}" for tool, n in sorted(fallbacks.items()))
+                    + " (mismatched results, called per item)"
+                )
+            Trace.comment(profile.to_markdown())
+            Trace.summary("stage3", {"profile": profile.to_dict(), "usage": dict(meter.usage)})
+    agent.reset()
+
+
+@Trace.section("Solution Composition (Library)")
+def run_program(agent: Agent, frames: list[Frame], program: Stage3Program) -> None:
+    """
+    Execute a known program (e.g., from the library) on frames annotated by Stage 2.
+    Raises like a failed generation attempt, without retrying.
+    """
+    all_frames = get_observation(frames)[0]
+    execute_program(agent, all_frames, program, build_default_registry())
+
+
+_CANDIDATES = (
+    "\n\nOutput {n} candidate programs that solve the task in different ways, most likely to succeed first, "
+    'as a single JSON object: {{"candidates": [{{"steps": [...]}}, ...]}}'
+)
+
+
+def _rank(data: Any, candidates: int, registry: ToolRegistry, all_frames: list[Frame]) -> list[Stage3Program]:
+    """The programs of a response, in the order they should be executed."""
+    if candidates == 1:
+        # Checked by `execute_program`
+        return [validate_stage3(data)]
+
+    ranked = rank_stage3_programs(validate_stage3_candidates(data), registry=registry, frames=all_frames)
+    if Trace.tracing:
+        Trace.comment(
+            f"**Candidates:** {len(ranked)} valid, executing in the model's order: "
+            + ", ".join(f"{cost.vlm_calls} VLM calls / {cost.actions} actions" for _, cost in ranked)
+        )
+    return [program for program, _ in ranked]
+
 
 @Trace.section("Solution Composition")
-def solution_composition(agent: Agent, frames: list[Frame], objective: str) -> None:
+def solution_composition(
+    agent: Agent, frames: list[Frame], objective: str, candidates: int = 1, prompt_budget: int | None = None
+) -> Stage3Program:
     """
     Agent composes a Python executable solution using vision and action tools.
+
+    With `candidates` > 1, the agent is asked for that many programs at once. The valid ones
+    that pass static analysis are executed in the model's order, until one acts on the page:
+    the next candidates were written for the page as it was, so asking again is safer.
+    In-context examples are fitted to `prompt_budget` tokens (see `halligan.prompts.builder`).
+
+    Returns:
+        Stage3Program: the program that was executed without errors.
     """
     examples = []
     all_frames, images, image_captions, descriptions, relations, interactable_types = get_observation(frames)
 
-    for interactable_type in interactable_types:
+    for interactable_type in sorted(interactable_types):
         # Prepare in-context learning examples
         if interactable_type == InteractableElement.NEXT.name:
             continue
         else:
-            examples.append(Examples.get(interactable_type))
+            examples.append((interactable_type, Examples.get(interactable_type)))
 
-    # Tools exposed to the JSON program (functions only)
     registry = build_default_registry()
-    action_tools = "\n".join(
-        [
-            "- click(target)",
-            "- get_all_choices(prev_arrow, next_arrow, observe)",
-            "- drag(start, end)",
-            "- slide_x(handle, direction, observe_frame)",
-            "- slide_y(handle, direction, observe_frame)",
-            "- explore(grid)",
-            "- select(choice)",
-            "- point(to)",
-            "- enter(field, text)",
-            "- draw(path)",
-        ]
-    )
-    vision_tools = "\n".join(
-        [
-            "- mark(images, object)",
-            "- focus(image, description)",
-            "- ask(images, question, answer_type)",
-            "- compare(images, task_objective, reference)",
-            "- rank(images, task_objective)",
-            "- match(e1, e2)",
-        ]
-    )
+    instructions = _CANDIDATES.format(n=candidates) if candidates > 1 else ""
 
     # Prepare prompt
-    prompt = Prompts.get(
+    prompt = Prompts.build(
         stage=stage,
+        examples=examples,
+        budget=prompt_budget,
         descriptions="\n".join(descriptions),
         relations="\n".join(relations),
         objective=objective,
-        examples="\n\n".join(examples),
-        action_tools=action_tools,
-        vision_tools=vision_tools,
+        action_tools=ACTION_TOOL_DOCS,
+        vision_tools=VISION_TOOL_DOCS,
     )
+    prompt += instructions
     print(prompt)
 
     # Request JSON program from agent and execute it safely
@@ -76,14 +170,26 @@ def solution_composition(agent: Agent, frames: list[Frame], objective: str) -> N
 
             response, _ = agent(prompt, images, image_captions)
             data = parse_json_from_response(response)
-            program = validate_stage3(data)
+            programs = _rank(data, candidates, registry, all_frames)
 
-            # Vision tools require an injected agent instance.
-            agent.reset()
-            vision_tools.set_agent(agent)
-            execute_stage3_program(all_frames, program, registry=registry)
+            # The fallbacks are already in hand, a failed program does not cost a round-trip
+            for program in programs:
+                meter = Meter()
+                try:
+                    execute_program(agent, all_frames, program, registry, meter)
+                    return program
+                except ExecutionCancelledError:
+                    raise
+                except Exception as exc:
+                    feedback = exc
+                    if meter.usage["input_events"]:
+                        break
+            raise feedback
+
+        except ExecutionCancelledError:
+            # Cancellation is not a mistake of the program, do not retry it
             agent.reset()
-            return
+            raise
 
         except (ParseError, ValidationError, ToolError, Exception) as exc:
             feedback = exc
@@ -92,7 +198,7 @@ def solution_composition(agent: Agent, frames: list[Frame], objective: str) -> N
                 f"Error: {exc}\n\n"
                 "Please output ONLY valid JSON that matches the required schema.\n"
                 "Do not include markdown fences or any extra text."
-            )
+            ) + instructions
 
     agent.reset()
     raise feedback if feedback else RuntimeError("Stage 3 failed without a captured error")
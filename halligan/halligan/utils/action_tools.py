@@ -2,36 +2,56 @@
 # Provides VLM agents with the ability to interact and execute actions (i.e., enhance executive function).
 from __future__ import annotations
 
-import io
+import bisect
 import itertools
 import time
-from copy import deepcopy
-from typing import List, Literal, Union
+from copy import copy
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Literal, Union
 
+import numpy as np
 import PIL.Image
 from dotenv import load_dotenv
-from PIL import ImageChops
 from playwright.sync_api import Page
 
+from halligan.utils.capture import (
+    InvalidatingInput,
+    ScreenCapture,
+    diff_ratio,
+    difference,
+    pixels,
+    signature,
+)
 from halligan.utils.layout import Element, Frame, Point
+from halligan.utils.logger import Trace
 from halligan.utils.toolkit import Toolkit
-from halligan.utils.vision_tools import match
+from halligan.utils.vision_tools import match_matrix
 
 load_dotenv()
 
 page: Page | None = None
+capture: ScreenCapture | None = None
 
+# Input devices of `page`, every event invalidates the frame cache of `capture`
+mouse: InvalidatingInput | None = None
+keyboard: InvalidatingInput | None = None
 
-def set_page(p: Page):
-    global page
+
+def set_page(p: Page, **capture_options):
+    """
+    Bind action tools to a page, `capture_options` are passed to `ScreenCapture`.
+    Input to the page must go through `mouse` and `keyboard` from then on, or be followed
+    by `capture.invalidate()`, otherwise observations may show the page from before it.
+    """
+    global page, capture, mouse, keyboard
     page = p
+    capture = ScreenCapture(p, **capture_options)
+    mouse = InvalidatingInput(p.mouse, capture)
+    keyboard = InvalidatingInput(p.keyboard, capture)
 
 
-def screenshot(region: list[float] = None) -> PIL.Image.Image:
-    if region:
-        region = {"x": region[0], "y": region[1], "width": region[2], "height": region[3]}
-    image_bytes = page.screenshot(clip=region)
-    return PIL.Image.open(io.BytesIO(image_bytes)).convert("RGB")
+def screenshot(region: list[float] = None, fresh: bool = False) -> PIL.Image.Image:
+    return capture.grab(region, fresh=fresh)
 
 
 class Choice:
@@ -46,14 +66,42 @@ class Choice:
         """
         (For click_and_hold) Release from holding.
         """
-        page.mouse.up()
+        mouse.up()
+
+
+class Carousel:
+    """
+    Choices cycled by arrow buttons, shared by the SelectChoices of one get_all_choices call.
+    Tracks which choice is shown, so that selecting one only clicks the difference.
+    """
+
+    def __init__(self, prev_arrow: Element, next_arrow: Element) -> None:
+        self.prev_arrow = prev_arrow
+        self.next_arrow = next_arrow
+        self.size = 1
+        self.position = 0
+        # Cyclic carousels wrap around from the last choice to the first, others stop at the ends
+        self.cyclic = True
+
+    def move_to(self, index: int) -> None:
+        if self.cyclic:
+            arrow, clicks = self.next_arrow, (index - self.position) % self.size
+        elif index >= self.position:
+            arrow, clicks = self.next_arrow, index - self.position
+        else:
+            arrow, clicks = self.prev_arrow, self.position - index
+
+        x, y = arrow.center
+        for _ in range(clicks):
+            mouse.click(x, y)
+        self.position = index
 
 
 class SelectChoice:
-    def __init__(self, index: int, image: PIL.Image.Image, next: Element) -> None:
+    def __init__(self, index: int, image: PIL.Image.Image, carousel: Carousel) -> None:
         self._image = image
         self._index = index
-        self._next = next
+        self._carousel = carousel
 
     @property
     def image(self) -> PIL.Image.Image:
@@ -63,10 +111,91 @@ class SelectChoice:
         """
         (For get_all_choices) Select this choice.
         """
-        x = self._next.x + self._next.w // 2
-        y = self._next.y + self._next.h // 2
-        for _ in range(self._index):
-            page.mouse.click(x, y)
+        self._carousel.move_to(self._index)
+
+
+@dataclass
+class SweepStats:
+    """
+    positions: slider positions visited
+    captures: positions observed (streamed frames arrive for positions where the page repainted)
+    kept: observations that changed from the previously kept one
+    """
+
+    axis: str
+    positions: int = 0
+    captures: int = 0
+    kept: int = 0
+    seconds: float = 0.0
+
+
+# Observations that differ less than this from the last kept one are dropped
+SWEEP_CHANGE_THRESHOLD = 0.001
+
+
+def sweep(
+    axis: Literal["x", "y"],
+    positions: Iterable[int],
+    fixed: int,
+    observe: Frame,
+    track_bounds: tuple[int, int],
+) -> list[SlideChoice]:
+    """
+    Move a held slider handle through `positions` along `axis` and observe `observe` at each one.
+    The moves are not interleaved with captures: frames streamed by the screencast meanwhile are
+    attributed to the last position moved to before they arrived. Without a screencast, each
+    position is captured after its move.
+    Visually identical observations (e.g., the track end, or a frame that only updates every few
+    pixels) are dropped, so fewer near-duplicate choices reach the agent.
+    """
+    stats = SweepStats(axis)
+    start_time = time.perf_counter()
+
+    observations: list[tuple[int, int, PIL.Image.Image]] = []
+    moves: list[tuple[float, int, int]] = []
+    with capture.recording() as frames:
+        for pos in positions:
+            x, y = (pos, fixed) if axis == "x" else (fixed, pos)
+            mouse.move(x, y)
+            stats.positions += 1
+            if frames is None:
+                observations.append((x, y, screenshot(observe.region)))
+            else:
+                moves.append((time.monotonic(), x, y))
+
+    if frames is not None:
+        # Positions without a frame were not repainted before the next move. Frames from before
+        # the first move are kept for it, later frames replace them if the move repainted.
+        shown: dict[int, PIL.Image.Image] = {}
+        moved_at = [moved for moved, _, _ in moves]
+        for arrived, frame in frames:
+            shown[max(0, bisect.bisect_left(moved_at, arrived) - 1)] = frame
+        observations = [
+            (x, y, capture.crop(shown[index], observe.region))
+            for index, (_, x, y) in enumerate(moves)
+            if index in shown
+        ]
+
+    stats.captures = len(observations)
+    choices: list[SlideChoice] = []
+    last_signature = None
+    for x, y, image in observations:
+        current = signature(image)
+        if last_signature is not None and difference(current, last_signature) < SWEEP_CHANGE_THRESHOLD:
+            continue
+
+        last_signature = current
+        choices.append(SlideChoice(axis, image, x, y, observe, track_bounds))
+
+    stats.kept = len(choices)
+    stats.seconds = time.perf_counter() - start_time
+    if Trace.tracing:
+        Trace.comment(
+            f"**Sweep ({axis}):** {stats.kept}/{stats.captures} observations kept "
+            f"over {stats.positions} positions in {stats.seconds:.3f} seconds"
+        )
+
+    return choices
 
 
 class SlideChoice:
@@ -103,45 +232,46 @@ class SlideChoice:
         refine_pos = self._current_x if self._axis == "x" else self._current_y
         min_bound = max(self._track_bounds[0], refine_pos - refine_range)
         max_bound = min(self._track_bounds[1], refine_pos + refine_range)
+        fixed = self._current_y if self._axis == "x" else self._current_x
 
-        choices = []
-        for pos in range(min_bound, max_bound, step):
-            if self._axis == "x":
-                page.mouse.move(x=pos, y=self._current_y)
-                image = screenshot(self._observe.region)
-                choice = SlideChoice(self._axis, image, pos, self._current_y, self._observe, (min_bound, max_bound))
-            else:
-                page.mouse.move(x=self._current_x, y=pos)
-                image = screenshot(self._observe.region)
-                choice = SlideChoice(self._axis, image, self._current_x, pos, self._observe, (min_bound, max_bound))
-
-            choices.append(choice)
-
-        return choices
+        positions = range(min_bound, max_bound, step)
+        return sweep(self._axis, positions, fixed, self._observe, (min_bound, max_bound))
 
     def release(self) -> None:
         """
         Confirm this as the final choice and release slider.
         """
-        page.mouse.move(self._current_x, self._current_y)
-        page.mouse.up()
+        mouse.move(self._current_x, self._current_y)
+        mouse.up()
 
 
 class SwapChoice:
     def __init__(
-        self, grid: list[list[Element]], image: PIL.Image.Image, start: tuple[int, int], end: tuple[int, int]
+        self, base: list[list[Element]], frame: Frame, first: tuple[int, int], second: tuple[int, int]
     ) -> None:
-        self._grid = grid
-        self._image = image
-        self._start = start
-        self._end = end
+        # A swap is a transposition of two cells over a grid shared by all choices.
+        # The swapped grid and its preview are only built when accessed.
+        self._base = base
+        self._frame = frame
+        self._first = first
+        self._second = second
+        self._grid: list[list[Element]] | None = None
+        self._preview: PIL.Image.Image | None = None
 
     @property
     def preview(self) -> PIL.Image.Image:
         """
         A preview image of the grid after swap.
         """
-        return self._image
+        if self._preview is None:
+            (r1, c1), (r2, c2) = self._first, self._second
+            e1, e2 = self._base[r1][c1], self._base[r2][c2]
+            image = self._frame.image.copy()
+            image.paste(e1.image, (e2.x - self._frame.x, e2.y - self._frame.y))
+            image.paste(e2.image, (e1.x - self._frame.x, e1.y - self._frame.y))
+            self._preview = image
+
+        return self._preview
 
     @property
     def grid(self) -> list[list[Element]]:
@@ -150,24 +280,38 @@ class SwapChoice:
         For solutions that need to compare for elements (i.e., visual identity, position) in the grid.
         For example: compare() identical elements in a row or column.
         """
+        if self._grid is None:
+            (r1, c1), (r2, c2) = self._first, self._second
+            e1, e2 = self._base[r1][c1], self._base[r2][c2]
+
+            # Only the two swapped cells are copied, every other cell is shared with the base grid.
+            swapped1, swapped2 = copy(e1), copy(e2)
+            swapped1.image, swapped2.image = e2.image, e1.image
+            swapped1.descriptor, swapped2.descriptor = e2.descriptor, e1.descriptor
+
+            grid = [list(row) for row in self._base]
+            grid[r1][c1], grid[r2][c2] = swapped1, swapped2
+            self._grid = grid
+
         return self._grid
 
     def swap(self) -> None:
         """
         Executes the swap previewed in this choice.
         """
-        x1, y1 = self._start
-        x2, y2 = self._end
+        (r1, c1), (r2, c2) = self._first, self._second
+        x1, y1 = self._base[r1][c1].center
+        x2, y2 = self._base[r2][c2].center
 
         # Attempt 1: click start and end
-        page.mouse.click(x1, y1)
-        page.mouse.click(x2, y2)
+        mouse.click(x1, y1)
+        mouse.click(x2, y2)
 
         # Attempt 2: drag start to end
-        page.mouse.move(x1, y1)
-        page.mouse.down()
-        page.mouse.move(x2, y2)
-        page.mouse.up()
+        mouse.move(x1, y1)
+        mouse.down()
+        mouse.move(x2, y2)
+        mouse.up()
 
 
 class DragChoice:
@@ -189,10 +333,10 @@ class DragChoice:
         """
         x1, y1 = self._start
         x2, y2 = self._end
-        page.mouse.move(x1, y1)
-        page.mouse.down()
-        page.mouse.move(x2, y2)
-        page.mouse.up()
+        mouse.move(x1, y1)
+        mouse.down()
+        mouse.move(x2, y2)
+        mouse.up()
 
 
 def click(target: Union[Frame, Element]) -> None:
@@ -200,32 +344,83 @@ def click(target: Union[Frame, Element]) -> None:
     Click a UI button.
     """
     x, y = target.center
-    page.mouse.click(x, y)
+    mouse.click(x, y)
 
 
-def click_and_hold(target: Union[Frame, Element], observe: Frame):
+@dataclass
+class HoldStats:
+    """
+    captured: frames captured while holding
+    yielded: frames that changed enough to be yielded
+    """
+
+    captured: int = 0
+    yielded: int = 0
+    seconds: float = 0.0
+
+
+def click_and_hold(
+    target: Union[Frame, Element],
+    observe: Frame,
+    fps: float = 10,
+    threshold: float = 0.005,
+    timeout: float = 10,
+):
     """
     Hold until release, returns observed state while holding.
     This action happens in real-time, do not batch process.
+    The frame is observed at most fps times per second and only yielded when it changed.
     Yields:
         choice (Choice): The latest frame observation.
     Example:
         for choice in click_and_hold(...):
             if ask([choice.image], "ready to release?"): break
     """
+    stats = HoldStats()
     x, y = target.center
     region = observe.region
-    page.mouse.down(x, y)
-    start_time = time.time()
-    timeout = 10
-
-    while True:
-        elapsed_time = time.time() - start_time
-        if elapsed_time > timeout:
-            break
-
-        image = screenshot(region)
-        yield Choice(image)
+    interval = 1 / fps
+    mouse.move(x, y)
+    mouse.down()
+    start_time = time.perf_counter()
+
+    # Ring buffer of the latest frames, allocated once the frame size is known
+    frames: np.ndarray | None = None
+    scratch: np.ndarray | None = None
+    slot, last_yielded = 0, None
+
+    try:
+        while True:
+            frame_time = time.perf_counter()
+            if frame_time - start_time > timeout:
+                break
+
+            # Nothing invalidates the cache while holding, always observe a new frame
+            image = screenshot(region, fresh=True)
+            stats.captured += 1
+            if frames is None:
+                frames = np.empty((4, image.height, image.width, 3), dtype=np.uint8)
+                scratch = np.empty((image.height, image.width, 3), dtype=np.int16)
+
+            np.copyto(frames[slot], np.asarray(image))
+            changed = last_yielded is None
+            if not changed:
+                np.subtract(frames[slot], frames[last_yielded], out=scratch, dtype=np.int16)
+                np.abs(scratch, out=scratch)
+                changed = scratch.mean() / 255 >= threshold
+
+            if changed:
+                last_yielded = slot
+                slot = (slot + 1) % len(frames)
+                stats.yielded += 1
+                yield Choice(image)
+
+            # Keep the capture rate at fps, time spent by the consumer counts towards the interval
+            time.sleep(max(0.0, interval - (time.perf_counter() - frame_time)))
+    finally:
+        stats.seconds = time.perf_counter() - start_time
+        if Trace.tracing:
+            Trace.comment(f"**Hold:** {stats.yielded}/{stats.captured} frames yielded in {stats.seconds:.3f} seconds")
 
 
 def get_all_choices(prev_arrow: Element, next_arrow: Element, observe: Frame) -> list[SelectChoice]:
@@ -234,52 +429,50 @@ def get_all_choices(prev_arrow: Element, next_arrow: Element, observe: Frame) ->
     Returns all cycled choices from frame.
     """
 
-    def same_as(diff: PIL.Image.Image) -> bool:
-        if not diff_with_first.getbbox():
-            return True
-        diff = diff.convert("L")
-        total_diff = sum(diff.getdata())
-        max_diff = diff.size[0] * diff.size[1] * 255
-        diff_ratio = total_diff / max_diff
-        return diff_ratio < 0.01
-
-    index = 0
+    threshold = 0.01
     region = observe.region
-    choices = [SelectChoice(index, screenshot(region), next_arrow)]
+    carousel = Carousel(prev_arrow, next_arrow)
     next_x, next_y = next_arrow.center
-    prev_x, prev_y = prev_arrow.center
+
+    image = screenshot(region)
+    choices = [SelectChoice(0, image, carousel)]
+    observed = [pixels(image)]
 
     while True:
-        page.mouse.click(next_x, next_y)
+        mouse.click(next_x, next_y)
         image = screenshot(region)
-        diff_with_first = ImageChops.difference(image, choices[0].image)
-        diff_with_prev = ImageChops.difference(image, choices[-1].image)
-
-        # Same as first means we have gone through a full cycle.
-        if same_as(diff_with_first):
+        current = pixels(image)
+
+        # Only the first choice (a full cycle) or the previous one (an end stop) ends the carousel,
+        # a look-alike option in the middle is a choice of its own
+        index = None
+        if diff_ratio(current, observed[0]) < threshold:
+            index = 0
+        elif diff_ratio(current, observed[-1]) < threshold:
+            index = len(choices) - 1
+
+        if index is not None:
+            carousel.size = len(choices)
+            # Same as prev means it has reached the end but can't cycle back, stay there.
+            carousel.cyclic = index != len(choices) - 1 or len(choices) == 1
+            carousel.position = index
             break
 
-        # Same as prev means it has reached the end but can't cycle back, manually do so.
-        if same_as(diff_with_prev):
-            for _ in range(len(choices) - 1):
-                page.mouse.click(prev_x, prev_y)
-            break
-
-        index += 1
-        choices.append(SelectChoice(index, image, next_arrow))
+        choices.append(SelectChoice(len(choices), image, carousel))
+        observed.append(current)
 
     return choices
 
 
-def drag(start: Element, end: Point) -> list[DragChoice]:
+def drag(start: Element, end: Point, lattice: int = 3, step: int = 10) -> list[DragChoice]:
     """
     Drag element from start to end point.
+    Candidates form a lattice x lattice grid around the end point, step px apart.
 
     Returns:
         drag_choices (list[DragChoice]): make minor adjustments at the endpoint.
     """
     import cv2
-    import numpy as np
 
     def get_mask(image: PIL.Image.Image) -> np.ndarray:
         image = np.array(image)
@@ -289,25 +482,29 @@ def drag(start: Element, end: Point) -> list[DragChoice]:
         mask = PIL.Image.fromarray(mask).convert("L")
         return mask
 
+    if lattice < 1 or step < 1:
+        raise ValueError("drag() needs lattice >= 1 and step >= 1")
+
     x2, y2 = end.center
+    margin = 20
+    width, height = start.w + margin * 2, start.h + margin * 2
+    # Offsets centered at (x, y), e.g. -10, 0, 10 for the default 3 x 3 grid
+    offsets = [round((i - (lattice - 1) / 2) * step) for i in range(lattice)]
+
+    # Capture the union of all candidate regions once and crop each preview from it
+    left = x2 + offsets[0] - start.w // 2 - margin
+    top = y2 + offsets[0] - start.h // 2 - margin
+    span = offsets[-1] - offsets[0]
+    union = screenshot([left, top, width + span, height + span])
+    mask = get_mask(start.image)
+
     choices = []
-    step = 10
-    # Create 3 x 3 choices centered at (x, y) with step size 10px
-    for i in range(-1, 2):
-        for j in range(-1, 2):
-            cx = x2 + i * step
-            cy = y2 + j * step
-            margin = 20
-            region = [
-                cx - start.w // 2 - margin,
-                cy - start.h // 2 - margin,
-                start.w + margin * 2,
-                start.h + margin * 2,
-            ]
-            mask = get_mask(start.image)
-            image = screenshot(region)
+    for dx in offsets:
+        for dy in offsets:
+            x, y = dx - offsets[0], dy - offsets[0]
+            image = union.crop((x, y, x + width, y + height))
             image.paste(start.image, box=(margin, margin), mask=mask)
-            choices.append(DragChoice(image, start.center, end=(cx, cy)))
+            choices.append(DragChoice(image, start.center, end=(x2 + dx, y2 + dy)))
 
     return choices
 
@@ -320,15 +517,15 @@ def draw(path: list[Point]) -> None:
         return
 
     x, y = path[0]
-    page.mouse.move(x, y)
-    page.mouse.down()
+    mouse.move(x, y)
+    mouse.down()
 
     for point in path:
-        page.mouse.move(point.x, point.y)
+        mouse.move(point.x, point.y)
 
     x, y = path[-1]
-    page.mouse.move(x, y)
-    page.mouse.up()
+    mouse.move(x, y)
+    mouse.up()
 
 
 def enter(field: Union[Frame, Element], text: str) -> None:
@@ -336,8 +533,8 @@ def enter(field: Union[Frame, Element], text: str) -> None:
     Click on an input field and enter text.
     """
     x, y = field.center
-    page.mouse.click(x, y)
-    page.keyboard.type(text)
+    mouse.click(x, y)
+    keyboard.type(text)
 
 
 def point(to: Point) -> None:
@@ -345,7 +542,7 @@ def point(to: Point) -> None:
     Click on a point on a frame.
     """
     x, y = to.center
-    page.mouse.click(x, y)
+    mouse.click(x, y)
 
 
 def select(choice: Union[Frame, Element]) -> None:
@@ -353,7 +550,7 @@ def select(choice: Union[Frame, Element]) -> None:
     Select a choice.
     """
     x, y = choice.center
-    page.mouse.click(x, y)
+    mouse.click(x, y)
 
 
 def slide_x(handle: Element, direction: Literal["left", "right"], observe_frame: Frame) -> list[SlideChoice]:
@@ -367,21 +564,19 @@ def slide_x(handle: Element, direction: Literal["left", "right"], observe_frame:
     step_size = handle.w // 2
     step = -step_size if direction == "left" else step_size
 
-    choices = []
     current_x = handle.x + handle.w // 2
     current_y = handle.y + handle.h // 2
-    page.mouse.move(current_x, current_y)
-    page.mouse.down()
+    mouse.move(current_x, current_y)
+    mouse.down()
 
-    while track_bounds[0] < current_x + handle.w < track_bounds[1]:
-        current_x += step
-        page.mouse.move(current_x, current_y)
-        image = screenshot(observe_frame.region)
-        refine_range = [track_bounds[0] + step, track_bounds[1] - step]
-        choice = SlideChoice("x", image, current_x, current_y, observe_frame, refine_range)
-        choices.append(choice)
+    def positions() -> Iterator[int]:
+        x = current_x
+        while track_bounds[0] < x + handle.w < track_bounds[1]:
+            x += step
+            yield x
 
-    return choices
+    refine_range = (track_bounds[0] + step, track_bounds[1] - step)
+    return sweep("x", positions(), current_y, observe_frame, refine_range)
 
 
 def slide_y(handle: Element, direction: Literal["up", "down"], observe_frame: Frame) -> list[SlideChoice]:
@@ -395,28 +590,26 @@ def slide_y(handle: Element, direction: Literal["up", "down"], observe_frame: Fr
     step_size = handle.h // 2
     step = -step_size if direction.lower() == "down" else step_size
 
-    choices = []
     current_x = handle.x + handle.w // 2
     current_y = handle.y + handle.h // 2
-    page.mouse.move(current_x, current_y)
-    page.mouse.down()
+    mouse.move(current_x, current_y)
+    mouse.down()
 
-    while track_bounds[0] < current_y + step < track_bounds[1]:
-        page.mouse.move(current_x, current_y)
-        image = screenshot(observe_frame.region)
-        choice = SlideChoice("y", image, current_x, current_y, observe_frame, track_bounds)
-        choices.append(choice)
-        current_y += step
+    def positions() -> Iterator[int]:
+        y = current_y
+        while track_bounds[0] < y + step < track_bounds[1]:
+            yield y
+            y += step
 
-    return choices
+    return sweep("y", positions(), current_x, observe_frame, track_bounds)
 
 
-def explore(grid: Frame) -> list[SwapChoice]:
+def explore(grid: Frame) -> Iterator[SwapChoice]:
     """
     Get all possible ways to swap elements in the grid.
 
     Returns:
-        choices (list[Choice]): all possible swaps.
+        choices (Iterator[Choice]): all possible swaps, nearest swaps first.
     """
     # Step 1: build the grid of elements
     elements = sorted(grid.interactables, key=lambda e: e.y)
@@ -432,38 +625,24 @@ def explore(grid: Frame) -> list[SwapChoice]:
 
     element_grid: list[list[Element]] = [sorted(row, key=lambda el: el.x) for row in rows]
 
-    # Step 2: get all possible swaps ordered by swap distance
+    # Step 2: compare all tiles once, swapping matching tiles would not change the grid.
+    # Matching is not transitive, only pairs that match themselves are skipped.
     rows, cols = len(rows), len(rows[-1])
-    choices_by_distance = {d: [] for d in range(1, rows + cols)}
     all_cells = list(itertools.product(range(rows), range(cols)))
+    matches = match_matrix([element_grid[r][c] for r, c in all_cells])
+    index = {cell: i for i, cell in enumerate(all_cells)}
 
-    for (r1, c1), (r2, c2) in itertools.combinations(all_cells, 2):
-        if match(element_grid[r1][c1], element_grid[r2][c2]):
-            continue
-
-        manhattan_distance = abs(r1 - r2) + abs(c1 - c2)
-        swapped_grid = deepcopy(element_grid)
-
-        # Update grid image
-        image = grid.image.copy()
-        image.paste(swapped_grid[r1][c1].image, (swapped_grid[r2][c2].x - grid.x, swapped_grid[r2][c2].y - grid.y))
-        image.paste(swapped_grid[r2][c2].image, (swapped_grid[r1][c1].x - grid.x, swapped_grid[r1][c1].y - grid.y))
+    # Step 3: yield all possible swaps ordered by swap distance (stable within the same distance)
+    pairs = sorted(
+        itertools.combinations(all_cells, 2),
+        key=lambda pair: abs(pair[0][0] - pair[1][0]) + abs(pair[0][1] - pair[1][1]),
+    )
 
-        # Swap elements
-        swapped_grid[r1][c1].image, swapped_grid[r2][c2].image = swapped_grid[r2][c2].image, swapped_grid[r1][c1].image
-        swap_from = (
-            swapped_grid[r1][c1].x + swapped_grid[r1][c1].w // 2,
-            swapped_grid[r1][c1].y + swapped_grid[r1][c1].h // 2,
-        )
-        swap_to = (
-            swapped_grid[r2][c2].x + swapped_grid[r2][c2].w // 2,
-            swapped_grid[r2][c2].y + swapped_grid[r2][c2].h // 2,
-        )
-
-        choice = SwapChoice(swapped_grid, image, swap_from, swap_to)
-        choices_by_distance[manhattan_distance].append(choice)
+    for (r1, c1), (r2, c2) in pairs:
+        if matches[index[(r1, c1)], index[(r2, c2)]]:
+            continue
 
-    return [choice for choices in choices_by_distance.values() for choice in choices]
+        yield SwapChoice(element_grid, grid, (r1, c1), (r2, c2))
 
 
 dependencies = {**globals(), "__builtins__": __builtins__, "List": List}
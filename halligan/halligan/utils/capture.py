@@ -0,0 +1,207 @@
+"""
+Screen capture for action tools.
+
+`page.screenshot(clip=...)` encodes and decodes a PNG for every observation, and tools such as
+slide_x, drag and get_all_choices take dozens of them per challenge. `ScreenCapture` grabs the
+whole viewport through a CDP session and serves sub-region crops from that frame until the next
+mouse/keyboard event (or `max_age`) invalidates it.
+
+Frames are PNG by default: tools diff consecutive observations against small thresholds, and
+lossy encodings add noise of that order. Only input sent through `InvalidatingInput` invalidates
+the cached frame, any other input (locator clicks, `page.mouse`) must be followed by `invalidate()`.
+
+Tools that observe while moving (e.g., sweep) use `recording()` to collect the frames pushed by
+the screencast during their input, instead of waiting for a capture after every event.
+"""
+
+from __future__ import annotations
+
+import base64
+import io
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, Literal
+
+import numpy as np
+import PIL.Image
+from playwright.sync_api import Page
+
+from halligan.runtime.accounting import current_meter, record
+
+
+class ScreenCapture:
+    def __init__(
+        self,
+        page: Page,
+        *,
+        format: Literal["jpeg", "png", "webp"] = "png",
+        quality: int = 90,
+        max_age: float = 0.5,
+        screencast: bool = False,
+    ) -> None:
+        """
+        Args:
+            format/quality: CDP encoding of captured frames, lossy formats are only fit for display
+            max_age: seconds a cached frame is served without input events, pages also animate on their own
+            screencast: keep the latest frame pushed by `Page.startScreencast` instead of polling for it
+        """
+        self.page = page
+        self.format = format
+        self.quality = quality
+        self.max_age = max_age
+        self.screencast = False
+        self.captures = 0
+
+        self._frame: PIL.Image.Image | None = None
+        self._frame_time = 0.0
+        self._invalidated_at = 0.0
+        self._screencast_frame: tuple[float, PIL.Image.Image] | None = None
+        self._recording: list[tuple[float, PIL.Image.Image]] | None = None
+
+        # CDP is only available on Chromium, other browsers fall back to page.screenshot()
+        try:
+            self._session = page.context.new_cdp_session(page)
+        except Exception:
+            self._session = None
+
+        if self._session is not None:
+            self._session.on("Page.screencastFrame", self._on_screencast_frame)
+            if screencast:
+                self._session.send("Page.startScreencast", self._encoding())
+                self.screencast = True
+
+    def _encoding(self) -> dict[str, Any]:
+        params: dict[str, Any] = {"format": self.format}
+        if self.format != "png":
+            params["quality"] = self.quality
+        return params
+
+    def _on_screencast_frame(self, event: dict[str, Any]) -> None:
+        image = PIL.Image.open(io.BytesIO(base64.b64decode(event["data"]))).convert("RGB")
+        self._screencast_frame = (time.monotonic(), image)
+        if self._recording is not None:
+            self._recording.append(self._screencast_frame)
+        self._session.send("Page.screencastFrameAck", {"sessionId": event["sessionId"]})
+
+    def _capture(self) -> PIL.Image.Image:
+        # Screencast frames are only valid if they were pushed after the last input event
+        if self._screencast_frame and self._screencast_frame[0] > self._invalidated_at:
+            return self._screencast_frame[1]
+
+        # Only actual captures count, frames served from the cache are free
+        self.captures += 1
+        record("screenshots")
+        if self._session is None:
+            return PIL.Image.open(io.BytesIO(self.page.screenshot())).convert("RGB")
+
+        params = {**self._encoding(), "fromSurface": True, "captureBeyondViewport": False}
+        data = self._session.send("Page.captureScreenshot", params)["data"]
+        return PIL.Image.open(io.BytesIO(base64.b64decode(data))).convert("RGB")
+
+    def invalidate(self) -> None:
+        """Drop the cached frame, the next grab() captures the screen again."""
+        self._frame = None
+        self._invalidated_at = time.monotonic()
+
+    @contextmanager
+    def recording(self, settle: float = 0.1) -> Iterator[list[tuple[float, PIL.Image.Image]] | None]:
+        """
+        Collect the screencast frames pushed while the context is open, as (arrival time, frame) pairs.
+        The screencast runs for the duration if it was not started, and frames are awaited for
+        `settle` seconds on exit. Yields None without CDP, observe with grab() instead.
+        """
+        if self._session is None:
+            yield None
+            return
+
+        frames: list[tuple[float, PIL.Image.Image]] = []
+        self._recording = frames
+        if not self.screencast:
+            self._session.send("Page.startScreencast", self._encoding())
+        try:
+            yield frames
+            # Screencast events are only dispatched while the page is waited on
+            self.page.wait_for_timeout(settle * 1000)
+        finally:
+            self._recording = None
+            if not self.screencast:
+                self._session.send("Page.stopScreencast")
+                # Frames stop with the screencast, the last one would be served after the page changed
+                self._screencast_frame = None
+
+    def crop(self, frame: PIL.Image.Image, region: list[float]) -> PIL.Image.Image:
+        """Crop a region given as [x, y, width, height] in page coordinates out of a captured frame."""
+        # Captured frames are in device pixels
+        viewport = self.page.viewport_size
+        scale = frame.width / viewport["width"] if viewport else 1.0
+        x, y, w, h = region
+        box = (round(x * scale), round(y * scale), round((x + w) * scale), round((y + h) * scale))
+        return frame.crop(box)
+
+    def grab(self, region: list[float] | None = None, *, fresh: bool = False) -> PIL.Image.Image:
+        """
+        Get the current screen, or a region of it as [x, y, width, height] in page coordinates.
+        `fresh` always captures a new frame (e.g., when observing a page that changes without input).
+        """
+        now = time.monotonic()
+        if fresh or self._frame is None or now - self._frame_time > self.max_age:
+            self._frame = self._capture()
+            self._frame_time = now
+
+        if region is None:
+            return self._frame.copy()
+        return self.crop(self._frame, region)
+
+
+class InvalidatingInput:
+    """
+    Forwards calls to a page input device (mouse/keyboard) and invalidates
+    the capture cache after each of them. Every call is tallied as `input_events` by the
+    current meter, so that a failed program is known to have changed the page.
+    """
+
+    def __init__(self, device: Any, capture: ScreenCapture) -> None:
+        self._device = device
+        self._capture = capture
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._device, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self._capture.invalidate()
+                if (meter := current_meter()) is not None:
+                    meter.tally("input_events")
+
+        return call
+
+
+def signature(image: PIL.Image.Image, size: int = 32) -> np.ndarray:
+    """Small grayscale thumbnail of an observation, compared with `difference`."""
+    thumbnail = image.convert("L").resize((size, size), PIL.Image.Resampling.BILINEAR)
+    return np.asarray(thumbnail, dtype=np.int16)
+
+
+def difference(a: np.ndarray, b: np.ndarray) -> float:
+    """Mean absolute difference of two signatures, between 0 (identical) and 1."""
+    return float(np.abs(a - b).mean()) / 255
+
+
+# ITU-R 601-2 luma weights, as used by PIL's convert("L")
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def pixels(image: PIL.Image.Image) -> np.ndarray:
+    """RGB pixels of an observation as a signed array, compared with `diff_ratio`."""
+    return np.asarray(image.convert("RGB"), dtype=np.int16)
+
+
+def diff_ratio(a: np.ndarray, b: np.ndarray) -> float:
+    """Luma of the absolute difference of two `pixels` arrays, as a ratio of the maximum difference."""
+    if a.shape != b.shape:
+        return 1.0
+    return float((np.abs(a - b) @ _LUMA).mean()) / 255
@@ -32,3 +32,14 @@ def get(interactable: str) -> str:
     Get in-context learning examples based on interactable type.
     """
     return _EXAMPLES[interactable]
+
+
+def get_all() -> list[tuple[list[str], str]]:
+    """
+    All distinct in-context examples, with the interactable types that use each one.
+    """
+    examples: dict[str, list[str]] = {}
+    for interactable, example in _EXAMPLES.items():
+        examples.setdefault(example, []).append(interactable)
+    examples.setdefault(_get_example("generic.txt"), [])
+    return [(interactables, example) for example, interactables in examples.items()]
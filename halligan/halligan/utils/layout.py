@@ -312,6 +312,9 @@ class Element(Component):
         self.parent = parent
         self.retrieved = False
 
+        # Cached visual descriptor of the image (see vision_tools.describe), reset when the image changes
+        self.descriptor = None
+
         if not self.is_within(parent):
             raise ValueError(f"{self} must be within {parent}")
 
@@ -325,6 +328,7 @@ class Element(Component):
     @image.setter
     def image(self, value):
         self._image = value
+        self.descriptor = None
 
     def set_element_as(self, interactable: str) -> None:
         """
@@ -1,16 +1,20 @@
-import base64
+import asyncio
 import hashlib
-import io
+import json
 import os
 import platform
+import re
 import sys
+import threading
+from contextvars import ContextVar
 from datetime import datetime, timezone
 from importlib.metadata import distributions
 from timeit import default_timer as timer
 
-import nbformat as nbf
 import PIL.Image
 
+from halligan.utils.trace_writer import TraceWriter
+
 
 def get_python_version() -> str:
     version_info = sys.version_info
@@ -26,41 +30,37 @@ def get_python_env_hash() -> str:
     return hash_object.hexdigest()
 
 
-def get_image_tag(image: PIL.Image.Image) -> str:
-    buffer = io.BytesIO()
-    image.save(buffer, format="PNG")
-    image_b64 = base64.b64encode(buffer.getvalue()).decode()
-    return f'<img src="data:image/png;base64,{image_b64}"/>'
-
-
-def get_image_grid(images: list[PIL.Image.Image], image_captions: list[str], columns=5) -> str:
-    image_htmls = []
-    for image, caption in zip(images, image_captions):
-        image_html = f"<div>{get_image_tag(image)}<p>{caption}</p></div>"
-        image_htmls.append(image_html)
-
-    return f"""
-    <div style="
-        display: grid;
-        grid-template-columns: repeat({columns}, auto);
-        column-gap: 10px;
-        row-gap: 10px;">
-        {"".join(image_htmls)}
-    </div>
-    """
-
-
 PYTHON_VERSION = get_python_version()
 PYTHON_ENV_HASH = get_python_env_hash()
 
 
-class Trace:
-    tracing = False
-
-    @classmethod
-    def start(cls, captcha: PIL.Image.Image, path: str = None) -> None:
-        cls.notebook = nbf.v4.new_notebook()
-        cls.timestamp = datetime.now().strftime("%y%m%d-%H%M%S")
+def trace_path(directory: str, name: str, id: int | str | None = None, worker: str | None = None) -> str:
+    """
+    A notebook path in `directory` unique to this run: `<name>[-<id>]-<worker>-<attempt>.ipynb`.
+    The worker defaults to the process and the asyncio task or thread, the attempt is the first unused one.
+    """
+    if worker is None:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        worker = f"{os.getpid()}-{task.get_name() if task else threading.current_thread().name}"
+
+    parts = [name.replace("/", "_")] + ([str(id)] if id is not None else []) + [worker]
+    stem = os.path.join(directory, re.sub(r"[^\w.-]", "_", "-".join(parts)))
+    attempt = 0
+    while os.path.exists(f"{stem}-{attempt}.ipynb") or os.path.exists(f"{stem}-{attempt}.cells.jsonl"):
+        attempt += 1
+    return f"{stem}-{attempt}.ipynb"
+
+
+class TraceSession:
+    """One trace, written as a notebook by a background `TraceWriter`."""
+
+    def __init__(self, captcha: PIL.Image.Image, path: str | None = None, *, thumbnail: int | None = None) -> None:
+        self.timestamp = datetime.now().strftime("%y%m%d-%H%M%S")
+        self.writer = TraceWriter(path or f"trace-{self.timestamp}.ipynb", thumbnail=thumbnail)
+        self.summaries: dict = {}
         header = (
             "# Execution Trace\n"
             f"- **Start Timestamp (UTC)**: {datetime.now(timezone.utc).isoformat()}\n"
@@ -68,43 +68,84 @@ class Trace:
             f"- **Machine**: {platform.machine()}\n"
             f"- **Python Info**: {PYTHON_VERSION}\n"
             f"- **Python Environment Hash**: {PYTHON_ENV_HASH}\n"
-            f"- **CAPTCHA**:\n\n"
-            f"{get_image_tag(captcha)}"
+            f"- **CAPTCHA**:"
         )
-        cls.cells: list = cls.notebook.get("cells", [])
-        cls.cells.append(nbf.v4.new_markdown_cell(header))
-        cls.tracing = True
-        cls.path = path
+        self.put({"cell": "markdown", "source": header, "images": [captcha], "captions": [""]})
+
+    @property
+    def path(self) -> str:
+        return self.writer.path
+
+    def put(self, record: dict) -> None:
+        self.writer.put(record)
+
+    def close(self) -> None:
+        name = self.writer.close()
+        if self.summaries:
+            with open(os.path.splitext(name)[0] + ".json", "w") as file:
+                json.dump(self.summaries, file, indent=2)
+
+
+_session: ContextVar[TraceSession | None] = ContextVar("halligan_trace", default=None)
+
+
+class _TraceMeta(type):
+    @property
+    def tracing(cls) -> bool:
+        return _session.get() is not None
+
+    @property
+    def session(cls) -> TraceSession | None:
+        return _session.get()
+
+
+class Trace(metaclass=_TraceMeta):
+    """
+    Execution tracing, bound to the current context like `accounting.metering`.
+
+    `start` binds a new `TraceSession` to the calling thread or asyncio task, and the decorators
+    and `comment`/`summary` write to the session of the context they run in. Concurrent solves
+    therefore trace to their own notebooks (see `trace_path`), and threads started with a copy of
+    the context (e.g., `pforeach`) trace to the session of the solve that started them.
+    `thumbnail` stores images as JPEGs of at most that many pixels instead of full PNGs.
+    """
+
+    @classmethod
+    def start(cls, captcha: PIL.Image.Image, path: str = None, *, thumbnail: int | None = None) -> TraceSession:
+        session = TraceSession(captcha, path, thumbnail=thumbnail)
+        _session.set(session)
+        return session
 
     @classmethod
     def agent(cls):
         def decorator(func):
-            def wrapper(self, prompt: str, images: list[PIL.Image.Image] = [], image_captions: list[str] = []):
-                if not cls.tracing:
-                    return func(self, prompt, images, image_captions)
+            def wrapper(
+                self, prompt: str, images: list[PIL.Image.Image] = [], image_captions: list[str] = [], **kwargs
+            ):
+                session = _session.get()
+                if session is None:
+                    return func(self, prompt, images, image_captions, **kwargs)
 
                 start_time = timer()
-                response, metadata = func(self, prompt, images, image_captions)
+                response, metadata = func(self, prompt, images, image_captions, **kwargs)
                 end_time = timer()
                 execution_time = end_time - start_time
 
-                prompt_cell = nbf.v4.new_code_cell(source=f"PROMPT = '''\n{prompt}\n'''")
-                images_cell = nbf.v4.new_code_cell(
-                    source=f"IMAGES = {len(images)}",
-                    outputs=[
-                        nbf.v4.new_output(
-                            output_type="display_data",
-                            data={"text/html": get_image_grid(images, image_captions)},
-                            metadata={},
-                        )
-                    ],
-                )
-
-                metadata = "\n".join(f"{key.upper()} = {value}" for key, value in metadata.items())
-                response = f"RESPONSE = '''\n{response}\n'''\nTIME = {execution_time}\n" + metadata
-                response_cell = nbf.v4.new_code_cell(source=response)
-                divider_cell = nbf.v4.new_markdown_cell("---")
-                cls.cells.extend([prompt_cell, images_cell, response_cell, divider_cell])
+                images = list(images or [])
+                details = "\n".join(f"{key.upper()} = {value}" for key, value in metadata.items())
+                source = f"RESPONSE = '''\n{response}\n'''\nTIME = {execution_time}\n" + details
+                for record in (
+                    {"cell": "code", "source": f"PROMPT = '''\n{prompt}\n'''"},
+                    {
+                        "cell": "code",
+                        "source": f"IMAGES = {len(images)}",
+                        "images": images,
+                        "captions": list(image_captions or []),
+                    },
+                    {"cell": "code", "source": source},
+                    {"cell": "markdown", "source": "---"},
+                ):
+                    session.put(record)
 
                 return response, metadata
 
@@ -116,19 +157,18 @@ class Trace:
     def section(cls, title: str):
         def decorator(func):
             def wrapper(*args, **kwargs):
-                if not cls.tracing:
+                session = _session.get()
+                if session is None:
                     return func(*args, **kwargs)
 
-                cell = nbf.v4.new_markdown_cell(f"## {title}")
-                cls.cells.append(cell)
+                session.put({"cell": "markdown", "source": f"## {title}"})
 
                 start_time = timer()
                 result = func(*args, **kwargs)
                 end_time = timer()
                 execution_time = end_time - start_time
 
-                cell = nbf.v4.new_markdown_cell(f"**Section Time:** {execution_time:.3f} seconds")
-                cls.cells.append(cell)
+                session.put({"cell": "markdown", "source": f"**Section Time:** {execution_time:.3f} seconds"})
 
                 return result
 
@@ -138,20 +178,21 @@ class Trace:
 
     @classmethod
     def comment(cls, markdown: str):
-        cell = nbf.v4.new_markdown_cell(markdown)
-        cls.cells.append(cell)
+        session = _session.get()
+        if session is not None:
+            session.put({"cell": "markdown", "source": markdown})
+
+    @classmethod
+    def summary(cls, key: str, data: dict):
+        """Machine-readable data, written next to the notebook as JSON (e.g., `trace.ipynb` -> `trace.json`)."""
+        session = _session.get()
+        if session is not None:
+            session.summaries[key] = data
 
     @classmethod
     def stop(cls):
-        if cls.path:
-            directory = os.path.dirname(cls.path)
-            os.makedirs(directory, exist_ok=True)
-            nbf.write(cls.notebook, cls.path)
-        else:
-            name = f"trace-{cls.timestamp}.ipynb"
-            nbf.write(cls.notebook, name)
-
-        cls.notebook = None
-        cls.cells = None
-        cls.timestamp = None
-        cls.tracing = False
+        session = _session.get()
+        if session is None:
+            return
+        _session.set(None)
+        session.close()
@@ -0,0 +1,74 @@
+"""
+Pack several small images into one labelled contact sheet.
+
+Sending 9-16 small crops as separate image parts makes the per-image overhead dominate
+prompt tokens and upload size. A contact sheet carries the same pixels in a single image
+part, each cell labelled so the agent can answer per image.
+"""
+
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass
+
+import PIL.Image
+from PIL import ImageDraw, ImageFont
+
+
+@dataclass(frozen=True)
+class Packing:
+    """
+    Contact sheet settings used by vision tools (see `vision_tools.set_packing`).
+
+    cell_size: maximum side (px) of each image inside its cell
+    min_images: calls with fewer images are sent image by image
+    """
+
+    cell_size: int = 192
+    min_images: int = 4
+    label_height: int = 24
+    padding: int = 8
+
+
+def pack(images: list[PIL.Image.Image], labels: list[str], packing: Packing = Packing()) -> PIL.Image.Image:
+    """
+    Compose `images` into a grid of labelled cells, row by row in list order.
+    Images are downscaled (never upscaled) to fit `packing.cell_size`.
+    """
+    if len(images) != len(labels):
+        raise ValueError("Each packed image needs exactly one label")
+
+    columns = max(1, math.ceil(math.sqrt(len(images))))
+    rows = max(1, math.ceil(len(images) / columns))
+    cell_w = packing.cell_size + packing.padding * 2
+    cell_h = packing.cell_size + packing.padding * 2 + packing.label_height
+
+    sheet = PIL.Image.new("RGB", (columns * cell_w, rows * cell_h), (255, 255, 255))
+    draw = ImageDraw.Draw(sheet)
+    font = ImageFont.load_default(size=packing.label_height - 6)
+
+    for index, (image, label) in enumerate(zip(images, labels)):
+        row, column = divmod(index, columns)
+        x, y = column * cell_w, row * cell_h
+
+        thumbnail = image.convert("RGB")
+        thumbnail.thumbnail((packing.cell_size, packing.cell_size))
+        offset_x = x + packing.padding + (packing.cell_size - thumbnail.width) // 2
+        offset_y = y + packing.label_height + packing.padding + (packing.cell_size - thumbnail.height) // 2
+        sheet.paste(thumbnail, (offset_x, offset_y))
+
+        # Label band above the image, and a border so that neighbouring cells are not confused
+        draw.rectangle([x, y, x + cell_w - 1, y + packing.label_height], fill=(0, 0, 0))
+        draw.text((x + packing.padding, y + 3), label, fill=(255, 255, 255), font=font)
+        draw.rectangle([x, y, x + cell_w - 1, y + cell_h - 1], outline=(0, 0, 0), width=2)
+
+    return sheet
+
+
+def unpack_answers(answers: list, count: int, default) -> list:
+    """
+    Map answers given in label order back onto the packed images.
+    Missing answers fall back to `default`, extra answers are dropped.
+    """
+    answers = list(answers)[:count]
+    return answers + [default] * (count - len(answers))
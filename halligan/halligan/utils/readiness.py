@@ -0,0 +1,101 @@
+"""
+Wait for a benchmark CAPTCHA to be ready before it is observed.
+
+Challenges are loaded asynchronously (the checkbox click fetches the challenge, builds an
+iframe and fades it in), so a fixed sleep is either too long or too short. Readiness is
+the DOM signal set by the benchmark template once the challenge is inserted, followed by
+the CAPTCHA region becoming visually stable (transitions, fade-ins and images finished).
+"""
+
+from __future__ import annotations
+
+import io
+import time
+
+import PIL.Image
+from playwright.sync_api import Error, Page
+
+from halligan.utils.capture import difference, signature
+
+# Selectors set by the benchmark templates (benchmark/apis/*/static/script.js) once the challenge is shown
+READY_SELECTORS: dict[str, str] = {
+    # Captcha() toggles the wrapper's `show` class after appending the challenge iframe
+    "recaptchav2": "#challenge-wrapper.show iframe",
+    # Captcha() sets #test to visible after appending the challenge iframe
+    "hcaptcha": '#test[style*="visibility: visible"] iframe',
+    # Captcha() sets the challenge image once ./challenge/<id> is fetched
+    "mtcaptcha": '#mtcap-image-1[style*="base64"]',
+}
+
+
+def wait_until_stable(
+    page: Page,
+    region: dict | None = None,
+    timeout: float = 5.0,
+    interval: float = 0.1,
+    stable_frames: int = 2,
+    threshold: float = 0.001,
+) -> bool:
+    """
+    Wait until `stable_frames` consecutive captures of `region` (the viewport if None)
+    differ less than `threshold`. Returns False if the region is still changing after `timeout` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    previous, stable = None, 0
+
+    while True:
+        image = PIL.Image.open(io.BytesIO(page.screenshot(clip=region)))
+        current = signature(image, size=64)
+        if previous is not None and difference(current, previous) < threshold:
+            stable += 1
+            if stable >= stable_frames:
+                return True
+        else:
+            stable = 0
+
+        previous = current
+        if time.monotonic() + interval > deadline:
+            return False
+        page.wait_for_timeout(interval * 1000)
+
+
+def wait_until_ready(page: Page, captcha_type: str, region: dict | None = None, timeout: float = 10.0) -> bool:
+    """
+    Wait for the challenge of `captcha_type` to be shown, then for `region` to stop changing.
+    Returns False on timeout, in which case the caller proceeds with whatever is on screen.
+    """
+    deadline = time.monotonic() + timeout
+    selector = next((selector for name, selector in READY_SELECTORS.items() if name in captcha_type), None)
+
+    if selector is not None:
+        try:
+            page.wait_for_selector(selector, state="attached", timeout=timeout * 1000)
+        except Error:
+            return False
+
+    return wait_until_stable(page, region, timeout=max(0.0, deadline - time.monotonic()))
+
+
+def prepare_captcha(captcha_type: str, page: Page, region: dict | None = None) -> bool:
+    """
+    For the recaptchav2, hcaptcha, and arkose CAPTCHA types,
+    an initial prompt or verification screen (such as a "click to begin" button) appears before the main challenge.
+    This preliminary step is automatically bypassed, and is not included in the evaluation.
+
+    Returns whether the challenge was detected as ready (see `wait_until_ready`).
+    """
+    if "recaptchav2" in captcha_type:
+        checkbox = page.frame_locator("#checkbox")
+        checkbox.locator("#recaptcha-anchor").click()
+        return wait_until_ready(page, captcha_type, region)
+    elif "hcaptcha" in captcha_type:
+        checkbox = page.frame_locator("#checkbox")
+        checkbox.locator("#anchor").click()
+        return wait_until_ready(page, captcha_type, region)
+    elif "arkose" in captcha_type:
+        frame = page.frame_locator("#funcaptcha")
+        frame.locator(".start-button").click()
+    elif "mtcaptcha" in captcha_type:
+        return wait_until_ready(page, captcha_type, region)
+
+    return True
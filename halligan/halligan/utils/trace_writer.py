@@ -0,0 +1,145 @@
+"""
+Background writer of execution traces.
+
+Encoding every traced image as base64 PNG on the solving thread slowed runs down and made
+notebooks many MB large. `Trace` now only queues records (markdown or code, with the PIL
+images to show), and a `TraceWriter` thread renders them:
+
+- images are stored once under `images/` next to the notebook, named by a digest of their
+  pixels, so the same screenshot in many cells or traces is written once; cells reference
+  them by relative path. `thumbnail` stores downscaled JPEGs instead of full PNGs.
+- cells are appended to `<trace>.cells.jsonl` as they come, so a crash keeps a partial trace
+  (see `assemble`); the notebook is assembled from it, and it is removed, when the writer is closed.
+
+The queue is bounded: when the writer falls behind, tracing blocks instead of piling up images.
+Images are copied when they are queued, since callers may keep drawing on them while the
+writer encodes them.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import queue
+import threading
+from typing import Any
+
+import nbformat as nbf
+import PIL.Image
+
+# Records waiting to be written, tracing blocks when the writer is this far behind
+QUEUE_SIZE = 256
+
+IMAGES_DIR = "images"
+
+
+class ImageStore:
+    """Content-addressed image files in `directory`, optionally as JPEG thumbnails of at most `thumbnail` px."""
+
+    def __init__(self, directory: str, thumbnail: int | None = None) -> None:
+        self.directory = directory
+        self.thumbnail = thumbnail
+        os.makedirs(directory, exist_ok=True)
+
+    def put(self, image: PIL.Image.Image) -> str:
+        """Store `image` unless it already is, returns its file name."""
+        digest = hashlib.sha256(f"{image.mode}{image.size}".encode())
+        digest.update(image.tobytes())
+        name = f"{digest.hexdigest()[:24]}.{'jpg' if self.thumbnail else 'png'}"
+        path = os.path.join(self.directory, name)
+        if os.path.exists(path):
+            return name
+
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        if self.thumbnail:
+            image = image.convert("RGB")
+            image.thumbnail((self.thumbnail, self.thumbnail))
+            image.save(tmp, format="JPEG", quality=80)
+        else:
+            image.save(tmp, format="PNG")
+        os.replace(tmp, path)
+        return name
+
+
+def image_grid(sources: list[str], captions: list[str], columns: int = 5) -> str:
+    items = "".join(f'<div><img src="{src}"/><p>{caption}</p></div>' for src, caption in zip(sources, captions))
+    style = f"display: grid; grid-template-columns: repeat({columns}, auto); column-gap: 10px; row-gap: 10px;"
+    return f'<div style="{style}">{items}</div>'
+
+
+class TraceWriter:
+    """
+    Writes the records of one trace to `path` (.ipynb) on a background thread.
+
+    Records are dicts with `cell` ("markdown" or "code"), `source`, and optionally `images`
+    and `captions`. Images of markdown cells are shown below the text, those of code cells
+    as the cell's output.
+    """
+
+    def __init__(self, path: str, *, thumbnail: int | None = None, queue_size: int = QUEUE_SIZE) -> None:
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.cells_path = os.path.splitext(path)[0] + ".cells.jsonl"
+        self.images = ImageStore(os.path.join(directory, IMAGES_DIR), thumbnail)
+        self.errors = 0
+
+        self._queue: queue.Queue[dict[str, Any] | None] = queue.Queue(maxsize=queue_size)
+        self._file = open(self.cells_path, "w")
+        self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, record: dict[str, Any]) -> None:
+        if record.get("images"):
+            record = {**record, "images": [image.copy() for image in record["images"]]}
+        self._queue.put(record)
+
+    def _run(self) -> None:
+        while (record := self._queue.get()) is not None:
+            try:
+                self._file.write(json.dumps(self._render(record)) + "\n")
+                self._file.flush()
+            except Exception:
+                # A broken record must not stop the trace, nor the run
+                self.errors += 1
+
+    def _render(self, record: dict[str, Any]) -> dict[str, Any]:
+        images = record.get("images") or []
+        captions = record.get("captions") or [f"Image {i}" for i in range(len(images))]
+        sources = [f"{IMAGES_DIR}/{self.images.put(image)}" for image in images]
+
+        if record["cell"] == "markdown":
+            source = record["source"] + ("\n\n" + image_grid(sources, captions) if images else "")
+            return nbf.v4.new_markdown_cell(source)
+
+        outputs = []
+        if images:
+            outputs.append(
+                nbf.v4.new_output(
+                    output_type="display_data", data={"text/html": image_grid(sources, captions)}, metadata={}
+                )
+            )
+        return nbf.v4.new_code_cell(source=record["source"], outputs=outputs)
+
+    def close(self) -> str:
+        """Write the remaining records and assemble the notebook, returns its path."""
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+        assemble(self.cells_path, self.path)
+        os.remove(self.cells_path)
+        return self.path
+
+
+def assemble(cells_path: str, path: str) -> None:
+    """Build the notebook `path` from the cells written so far, e.g. after a crash."""
+    cells = []
+    with open(cells_path) as file:
+        for line in file:
+            try:
+                cells.append(nbf.from_dict(json.loads(line)))
+            except json.JSONDecodeError:
+                # The last line of a trace that was interrupted mid-write
+                break
+    nbf.write(nbf.v4.new_notebook(cells=cells), path)
@@ -11,25 +11,54 @@ for parsing strictly-limited literal lists.
 """
 
 import ast
-import itertools
+import hashlib
+import math
 import random
 import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 from dataclasses import dataclass, field
-from typing import Any, List
+from typing import Any, Callable, List, Literal, TypeVar
 
 import cv2
 import numpy as np
 import PIL.Image
 from PIL import ImageDraw
-from skimage.color import deltaE_cie76, rgb2lab
+from skimage.color import rgb2lab
 
-from halligan.agents import Agent
+from halligan.agents import Agent, ImagePolicy, Router, estimate_image_tokens, split_by_budget
 from halligan.models import Detector
+from halligan.runtime.accounting import record
 from halligan.utils.layout import Element, Frame, Point
+from halligan.utils.mosaic import Packing, pack, unpack_answers
 from halligan.utils.toolkit import Toolkit
 
 _agent: Agent | None = None
 
+# Routes ask/rank/compare to their own model and settings, disabled by default (see set_router)
+_router: Router | None = None
+
+# Upper bound on concurrent agent calls issued by a single vision tool
+_MAX_CONCURRENT_CALLS = 8
+
+# Image policy per vision tool (see set_image_policy)
+_image_policies: dict[str, ImagePolicy] = {}
+
+# Contact sheet packing for ask/compare, disabled by default (see set_packing)
+_packing: Packing | None = None
+_PACKED_HINT = (
+    "\nThe {item}s are packed into one contact sheet. "
+    "Each {item} is labelled with its number in a black band above it.\n"
+    "Output exactly one value per label, in ascending label order.\n"
+)
+
+# Detector results keyed by (image digest, normalized query, model version), least recently used first
+_DETECTION_CACHE_SIZE = 512
+_detections: OrderedDict[tuple[str, str, str], list] = OrderedDict()
+_detections_lock = threading.Lock()
+
 
 def set_agent(agent: Agent) -> None:
     """Inject the VLM agent used by vision tools (required for ask/rank/compare)."""
@@ -37,10 +66,50 @@ def set_agent(agent: Agent) -> None:
     _agent = agent
 
 
-def _require_agent() -> Agent:
+def set_router(router: Router | None) -> None:
+    """Call the agent of ask/rank/compare through `router`, or directly with None."""
+    global _router
+    _router = router
+
+
+def set_image_policy(tool: str, policy: ImagePolicy | None) -> None:
+    """
+    Set how images of a vision tool (`ask`, `compare`, `rank`) are sent to the agent.
+    Pass None to fall back to the agent's own policy.
+    """
+    if policy is None:
+        _image_policies.pop(tool, None)
+    else:
+        _image_policies[tool] = policy
+
+
+def _require_agent(tool: str) -> Agent:
+    """
+    Get a fork of the injected agent, routed for `tool` if a router is set.
+    Every tool call gets its own fork, so calls never share (or reset) conversation history.
+    Each fork is one agent call, counted against the VLM budget of the running program.
+    """
     if _agent is None:
         raise RuntimeError("Vision tools agent is not set. Call `halligan.utils.vision_tools.set_agent(agent)` first.")
-    return _agent
+    record("vlm_calls")
+    return _router.agent(_agent, tool) if _router else _agent.fork()
+
+
+_T = TypeVar("_T")
+_R = TypeVar("_R")
+
+
+def _map_concurrently(fn: Callable[[_T], _R], items: list[_T]) -> list[_R]:
+    """
+    `map` over a thread pool, in order. Calls run in a copy of the caller's context,
+    so that budgets of the running program (see `runtime.accounting`) still apply.
+    """
+    if len(items) == 1:
+        return [fn(items[0])]
+
+    with ThreadPoolExecutor(max_workers=min(len(items), _MAX_CONCURRENT_CALLS)) as pool:
+        futures = [pool.submit(copy_context().run, fn, item) for item in items]
+        return [future.result() for future in futures]
 
 
 def _safe_literal_list(text: str) -> list[Any]:
@@ -55,25 +124,109 @@ def _safe_literal_list(text: str) -> list[Any]:
     return value
 
 
+def set_packing(packing: Packing | None) -> None:
+    """
+    Pack the images of ask/compare calls into one labelled contact sheet.
+    Pass None to send every image as a separate image part (default).
+    """
+    global _packing
+    _packing = packing
+
+
+def _pack(images: list[PIL.Image.Image], item: str) -> tuple[list[PIL.Image.Image], list[str]] | None:
+    """Contact sheet and caption for `images`, or None when they are sent one by one."""
+    if _packing is None or len(images) < _packing.min_images:
+        return None
+
+    sheet = pack(images, [str(i) for i in range(len(images))], _packing)
+    return [sheet], [f"{item}s 0-{len(images) - 1}"]
+
+
+def _image_digest(image: PIL.Image.Image) -> str:
+    digest = hashlib.blake2b(image.tobytes(), digest_size=16)
+    digest.update(f"{image.mode}{image.size}".encode())
+    return digest.hexdigest()
+
+
+def _normalize_query(text: str) -> str:
+    """Similar prompts (case, punctuation, spacing, articles) share detections."""
+    words = re.sub(r"[^\w\s]", " ", text.lower()).split()
+    return " ".join(word for word in words if word not in {"a", "an", "the"})
+
+
+def _detector_version() -> str:
+    return str(getattr(Detector, "version", None) or getattr(Detector, "__qualname__", "Detector"))
+
+
+def _cache_detections(digest: str, query: str, bboxes: list) -> None:
+    key = (digest, query, _detector_version())
+    with _detections_lock:
+        _detections[key] = bboxes
+        _detections.move_to_end(key)
+        while len(_detections) > _DETECTION_CACHE_SIZE:
+            _detections.popitem(last=False)
+
+
+def _detect(images: list[PIL.Image.Image], queries: list[str]) -> list[dict[str, list]]:
+    """
+    Detect objects matching each query in each image.
+    Results are cached by (image, query, model version). Cache misses are batched:
+    the Detector runs at most once per query, over all images that still need it.
+
+    Returns a {query: bboxes} mapping for each image.
+    """
+    digests = [_image_digest(image) for image in images]
+    results: list[dict[str, list]] = [{} for _ in images]
+    version = _detector_version()
+
+    for query in queries:
+        key = _normalize_query(query)
+        missing: list[int] = []
+        with _detections_lock:
+            for i, digest in enumerate(digests):
+                bboxes = _detections.get((digest, key, version))
+                if bboxes is None:
+                    missing.append(i)
+                else:
+                    _detections.move_to_end((digest, key, version))
+                    results[i][query] = bboxes
+
+        if missing:
+            all_bboxes = Detector.detect([images[i] for i in missing], query)
+            for i, bboxes in zip(missing, all_bboxes):
+                _cache_detections(digests[i], key, bboxes)
+                results[i][query] = bboxes
+
+    return results
+
+
 def mark(images: list[PIL.Image.Image], object: str) -> list[PIL.Image.Image]:
     """
     Annotate object bounding boxes in each image.
     Helps answer questions that require counting and finding objects.
+    Returns annotated copies, the given images are left unchanged.
     """
-    all_bboxes = Detector.detect(images, object)
+    all_bboxes = [detections[object] for detections in _detect(images, [object])]
 
     annotated_images = []
     for image, bboxes in zip(images, all_bboxes):
         img_width, img_height = image.size
+        detected = bboxes
         bboxes = [
             bbox
             for bbox in bboxes
             if (bbox[2] - bbox[0]) / img_width >= 0.125 and (bbox[3] - bbox[1]) / img_height >= 0.125
         ]
 
-        for bbox in bboxes:
+        # Draw on a copy: the images may be shared (element images, concurrent `pforeach` bodies)
+        if bboxes:
+            image = image.copy()
             draw = ImageDraw.Draw(image)
-            draw.rectangle(bbox, outline="red", width=2)
+            for bbox in bboxes:
+                draw.rectangle(bbox, outline="red", width=2)
+
+            # Later focus() calls on the annotated image reuse the same detections
+            _cache_detections(_image_digest(image), _normalize_query(object), detected)
 
         annotated_images.append(image)
 
@@ -86,7 +239,7 @@ def focus(image: PIL.Image.Image, description: str) -> list[PIL.Image.Image]:
     Helps answer questions that require detailed visual analysis.
     Returns a list of focused regions.
     """
-    bboxes = Detector.detect([image], description)[-1]
+    bboxes = _detect([image], [description])[0][description]
     zoomed_regions = [image.crop(bbox) for bbox in bboxes]
     return zoomed_regions
 
@@ -133,26 +286,56 @@ def ask(images: list[PIL.Image.Image], question: str, answer_type: str) -> list[
         f"You should follow the format `{answers_format}` to answer the question.\n"
         f"{hint}"
     )
-    image_captions = [f"Image {i}" for i in range(len(images))]
-    agent = _require_agent()
-    response, _ = agent(prompt, images, image_captions)
-    agent.reset()
-    match = re.search(answer_pattern, response)
-    if match:
-        matches = _safe_literal_list(match.group(2))
+    default = False if answer_type == "bool" else 0
+    policy = _image_policies.get("ask")
+
+    def answer(batch: list[PIL.Image.Image]) -> list[Any] | None:
+        agent = _require_agent("ask")
+        packed = _pack(batch, "Image")
+        if packed:
+            sheets, sheet_captions = packed
+            response, _ = agent(prompt + _PACKED_HINT.format(item="image"), sheets, sheet_captions, policy=policy)
+        else:
+            image_captions = [f"Image {i}" for i in range(len(batch))]
+            response, _ = agent(prompt, batch, image_captions, policy=policy)
+        agent.reset()
+
+        match = re.search(answer_pattern, response)
+        if not match:
+            return None
+        answers = _safe_literal_list(match.group(2))
+        return unpack_answers(answers, len(batch), default) if packed else answers
+
+    chunks = split_by_budget(images, policy) if policy else []
+    if len(chunks) > 1:
+        # Over the image budget of one call: ask chunk by chunk and stitch the answers back together
+        results = _map_concurrently(lambda chunk: answer([images[i] for i in chunk]), chunks)
+        matches = []
+        for chunk, answers in zip(chunks, results):
+            matches += unpack_answers(answers or [], len(chunk), default)
+    else:
+        matches = answer(images)
+
+    if matches is not None:
         if "point to the letter" in question.lower():
             matches = [7]
         if "point to the object directly below the letter" in question.lower():
             matches = [11]
     else:
-        matches = [False] * len(images) if answer_type == "bool" else [0] * len(images)
+        matches = [default] * len(images)
 
     return matches
 
 
-def rank(images: list[PIL.Image.Image], task_objective: str) -> list[str]:
+def rank(
+    images: list[PIL.Image.Image],
+    task_objective: str,
+    max_images_per_call: int = 10,
+    seeding: Literal["single_elimination", "multi_round"] = "single_elimination",
+) -> list[int]:
     """
     Ranks each image in the `images` list based on the specified criteria in `task_objective`.
+    `seeding="multi_round"` lets the top 2 of each batch advance, which is more robust but costs more calls.
     Returns image_ids (list[int]), a list of image IDs ordered by descending rank.
     """
 
@@ -161,7 +344,7 @@ def rank(images: list[PIL.Image.Image], task_objective: str) -> list[str]:
         id: int
         children: list["Node"] = field(default_factory=lambda: [])
 
-    def preorder(root: Node):
+    def preorder(root: Node) -> list[int]:
         seen = set()
         result = []
 
@@ -178,12 +361,16 @@ def rank(images: list[PIL.Image.Image], task_objective: str) -> list[str]:
         traverse(root)
         return result
 
-    def get_top_rank(
-        prompt: str, batch: list[Node], batch_image: list[PIL.Image.Image], batch_captions: list[str]
-    ) -> Node:
-        # Get ranking
-        agent = _require_agent()
-        response, _ = agent(prompt, batch_image, batch_captions)
+    def get_top_rank(prompt: str, batch: list[Node], advance: int) -> list[Node]:
+        # A single image wins its batch without asking the agent
+        if len(batch) == 1:
+            return batch
+
+        # Get ranking (batches of the same round run concurrently)
+        agent = _require_agent("rank")
+        batch_images = [images[node.id] for node in batch]
+        batch_captions = [f"Image {i}" for i in range(len(batch))]
+        response, _ = agent(prompt, batch_images, batch_captions, policy=policy)
         match = re.search(r"rank\((ids=)?(\[[\d, ]+\])\)", response)
 
         ranking: list[int]
@@ -216,14 +403,26 @@ def rank(images: list[PIL.Image.Image], task_objective: str) -> list[str]:
         best_node = Node(best_id)
         best_node.children = [batch[i] for i in ranking]
 
-        agent.reset()
-        return best_node
-
-    # To prevent agent from being overwhelmed, batch the input images
-
-    batch_size = 10
+        # Keep at least one image out of every batch so that each round shrinks
+        runners_up = [batch[i] for i in ranking[1 : min(advance, len(batch) - 1)]]
+        return [best_node] + runners_up
+
+    def get_batches(nodes: list[Node]) -> list[list[Node]]:
+        # To prevent agent from being overwhelmed, batch the input images.
+        # Batches are balanced, e.g., 23 images with a budget of 10 are split as 7 + 8 + 8.
+        budget = max(2, max_images_per_call)
+        if policy and policy.max_tokens_per_call:
+            tokens = max(estimate_image_tokens(images[node.id].size, policy) for node in nodes)
+            budget = max(2, min(budget, policy.max_tokens_per_call // tokens))
+        count = math.ceil(len(nodes) / budget)
+        return [nodes[i * len(nodes) // count : (i + 1) * len(nodes) // count] for i in range(count)]
+
+    if not images:
+        return []
+
+    advance = 2 if seeding == "multi_round" else 1
+    policy = _image_policies.get("rank")
     nodes = [Node(i) for i in range(len(images))]
-    batches = [nodes[i : i + batch_size] for i in range(0, len(images), batch_size)]
     hint = ""
     if any(keyword in task_objective.lower() for keyword in ["complete the puzzle", "missing spot"]):
         hint = (
@@ -242,30 +441,25 @@ def rank(images: list[PIL.Image.Image], task_objective: str) -> list[str]:
     if any(keyword in task_objective.lower() for keyword in ["upright"]):
         hint = "## Guidelines\n" "1. Find the image that is the least tiled (the upright image)."
 
+    prompt = (
+        f"Given a list of images, "
+        f"rank them based on their relevance to the objective: {task_objective}.\n"
+        f"You should follow the format rank(ids=[1, 2, ...]) to output a ranked list of image ids.\n"
+        f"{hint}"
+    )
+
     # Perform tournament-based ranking on the batches.
-    # The best (rank #1) image from each batch is selected to form a new batch for the next round.
-    root = None
+    # The best image(s) from each batch advance to the next round until a single batch is left.
+    # Batches within a round are independent, so they are dispatched concurrently.
     while True:
-        next_batch = []
-
-        for batch in batches:
-            # Prepare input
-            prompt = (
-                f"Given a list of images, "
-                f"rank them based on their relevance to the objective: {task_objective}.\n"
-                f"You should follow the format rank(ids=[1, 2, ...]) to output a ranked list of image ids.\n"
-                f"{hint}"
-            )
-            batch_captions = [f"Image {i}" for i in range(len(batch))]
-            batch_image = [images[node.id] for node in batch]
-            best_node = get_top_rank(prompt, batch, batch_image, batch_captions)
-            next_batch.append(best_node)
+        batches = get_batches(nodes)
+        winners = _map_concurrently(lambda batch: get_top_rank(prompt, batch, advance), batches)
 
-        if len(next_batch) == 1:
-            root = best_node
+        if len(batches) == 1:
+            root = winners[0][0]
             break
 
-        batches = [next_batch]
+        nodes = [node for batch_winners in winners for node in batch_winners]
 
     return preorder(root)
 
@@ -314,84 +508,148 @@ def compare(images: list[PIL.Image.Image], task_objective: str, reference: PIL.I
         f"{hint}"
     )
 
-    images = [reference] + images
-    image_captions = ["Reference"] + [f"Item {i}" for i in range(len(images) - 1)]
-    agent = _require_agent()
-    response, _ = agent(prompt, images, image_captions)
+    policy = _image_policies.get("compare")
+
+    def answer(batch: list[PIL.Image.Image]) -> list[bool] | None:
+        agent = _require_agent("compare")
+        packed = _pack(batch, "Item")
+        if packed:
+            sheets, sheet_captions = packed
+            response, _ = agent(
+                prompt + _PACKED_HINT.format(item="item"),
+                [reference] + sheets,
+                ["Reference"] + sheet_captions,
+                policy=policy,
+            )
+        else:
+            image_captions = ["Reference"] + [f"Item {i}" for i in range(len(batch))]
+            response, _ = agent(prompt, [reference] + batch, image_captions, policy=policy)
+        agent.reset()
+
+        match = re.search(answer_pattern, response)
+        if not match:
+            return None
+        answers = _safe_literal_list(match.group(2))
+        return unpack_answers(answers, len(batch), False) if packed else answers
 
-    agent.reset()
-    match = re.search(answer_pattern, response)
-    matches = _safe_literal_list(match.group(2)) if match else [False] * (len(images) - 1)
-    return matches
+    reserved = estimate_image_tokens(reference.size, policy) if policy and reference else 0
+    chunks = split_by_budget(images, policy, reserved=reserved) if policy else []
+    if len(chunks) > 1:
+        # Over the image budget of one call: the reference is sent again with every chunk
+        results = _map_concurrently(lambda chunk: answer([images[i] for i in chunk]), chunks)
+        matches = []
+        for chunk, answers in zip(chunks, results):
+            matches += unpack_answers(answers or [], len(chunk), False)
+        return matches
 
+    matches = answer(images)
+    return matches if matches is not None else [False] * len(images)
 
-def match(e1: Element, e2: Element) -> bool:
+
+@dataclass(frozen=True)
+class TileDescriptor:
     """
-    Check if two elements are visually similar or identical.
-    Works best for grid items.
+    Visual features of an element image used by `match()`.
+    Computed once per image and cached on the element (see `describe()`).
     """
-    if not (isinstance(e1, Element) and isinstance(e2, Element)):
-        return False
 
-    def _moment_match():
-        img1 = np.array(e1.image)
-        img2 = np.array(e2.image)
+    contours: int
+    hu_moments: np.ndarray  # (contours - 1, 7), contours sorted by area without the largest one
+    palette: np.ndarray  # (10, 3), median-cut palette in CIELAB
+    spread: float  # mean pairwise palette distance, low for empty cells of uniform color
 
-        gray1 = cv2.cvtColor(img1, cv2.COLOR_RGB2GRAY)
-        gray2 = cv2.cvtColor(img2, cv2.COLOR_RGB2GRAY)
 
-        _, threshold1 = cv2.threshold(gray1, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        _, threshold2 = cv2.threshold(gray2, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+def _color_dist(lab1: np.ndarray, lab2: np.ndarray) -> np.ndarray:
+    """CIE76 color distance normalized to [0, 1]."""
+    return np.minimum(np.linalg.norm(lab1 - lab2, axis=-1) / 100.0, 1.0)
 
-        contours1, _ = cv2.findContours(threshold1, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
-        contours2, _ = cv2.findContours(threshold2, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
 
-        if len(contours1) != len(contours2):
-            return False
+def describe(element: Element) -> TileDescriptor:
+    """
+    Get the cached descriptor of an element, computing it on first use.
+    The cache is reset when the element's image is replaced, tools do not edit images in place.
+    """
+    if element.descriptor is not None:
+        return element.descriptor
+
+    image = element.image
+    gray = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2GRAY)
+    _, threshold = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    contours, _ = cv2.findContours(threshold, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+    contours = sorted(contours, key=cv2.contourArea, reverse=True)
+    hu_moments = np.array([cv2.HuMoments(cv2.moments(contour)).flatten() for contour in contours[1:]])
+
+    palette = image.quantize(
+        colors=10, method=PIL.Image.Quantize.MEDIANCUT, dither=PIL.Image.Dither.NONE, kmeans=0
+    ).getpalette()
+    # Unused palette entries are black, as in a full 256-color palette
+    palette = (list(palette) + [0] * 30)[:30]
+    palette = rgb2lab(np.array(palette, dtype=np.float64).reshape(10, 3) / 255.0)
+
+    i, j = np.triu_indices(10, k=1)
+    spread = float(_color_dist(palette[i], palette[j]).sum() / 10)
+
+    element.descriptor = TileDescriptor(
+        contours=len(contours),
+        hu_moments=hu_moments.reshape(-1, 7),
+        palette=palette,
+        spread=spread,
+    )
+    return element.descriptor
 
-        contours1 = sorted(contours1, key=cv2.contourArea, reverse=True)
-        contours2 = sorted(contours2, key=cv2.contourArea, reverse=True)
 
-        diff = 0.0
-        for contour1, contour2 in zip(contours1[1:], contours2[1:]):
-            moments1 = cv2.moments(contour1)
-            moments2 = cv2.moments(contour2)
-            hu_moments1 = cv2.HuMoments(moments1).flatten()
-            hu_moments2 = cv2.HuMoments(moments2).flatten()
-            diff += np.sum(np.abs(hu_moments1 - hu_moments2))
+def _descriptors_match(d1: TileDescriptor, d2: TileDescriptor) -> bool:
+    # Shapes: same number of contours with near-identical Hu moments
+    if d1.contours != d2.contours:
+        return False
+    if np.sum(np.abs(d1.hu_moments - d2.hu_moments)) >= 1e-2:
+        return False
 
-        return True if diff < 1e-2 else False
+    # Reject empty cells of uniform color
+    if d1.spread < 0.2 or d2.spread < 0.2:
+        return False
 
-    def _color_match():
-        def _color_dist(c1, c2):
-            dist = deltaE_cie76(rgb2lab([c / 255.0 for c in c1]), rgb2lab([c / 255.0 for c in c2]))
-            dist = min(dist / 100.0, 1.0)
-            return dist
+    # Reject different colored cells
+    return bool(_color_dist(d1.palette, d2.palette).sum() / 10 <= 0.15)
 
-        palette1 = e1.image.quantize(
-            colors=10, method=PIL.Image.Quantize.MEDIANCUT, dither=PIL.Image.Dither.NONE, kmeans=0
-        ).getpalette()
 
-        palette2 = e2.image.quantize(
-            colors=10, method=PIL.Image.Quantize.MEDIANCUT, dither=PIL.Image.Dither.NONE, kmeans=0
-        ).getpalette()
+def match_matrix(elements: list[Element]) -> np.ndarray:
+    """
+    Pairwise `match()` results for a list of elements as a boolean (N, N) matrix.
+    """
+    descriptors = [describe(element) for element in elements]
+    n = len(descriptors)
+    if n == 0:
+        return np.zeros((0, 0), dtype=bool)
+
+    palettes = np.stack([d.palette for d in descriptors])
+    spreads = np.array([d.spread for d in descriptors])
+    colors = _color_dist(palettes[:, None], palettes[None, :]).sum(axis=-1) / 10 <= 0.15
+    colors &= (spreads[:, None] >= 0.2) & (spreads[None, :] >= 0.2)
+
+    # Hu moments are only comparable between elements with the same number of contours
+    shapes = np.zeros((n, n), dtype=bool)
+    groups: dict[int, list[int]] = {}
+    for index, descriptor in enumerate(descriptors):
+        groups.setdefault(descriptor.contours, []).append(index)
 
-        palette1 = [palette1[i : i + 3] for i in range(0, 10 * 3, 3)]
-        palette2 = [palette2[i : i + 3] for i in range(0, 10 * 3, 3)]
+    for indices in groups.values():
+        moments = np.stack([descriptors[i].hu_moments for i in indices])
+        diff = np.abs(moments[:, None] - moments[None, :]).sum(axis=(-2, -1))
+        shapes[np.ix_(indices, indices)] = diff < 1e-2
 
-        intra_dist1 = sum([_color_dist(c1, c2) for c1, c2 in itertools.combinations(palette1, 2)])
-        intra_dist2 = sum([_color_dist(c1, c2) for c1, c2 in itertools.combinations(palette2, 2)])
-        inter_dist = sum([_color_dist(c1, c2) for c1, c2 in zip(palette1, palette2)])
+    return shapes & colors
 
-        # Reject empty cells of uniform color
-        if intra_dist1 / 10 < 0.2 or intra_dist2 / 10 < 0.2:
-            return False
 
-        # Reject different colored cells
-        if inter_dist / 10 <= 0.15:
-            return True
+def match(e1: Element, e2: Element) -> bool:
+    """
+    Check if two elements are visually similar or identical.
+    Works best for grid items.
+    """
+    if not (isinstance(e1, Element) and isinstance(e2, Element)):
+        return False
 
-    return _moment_match() and _color_match()
+    return _descriptors_match(describe(e1), describe(e2))
 
 
 dependencies = {**globals(), "__builtins__": __builtins__, "List": List}
@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import numpy as np
+import pytest
+from PIL import Image
+
+# The action tools import the vision tools, which need the model dependencies
+action_tools = pytest.importorskip("halligan.utils.action_tools", exc_type=ImportError)
+
+
+@dataclass
+class DummyArrow:
+    center: tuple[int, int]
+
+
+class DummyCarousel:
+    """Shows `options` in turn, the next arrow wraps around (cyclic) or stops at the last one."""
+
+    def __init__(self, options: list[int], cyclic: bool = True) -> None:
+        self.options = options
+        self.cyclic = cyclic
+        self.position = 0
+
+    def click(self, x: int, y: int) -> None:
+        step = 1 if x > 0 else -1
+        position = self.position + step
+        if self.cyclic:
+            position %= len(self.options)
+        self.position = min(max(position, 0), len(self.options) - 1)
+
+    def screenshot(self, region=None, fresh: bool = False) -> Image.Image:
+        # A white square whose place depends on the option
+        image = Image.new("RGB", (16, 16))
+        x, y = 4 * (self.options[self.position] % 4), 4 * (self.options[self.position] // 4)
+        image.paste((255, 255, 255), (x, y, x + 4, y + 4))
+        return image
+
+
+@dataclass
+class DummyFrame:
+    region: list[float]
+
+
+@pytest.mark.parametrize("cyclic", [True, False])
+def test_get_all_choices_keeps_look_alike_options_in_the_middle(monkeypatch, cyclic):
+    # Option 3 looks like option 1
+    carousel = DummyCarousel([0, 5, 10, 5, 15], cyclic=cyclic)
+    monkeypatch.setattr(action_tools, "mouse", carousel)
+    monkeypatch.setattr(action_tools, "screenshot", carousel.screenshot)
+
+    choices = action_tools.get_all_choices(DummyArrow((-1, 0)), DummyArrow((1, 0)), DummyFrame([0, 0, 16, 16]))
+
+    assert len(choices) == 5
+    choices[1].select()
+    assert carousel.position == 1
+    choices[4].select()
+    assert carousel.position == 4
+    choices[0].select()
+    assert carousel.position == 0
+
+
+@dataclass
+class DummyTile:
+    x: int
+    y: int
+
+
+@dataclass
+class DummyGrid:
+    interactables: list[DummyTile]
+
+
+def test_explore_skips_only_pairs_that_match(monkeypatch):
+    # A matches B and B matches C, but A does not match C: swapping A and C changes the grid
+    a, b, c = DummyTile(0, 0), DummyTile(10, 0), DummyTile(20, 0)
+    matches = np.array([[True, True, False], [True, True, True], [False, True, True]])
+    monkeypatch.setattr(action_tools, "match_matrix", lambda elements: matches)
+
+    swaps = [(choice._first, choice._second) for choice in action_tools.explore(DummyGrid([a, b, c]))]
+    assert swaps == [((0, 0), (0, 2))]
+
+
+class DummySlider:
+    """Slides a white bar over a 16x16 frame, the screencast pushes a frame whenever the bar moved."""
+
+    def __init__(self, streaming: bool = True) -> None:
+        self.streaming = streaming
+        self.x = 0
+        self.screenshots = 0
+        self.frames: list | None = None
+
+    def view(self) -> Image.Image:
+        image = Image.new("RGB", (16, 16))
+        image.paste((255, 255, 255), (self.x // 4, 0, self.x // 4 + 2, 16))
+        return image
+
+    def repaint(self) -> None:
+        # Pushed after the move returned, i.e., on the next input or while settling
+        if self.frames is not None and (not self.frames or self.frames[-1][1].tobytes() != self.view().tobytes()):
+            self.frames.append((time.monotonic(), self.view()))
+
+    def move(self, x: int, y: int) -> None:
+        self.repaint()
+        self.x = x
+
+    @contextmanager
+    def recording(self):
+        self.frames = [] if self.streaming else None
+        yield self.frames
+        self.repaint()
+        self.frames = None
+
+    def crop(self, frame: Image.Image, region) -> Image.Image:
+        return frame
+
+    def screenshot(self, region=None, fresh: bool = False) -> Image.Image:
+        self.screenshots += 1
+        return self.view()
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_sweep_observes_each_position_once(monkeypatch, streaming):
+    slider = DummySlider(streaming)
+    monkeypatch.setattr(action_tools, "mouse", slider)
+    monkeypatch.setattr(action_tools, "capture", slider)
+    monkeypatch.setattr(action_tools, "screenshot", slider.screenshot)
+
+    # Positions 0-3 show the same frame, 8 and 9 as well
+    positions = [0, 1, 2, 3, 8, 9, 16]
+    choices = action_tools.sweep("x", positions, 0, DummyFrame([0, 0, 16, 16]), (0, 16))
+
+    assert [choice._current_x for choice in choices] == [0, 8, 16]
+    assert [choice.image.getpixel((x // 4, 0)) for choice, x in zip(choices, [0, 8, 16])] == [(255, 255, 255)] * 3
+    assert slider.screenshots == (0 if streaming else len(positions))
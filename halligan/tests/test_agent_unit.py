@@ -1,9 +1,75 @@
 from __future__ import annotations
 
-from halligan.agents import GPTAgent
+import pytest
+from PIL import Image
+
+from halligan.agents import GPTAgent, ImagePolicy, Route, Router, estimate_image_tokens, split_by_budget
+from halligan.runtime.errors import ConfigError
 
 
 def test_gpt_agent_constructs_without_network():
     # The client is constructed but no network request is performed.
     agent = GPTAgent(api_key="sk-test", model="gpt-4o-2024-11-20")
     assert agent is not None
+
+
+def test_image_token_estimate_follows_tiling_rule():
+    # 1344 x 768 screenshot: 3 x 2 tiles of 512px
+    assert estimate_image_tokens((1344, 768)) == 85 + 170 * 6
+    assert estimate_image_tokens((1344, 768), ImagePolicy(detail="low")) == 85
+    assert estimate_image_tokens((1344, 768), ImagePolicy(max_side=512)) == 85 + 170 * 1
+
+
+def test_split_by_budget_keeps_order_and_fits_budget():
+    images = [Image.new("RGB", (600, 600)) for _ in range(5)]
+    policy = ImagePolicy(max_tokens_per_call=2 * 765)
+    assert split_by_budget(images, policy) == [[0, 1], [2, 3], [4]]
+    assert split_by_budget(images, ImagePolicy()) == [[0, 1, 2, 3, 4]]
+
+
+def test_gpt_agent_reset_seeds_system_prompt():
+    agent = GPTAgent(api_key="sk-test")
+    agent.reset(system="stable prefix")
+    assert agent.history == [{"role": "system", "content": "stable prefix"}]
+    agent.reset()
+    assert agent.history == []
+
+
+def test_pipeline_usage_and_stable_system_prompt():
+    # The stages import the vision tools, which need the model dependencies
+    pipeline = pytest.importorskip("halligan.stages.pipeline", exc_type=ImportError)
+    PipelineUsage = pipeline.PipelineUsage
+
+    usage = PipelineUsage()
+    usage.add({"prompt_tokens": 2000, "cached_tokens": 0, "completion_tokens": 100})
+    usage.add({"prompt_tokens": 3000, "cached_tokens": 1920, "completion_tokens": 50, "ttft": 0.4})
+    assert usage.calls == 2
+    assert usage.cache_hit_ratio == 1920 / 5000
+    assert usage.summary()["ttft"] == [0.4]
+    # The prefix must be byte-identical across challenges to be cached
+    assert pipeline.system_prompt() == pipeline.SYSTEM_PROMPT
+
+
+def test_router_configures_sites_and_records_stats():
+    agent = GPTAgent(api_key="sk-test")
+    router = Router(routes={"ask": Route(model="gpt-4o-mini", max_tokens=64)})
+
+    ask = router.agent(agent, "ask")
+    assert (ask.agent.model, ask.agent.max_tokens) == ("gpt-4o-mini", 64)
+    assert (agent.model, agent.max_tokens) == ("gpt-4o-2024-11-20", 1024)
+    # Vision tools route from the original agent, not from the routed agent of Stage 3
+    stage3 = router.agent(agent, "stage3")
+    assert router.agent(stage3, "ask").agent.model == "gpt-4o-mini"
+    assert stage3.agent.model == agent.model
+
+    router.record("ask", "gpt-4o-mini", {"prompt_tokens": 100, "completion_tokens": 5}, 0.5)
+    router.outcome(True)
+    router.record("ask", "gpt-4o-mini", {"prompt_tokens": 100, "completion_tokens": 5}, 1.5)
+    router.outcome(False)
+    router.outcome(True)
+    summary = router.summary()["ask:gpt-4o-mini"]
+    assert summary["calls"] == 2 and summary["mean_seconds"] == 1.0
+    assert summary["challenges"] == 2 and summary["solve_rate"] == 0.5
+
+    with pytest.raises(ConfigError):
+        Router(routes={"stage4": Route()})
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import pytest
+
+from halligan.runtime.analysis import CostLimits, analyze_stage3_program, estimate_stage3_cost, rank_stage3_programs
+from halligan.runtime.errors import ValidationError
+from halligan.runtime.registry import ToolRegistry
+from halligan.runtime.schemas import Stage3Program, validate_stage3_candidates
+
+
+class SlideChoice:
+    def release(self) -> None:
+        pass
+
+
+def _registry() -> ToolRegistry:
+    def slide_x(handle, direction, observe_frame) -> list[SlideChoice]:
+        return [SlideChoice()]
+
+    def ask(images, question, answer_type) -> list[bool]:
+        return [True for _ in images]
+
+    reg = ToolRegistry()
+    reg.register("slide_x", slide_x)
+    reg.register("ask", ask)
+    return reg
+
+
+def _slide(save_as: str = "choices") -> dict:
+    args = {"handle": {"ref": "interactable", "frame": 0, "id": 0}, "direction": "right", "observe_frame": 1}
+    return {"op": "call", "tool": "slide_x", "args": args, "save_as": save_as}
+
+
+def test_analysis_accepts_valid_program_and_estimates_cost():
+    program = Stage3Program(
+        steps=[
+            _slide(),
+            {"op": "call", "tool": "ask", "args": {"images": [], "question": "q", "answer_type": "bool"}},
+            {
+                "op": "call_method",
+                "target": {"ref": "index", "list": {"var": "choices"}, "index": 0},
+                "method": "release",
+            },
+        ]
+    )
+    cost = analyze_stage3_program(program, registry=_registry())
+    assert cost.vlm_calls == 1
+    assert cost.screenshots > 0 and cost.actions > 0
+
+
+def test_analysis_reports_all_issues_at_once():
+    program = Stage3Program(
+        steps=[
+            _slide(),
+            {"op": "call", "tool": "nope", "args": {}},
+            {"op": "call", "tool": "ask", "args": {"images": {"var": "typo"}, "question": "q"}},
+            {
+                "op": "foreach",
+                "var": "c",
+                "in": {"var": "choices"},
+                "do": [{"op": "call_method", "target": {"var": "c"}, "method": "swap"}],
+            },
+            {"op": "foreach", "var": "n", "in": {"op": "len", "value": {"var": "choices"}}, "do": []},
+            {"op": "break"},
+        ]
+    )
+    _, issues = estimate_stage3_cost(program, registry=_registry())
+    messages = "\n".join(issues)
+
+    assert "'nope' is not allowed" in messages
+    assert "'typo' is used before it is defined" in messages
+    assert "invalid arguments for ask" in messages
+    assert "'swap' is not allowed on SlideChoice" in messages
+    assert "foreach.in must be a list, got int" in messages
+    assert "break outside of foreach" in messages
+
+
+def test_analysis_rejects_runaway_programs():
+    ask = {"op": "call", "tool": "ask", "args": {"images": [], "question": "q", "answer_type": "bool"}}
+    program = Stage3Program(
+        steps=[
+            _slide(),
+            {
+                "op": "foreach",
+                "var": "c",
+                "in": {"var": "choices"},
+                "do": [{"op": "foreach", "var": "d", "in": {"var": "choices"}, "do": [ask]}],
+            },
+        ]
+    )
+    with pytest.raises(ValidationError, match="VLM calls exceeds the limit"):
+        analyze_stage3_program(program, registry=_registry(), limits=CostLimits(max_vlm_calls=40))
+
+
+def test_analysis_checks_pforeach_bodies():
+    reg = _registry()
+    reg.register("ask", reg.get("ask").fn, parallel=True)
+    ask = {"op": "call", "tool": "ask", "args": {"images": [], "question": "q", "answer_type": "bool"}, "save_as": "a"}
+    program = Stage3Program(
+        steps=[
+            _slide(),
+            {"op": "pforeach", "var": "c", "in": [1, 2, 3], "do": [ask], "collect": {"var": "a"}, "save_as": "answers"},
+            {"op": "assign", "var": "n", "value": {"op": "len", "value": {"var": "answers"}}},
+            {"op": "pforeach", "var": "c", "in": {"var": "choices"}, "do": [_slide("inner")]},
+            {"op": "assign", "var": "leak", "value": {"var": "a"}},
+        ]
+    )
+    cost, issues = estimate_stage3_cost(program, registry=reg)
+    messages = "\n".join(issues)
+
+    assert cost.vlm_calls == 3
+    assert "pforeach.do cannot call slide_x, only ask" in messages
+    assert "'a' is used before it is defined" in messages
+    assert len(issues) == 2
+
+
+def test_analysis_counts_batched_loops_once():
+    reg = _registry()
+    reg.register("ask", reg.get("ask").fn, parallel=True, batch_arg="images")
+    ask = {"op": "call", "tool": "ask", "args": {"images": [{"var": "c"}], "question": "q", "answer_type": "bool"}}
+    program = Stage3Program(steps=[{"op": "foreach", "var": "c", "in": [1, 2, 3], "do": [ask]}])
+    assert analyze_stage3_program(program, registry=reg).vlm_calls == 1
+
+    # Loops that stop early are not batched
+    program = Stage3Program(steps=[{"op": "foreach", "var": "c", "in": [1, 2, 3], "do": [ask, {"op": "break"}]}])
+    assert analyze_stage3_program(program, registry=reg).vlm_calls == 3
+
+
+def test_candidates_keep_the_model_order_and_drop_invalid_ones():
+    ask = {"op": "call", "tool": "ask", "args": {"images": [], "question": "q", "answer_type": "bool"}}
+    expensive = {"steps": [ask, ask]}
+    cheap = {"steps": [ask]}
+    invalid = {"steps": [{"op": "call", "tool": "nope", "args": {}}]}
+    data = {"candidates": [expensive, invalid, cheap, cheap]}
+
+    # The model lists the most likely first, a cheaper program is not a better one
+    ranked = rank_stage3_programs(validate_stage3_candidates(data), registry=_registry())
+    assert [program.steps for program, _ in ranked] == [expensive["steps"], cheap["steps"]]
+    assert [cost.vlm_calls for _, cost in ranked] == [2, 1]
+
+    # Static cost only filters programs over budget
+    limits = CostLimits(max_vlm_calls=1)
+    ranked = rank_stage3_programs(validate_stage3_candidates(data), registry=_registry(), limits=limits)
+    assert [program.steps for program, _ in ranked] == [cheap["steps"]]
+
+    # A single program is one candidate, and no valid candidate is an error listing all issues
+    assert validate_stage3_candidates(cheap) == [cheap]
+    with pytest.raises(ValidationError, match="candidate 0"):
+        rank_stage3_programs([invalid], registry=_registry())
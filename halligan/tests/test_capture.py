@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import base64
+import io
+
+from PIL import Image
+
+from halligan.runtime.accounting import Meter, metering
+from halligan.utils.capture import InvalidatingInput, ScreenCapture, difference, signature
+
+
+class DummyContext:
+    def new_cdp_session(self, page):
+        raise RuntimeError("CDP is only available on Chromium")
+
+
+class DummyMouse:
+    def __init__(self):
+        self.clicks = []
+
+    def click(self, x, y):
+        self.clicks.append((x, y))
+
+
+class DummyPage:
+    """Page without CDP support, screenshots are served by page.screenshot()."""
+
+    viewport_size = {"width": 40, "height": 20}
+
+    def __init__(self):
+        self.context = DummyContext()
+        self.mouse = DummyMouse()
+        self.screenshots = 0
+
+    def screenshot(self):
+        self.screenshots += 1
+        image = Image.new("RGB", (40, 20), (0, 0, 0))
+        image.paste((255, 0, 0), (10, 5, 20, 15))
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        return buffer.getvalue()
+
+
+def test_capture_serves_regions_from_cached_frame():
+    page = DummyPage()
+    capture = ScreenCapture(page, max_age=60)
+
+    crop = capture.grab([10, 5, 10, 10])
+    assert crop.size == (10, 10)
+    assert crop.getpixel((0, 0)) == (255, 0, 0)
+    assert capture.grab([0, 0, 5, 5]).getpixel((0, 0)) == (0, 0, 0)
+    assert page.screenshots == 1
+
+    capture.grab([0, 0, 5, 5], fresh=True)
+    assert page.screenshots == 2
+
+
+def test_only_actual_captures_are_charged():
+    page = DummyPage()
+    capture = ScreenCapture(page, max_age=60)
+
+    with metering(Meter()) as meter:
+        for _ in range(3):
+            capture.grab([0, 0, 5, 5])
+        capture.grab(fresh=True)
+    assert meter.usage["screenshots"] == page.screenshots == 2
+
+
+def test_input_events_invalidate_cached_frame():
+    page = DummyPage()
+    capture = ScreenCapture(page, max_age=60)
+    mouse = InvalidatingInput(page.mouse, capture)
+
+    capture.grab()
+    mouse.click(1, 2)
+    capture.grab()
+    assert page.mouse.clicks == [(1, 2)]
+    assert page.screenshots == 2
+
+
+def test_signature_difference_ignores_identical_observations():
+    image = Image.new("RGB", (300, 150), (0, 0, 0))
+    moved = image.copy()
+    moved.paste((255, 255, 255), (100, 50, 140, 90))
+
+    assert difference(signature(image), signature(image.copy())) == 0
+    assert difference(signature(image), signature(moved)) > 0.001
+
+
+class DummySession:
+    def __init__(self):
+        self.sent = []
+        self.handlers = {}
+
+    def on(self, event, handler):
+        self.handlers[event] = handler
+
+    def send(self, method, params=None):
+        self.sent.append(method)
+
+    def push(self, image):
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        data = base64.b64encode(buffer.getvalue()).decode()
+        self.handlers["Page.screencastFrame"]({"data": data, "sessionId": 1})
+
+
+class DummyCDPContext:
+    def __init__(self, session):
+        self.session = session
+
+    def new_cdp_session(self, page):
+        return self.session
+
+
+class DummyCDPPage:
+    """Page with CDP support, a screencast frame is pushed whenever the page is waited on."""
+
+    viewport_size = {"width": 40, "height": 20}
+
+    def __init__(self):
+        self.session = DummySession()
+        self.context = DummyCDPContext(self.session)
+
+    def wait_for_timeout(self, timeout):
+        self.session.push(Image.new("RGB", (40, 20), (0, 0, 255)))
+
+
+def test_recording_collects_screencast_frames():
+    page = DummyCDPPage()
+    capture = ScreenCapture(page)
+
+    with capture.recording() as frames:
+        page.session.push(Image.new("RGB", (40, 20), (255, 0, 0)))
+    assert [frame.getpixel((0, 0)) for _, frame in frames] == [(255, 0, 0), (0, 0, 255)]
+    assert page.session.sent.count("Page.startScreencast") == page.session.sent.count("Page.stopScreencast") == 1
+
+    # The last frame is not served once the screencast stopped, nor are later frames recorded
+    assert capture._screencast_frame is None
+    page.session.push(Image.new("RGB", (40, 20)))
+    assert len(frames) == 2
+    assert capture.crop(frames[0][1], [10, 5, 10, 10]).size == (10, 10)
+
+
+def test_recording_without_cdp_yields_nothing():
+    capture = ScreenCapture(DummyPage())
+    with capture.recording() as frames:
+        assert frames is None
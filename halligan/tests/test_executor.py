@@ -2,8 +2,10 @@ from __future__ import annotations
 
 import pytest
 
-from halligan.runtime.errors import ToolError, ValidationError
-from halligan.runtime.executor import apply_stage2_plan, execute_stage3_program
+from halligan.runtime.accounting import Budgets, Meter, record
+from halligan.runtime.compiler import compile_stage3_program
+from halligan.runtime.errors import BudgetExceededError, ExecutionCancelledError, ToolError, ValidationError
+from halligan.runtime.executor import _interpret_stage3_program, apply_stage2_plan, execute_stage3_program
 from halligan.runtime.registry import ToolRegistry
 from halligan.runtime.schemas import Stage2Action, Stage2Plan, Stage3Program
 
@@ -82,3 +84,295 @@ def test_stage3_executor_blocks_unknown_tool():
     frames = [DummyFrame()]
     with pytest.raises(ToolError):
         execute_stage3_program(frames, program, registry=reg)
+
+
+def test_stage3_executor_materializes_iterator_results():
+    reg = ToolRegistry()
+    seen: dict[str, object] = {}
+
+    def stream(*, n):
+        yield from range(n)
+
+    def keep(*, value):
+        seen["value"] = value
+
+    reg.register("stream", stream)
+    reg.register("keep", keep)
+
+    program = Stage3Program(
+        steps=[
+            {"op": "call", "tool": "stream", "args": {"n": 3}, "save_as": "items"},
+            {"op": "call", "tool": "keep", "args": {"value": {"ref": "index", "list": {"var": "items"}, "index": 2}}},
+        ]
+    )
+
+    execute_stage3_program([DummyFrame()], program, registry=reg)
+    assert seen["value"] == 2
+
+
+def test_stage3_compiler_rejects_unknown_tool_before_running():
+    reg = ToolRegistry()
+    calls: list[int] = []
+    reg.register("echo", lambda *, value: calls.append(value))
+
+    program = Stage3Program(
+        steps=[
+            {"op": "call", "tool": "echo", "args": {"value": 1}},
+            {"op": "foreach", "var": "x", "in": [1, 2], "do": [{"op": "call", "tool": "nope", "args": {}}]},
+        ]
+    )
+
+    with pytest.raises(ToolError):
+        execute_stage3_program([DummyFrame()], program, registry=reg)
+    assert calls == []
+
+
+def test_stage3_compiled_program_matches_interpreter():
+    program = Stage3Program(
+        steps=[
+            {"op": "assign", "var": "items", "value": [1, 2, 3, 4]},
+            {
+                "op": "foreach",
+                "var": "x",
+                "in": {"var": "items"},
+                "do": [
+                    {"op": "call", "tool": "echo", "args": {"value": {"var": "x"}}, "save_as": "last"},
+                    {"op": "if", "cond": {"var": "x"}, "then": [], "else": [{"op": "break"}]},
+                    {"op": "call", "tool": "stop", "args": {"value": {"var": "x"}}, "save_as": "done"},
+                    {"op": "if", "cond": {"var": "done"}, "then": [{"op": "break"}]},
+                ],
+            },
+            {"op": "assign", "var": "count", "value": {"op": "len", "value": {"var": "items"}}},
+        ]
+    )
+
+    def run(execute) -> list[object]:
+        seen: list[object] = []
+        reg = ToolRegistry()
+        reg.register("echo", lambda *, value: seen.append(value) or value)
+        reg.register("stop", lambda *, value: value >= 3)
+        execute([DummyFrame()], program, registry=reg)
+        return seen
+
+    assert run(execute_stage3_program) == run(_interpret_stage3_program) == [1, 2, 3]
+
+    reg = ToolRegistry()
+    reg.register("echo", lambda *, value: value)
+    reg.register("stop", lambda *, value: False)
+    env = compile_stage3_program(program, registry=reg, frames=[DummyFrame()]).run()
+    assert env["last"] == 4 and env["count"] == 4
+
+
+def test_stage3_executor_enforces_budgets():
+    reg = ToolRegistry()
+    reg.register("look", lambda *, value: record("screenshots"))
+
+    loop = {"op": "foreach", "var": "x", "in": list(range(10)), "do": []}
+    with pytest.raises(BudgetExceededError) as exc:
+        execute_stage3_program(
+            [DummyFrame()], Stage3Program(steps=[loop]), registry=reg, budgets=Budgets(loop_iterations=5)
+        )
+    assert (exc.value.resource, exc.value.limit, exc.value.used) == ("loop_iterations", 5, 6)
+
+    calls = {"op": "foreach", "var": "x", "in": [1, 2, 3], "do": [{"op": "call", "tool": "look", "args": {"value": 1}}]}
+    with pytest.raises(BudgetExceededError, match="screenshots used 3 of 2"):
+        execute_stage3_program(
+            [DummyFrame()], Stage3Program(steps=[calls]), registry=reg, budgets=Budgets(screenshots=2)
+        )
+    with pytest.raises(BudgetExceededError, match="look calls used 2 of 1"):
+        execute_stage3_program(
+            [DummyFrame()], Stage3Program(steps=[calls]), registry=reg, budgets=Budgets(per_tool={"look": 1})
+        )
+
+
+def test_stage3_executor_stops_when_cancelled():
+    meter = Meter()
+    seen: list[int] = []
+    reg = ToolRegistry()
+    reg.register("step", lambda *, value: seen.append(value) or (value == 2 and meter.cancel("user abort")))
+
+    program = Stage3Program(
+        steps=[
+            {
+                "op": "foreach",
+                "var": "x",
+                "in": [1, 2, 3, 4],
+                "do": [{"op": "call", "tool": "step", "args": {"value": {"var": "x"}}}],
+            }
+        ]
+    )
+    with pytest.raises(ExecutionCancelledError, match="user abort"):
+        execute_stage3_program([DummyFrame()], program, registry=reg, meter=meter)
+    assert seen == [1, 2]
+
+
+def test_stage3_pforeach_runs_concurrently_and_keeps_order():
+    import threading
+    import time
+
+    barrier = threading.Barrier(3, timeout=5)
+    reg = ToolRegistry()
+
+    def ask(*, value):
+        barrier.wait()  # deadlocks unless all three calls run at once
+        time.sleep(0.01 * (3 - value))
+        return value * 10
+
+    reg.register("ask", ask, parallel=True)
+    program = Stage3Program(
+        steps=[
+            {"op": "assign", "var": "offset", "value": 1},
+            {
+                "op": "pforeach",
+                "var": "x",
+                "in": [1, 2, 3],
+                "do": [{"op": "call", "tool": "ask", "args": {"value": {"var": "x"}}, "save_as": "answer"}],
+                "collect": {"var": "answer"},
+                "save_as": "answers",
+            },
+        ]
+    )
+    env = compile_stage3_program(program, registry=reg, frames=[DummyFrame()]).run()
+    assert env["answers"] == [10, 20, 30]
+    assert "answer" not in env and "x" not in env
+
+
+def test_stage3_pforeach_rejects_side_effects():
+    reg = ToolRegistry()
+    reg.register("click", lambda *, target: None)
+    reg.register("ask", lambda *, value: value, parallel=True)
+
+    for body in (
+        [{"op": "call", "tool": "click", "args": {"target": 0}}],
+        [{"op": "if", "cond": True, "then": [{"op": "break"}]}],
+        [{"op": "call_method", "target": {"var": "x"}, "method": "select"}],
+    ):
+        program = Stage3Program(steps=[{"op": "pforeach", "var": "x", "in": [1, 2], "do": body}])
+        with pytest.raises(ToolError, match="pforeach.do cannot"):
+            compile_stage3_program(program, registry=reg, frames=[DummyFrame()])
+
+
+def test_stage3_executor_batches_per_item_vision_calls():
+    calls: list[list[int]] = []
+
+    def ask(*, images, question):
+        calls.append(list(images))
+        return [image % 2 == 0 for image in images]
+
+    reg = ToolRegistry()
+    reg.register("ask", ask, parallel=True, batch_arg="images")
+
+    program = Stage3Program(
+        steps=[
+            {
+                "op": "foreach",
+                "var": "x",
+                "in": [1, 2, 3, 4],
+                "do": [
+                    {"op": "call", "tool": "ask", "args": {"images": [{"var": "x"}], "question": "q"}, "save_as": "a"},
+                    {
+                        "op": "if",
+                        "cond": {"ref": "index", "list": {"var": "a"}, "index": 0},
+                        "then": [{"op": "assign", "var": "first", "value": {"var": "x"}}],
+                        "else": [{"op": "assign", "var": "odd", "value": {"var": "x"}}],
+                    },
+                ],
+            }
+        ]
+    )
+    meter = Meter()
+    execute_stage3_program([DummyFrame()], program, registry=reg, meter=meter)
+    assert calls == [[1, 2, 3, 4]]
+    assert meter.usage["batched:ask"] == 3
+
+    env = compile_stage3_program(program, registry=reg, frames=[DummyFrame()]).run()
+    assert env["first"] == 4 and env["odd"] == 3 and env["a"] == [True]
+
+    # Results that cannot be scattered back fall back to per-item calls
+    calls.clear()
+    reg.register(
+        "ask", lambda *, images, question: calls.append(list(images)) or [True], parallel=True, batch_arg="images"
+    )
+    meter = Meter()
+    execute_stage3_program([DummyFrame()], program, registry=reg, meter=meter)
+    assert calls == [[1, 2, 3, 4], [1], [2], [3], [4]]
+
+    # The discarded batched call was made, it is charged and tallied as a fallback
+    assert meter.usage["tool:ask"] == 5
+    assert meter.usage["batch_fallback:ask"] == 1 and not meter.usage["batched:ask"]
+
+
+@pytest.mark.parametrize(
+    "then, expected",
+    [
+        ([{"op": "call", "tool": "pick", "args": {"value": {"var": "x"}}}], [2]),
+        ([{"op": "break"}], []),
+    ],
+)
+def test_stage3_executor_does_not_batch_loops_with_other_effects(then, expected):
+    calls: list[list[int]] = []
+    picked: list[int] = []
+    reg = ToolRegistry()
+    reg.register(
+        "ask", lambda *, images: calls.append(list(images)) or [images[0] == 2], parallel=True, batch_arg="images"
+    )
+    reg.register("pick", lambda *, value: picked.append(value))
+
+    # Ask about an item, and act on it or stop the loop
+    ask = {"op": "call", "tool": "ask", "args": {"images": [{"var": "x"}]}, "save_as": "a"}
+    cond = {"ref": "index", "list": {"var": "a"}, "index": 0}
+    body = [ask, {"op": "if", "cond": cond, "then": then}]
+    program = Stage3Program(steps=[{"op": "foreach", "var": "x", "in": [1, 2, 3, 4], "do": body}])
+
+    meter = Meter()
+    execute_stage3_program([DummyFrame()], program, registry=reg, meter=meter)
+    assert not meter.usage["batched:ask"]
+    assert calls == ([[1], [2], [3], [4]] if expected else [[1], [2]])
+    assert picked == expected
+
+
+def test_stage3_executor_does_not_batch_tools_with_side_effects():
+    calls: list[list[int]] = []
+    reg = ToolRegistry()
+    reg.register("tap", lambda *, items: calls.append(list(items)) or [None], batch_arg="items")
+
+    step = {"op": "call", "tool": "tap", "args": {"items": [{"var": "x"}]}}
+    program = Stage3Program(steps=[{"op": "foreach", "var": "x", "in": [1, 2, 3], "do": [step]}])
+    execute_stage3_program([DummyFrame()], program, registry=reg)
+    assert calls == [[1], [2], [3]]
+
+
+def test_stage3_executor_profiles_steps_and_tools():
+    from PIL import Image
+
+    reg = ToolRegistry()
+
+    def look(*, value):
+        record("screenshots", 2)
+        return [Image.new("RGB", (10, 10)) for _ in range(value)]
+
+    reg.register("look", look)
+    program = Stage3Program(
+        steps=[
+            {
+                "op": "foreach",
+                "var": "x",
+                "in": [1, 2, 3],
+                "do": [{"op": "call", "tool": "look", "args": {"value": {"var": "x"}}}],
+            }
+        ]
+    )
+    profile = execute_stage3_program([DummyFrame()], program, registry=reg)
+    summary = profile.to_dict()
+
+    # Tools are always profiled, steps only on request
+    assert summary["tools"]["look"]["calls"] == 3
+    assert summary["tools"]["look"]["screenshots"] == 6
+    assert summary["tools"]["look"]["image_bytes"] == 6 * 10 * 10 * 3
+    assert summary["steps"] == {}
+    assert "| `look` | 3 |" in profile.to_markdown()
+
+    summary = execute_stage3_program([DummyFrame()], program, registry=reg, profile_steps=True).to_dict()
+    assert summary["tools"]["look"]["calls"] == 3
+    assert summary["steps"]["$.steps[0].do[0]"]["calls"] == 3
+    assert summary["steps"]["$.steps[0]"]["screenshots"] == 6
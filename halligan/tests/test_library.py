@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+from halligan.runtime.library import Library, layout_signature, plan_to_json
+from halligan.runtime.schemas import validate_stage2
+
+
+@dataclass
+class DummyFrame:
+    x: int
+    y: int
+    w: int
+    h: int
+
+
+def _frames(dx: int = 0) -> list[DummyFrame]:
+    return [DummyFrame(100 + dx, 50, 300, 200), DummyFrame(100 + dx, 251, 300, 40)]
+
+
+def test_layout_signature_ignores_offset_and_jitter():
+    a = layout_signature(_frames(), "Select all images with buses")
+    b = layout_signature([DummyFrame(f.x + 1, f.y, f.w, f.h) for f in _frames(dx=400)], "select all images with a bus")
+
+    assert a.key == b.key
+    assert a.objective == b.objective
+    assert layout_signature(_frames(), "x", {"SELECTABLE"}).key != a.key
+
+
+def test_library_lookup_store_and_report(tmp_path):
+    path = str(tmp_path / "library.json")
+    library = Library.load(path)
+    signature = layout_signature(_frames(), "Select all images with buses")
+    plan = validate_stage2(
+        {"actions": [{"type": "grid_frame", "frame": 0, "tiles": 9, "mark_as": "CLICKABLE"}]}, frames=2
+    )
+
+    assert library.lookup("stage2", signature, "recaptcha") is None
+    library.store("stage2", signature, plan_to_json(plan), "recaptcha", latency=4.0)
+    library.save()
+
+    library = Library.load(path)
+    entry = library.lookup("stage2", signature, "recaptcha")
+    assert entry is not None and validate_stage2(entry.data, frames=2) == plan
+    assert library.lookup("stage2", layout_signature(_frames(), "Select all images with cars"), "recaptcha") is None
+    assert library.summary()["stage2:recaptcha"] == {"lookups": 3, "hits": 1, "hit_rate": 0.333, "saved_seconds": 4.0}
+
+    # Entries that fail more often than they succeed are dropped
+    library.report(entry, False)
+    assert library.lookup("stage2", signature, "recaptcha") is entry
+    library.report(entry, False)
+    assert library.lookup("stage2", signature, "recaptcha") is None
+
+
+def test_library_misses_objectives_that_differ_in_the_target_object():
+    library = Library()
+    bus = layout_signature(_frames(), "Select all images containing a bus, then click verify")
+    library.store("stage3", bus, {"steps": []}, "recaptcha", latency=1.0)
+
+    for objective in ("Select all images containing a motorcycle, then click verify", "Select all buses then verify"):
+        assert library.lookup("stage3", layout_signature(_frames(), objective), "recaptcha") is None
+    assert library.lookup(
+        "stage3", layout_signature(_frames(), "select all images containing buses, then click verify"), "recaptcha"
+    )
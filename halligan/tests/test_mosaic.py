@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import pytest
+from PIL import Image
+
+from halligan.utils.mosaic import Packing, pack, unpack_answers
+
+PACKING = Packing(cell_size=16, label_height=8, padding=2)
+
+
+def _tiles(count: int) -> list[Image.Image]:
+    # Distinct solid colours so that every cell can be traced back to its tile
+    return [Image.new("RGB", (16, 16), (index * 20, 255 - index * 20, 100)) for index in range(count)]
+
+
+def _cell_colour(sheet: Image.Image, index: int, columns: int) -> tuple[int, int, int]:
+    row, column = divmod(index, columns)
+    cell_w = PACKING.cell_size + PACKING.padding * 2
+    cell_h = cell_w + PACKING.label_height
+    centre = PACKING.padding + PACKING.cell_size // 2
+    return sheet.getpixel((column * cell_w + centre, row * cell_h + PACKING.label_height + centre))
+
+
+@pytest.mark.parametrize("count, columns, rows", [(1, 1, 1), (4, 2, 2), (5, 3, 2), (10, 4, 3)])
+def test_pack_places_tiles_in_label_order(count, columns, rows):
+    tiles = _tiles(count)
+    sheet = pack(tiles, [str(i) for i in range(count)], PACKING)
+
+    cell_w = PACKING.cell_size + PACKING.padding * 2
+    assert sheet.size == (columns * cell_w, rows * (cell_w + PACKING.label_height))
+    for index, tile in enumerate(tiles):
+        assert _cell_colour(sheet, index, columns) == tile.getpixel((0, 0))
+
+    # Cells after the last tile of an uneven sheet stay blank
+    for index in range(count, columns * rows):
+        assert _cell_colour(sheet, index, columns) == (255, 255, 255)
+
+
+def test_pack_needs_one_label_per_image():
+    with pytest.raises(ValueError):
+        pack(_tiles(3), ["0", "1"], PACKING)
+
+
+def test_unpack_answers_round_trips_uneven_sheets():
+    # 7 tiles sent as sheets of 3, 3 and 1, answered per sheet in label order
+    chunks = [[0, 1, 2], [3, 4, 5], [6]]
+    answers = [[tile % 2 == 0 for tile in chunk] for chunk in chunks]
+
+    stitched = []
+    for chunk, chunk_answers in zip(chunks, answers):
+        stitched += unpack_answers(chunk_answers, len(chunk), False)
+    assert stitched == [tile % 2 == 0 for tile in range(7)]
+
+
+@pytest.mark.parametrize(
+    "answers, expected",
+    [
+        ([], [0, 0, 0]),  # no answers
+        ([5], [5, 0, 0]),  # missing answers
+        ([1, 2, 3, 4, 5], [1, 2, 3]),  # extra answers
+        ((1, 2, 3), [1, 2, 3]),  # not a list
+    ],
+)
+def test_unpack_answers_fixes_the_answer_count(answers, expected):
+    assert unpack_answers(answers, 3, 0) == expected
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+from string import Template
+
+import halligan.prompts as Prompts
+import halligan.utils.examples as Examples
+from halligan.prompts.builder import build, compact, count_tokens
+from halligan.utils.constants import Stage
+
+_TEMPLATE = Template("Solve ${objective}.\nExamples:\n${examples}")
+
+
+def test_build_reports_sections_and_dedupes_examples():
+    slideable = Examples.get("SLIDEABLE_X")
+    examples = [("SLIDEABLE_X", slideable), ("SLIDEABLE_Y", slideable), ("CLICKABLE", Examples.get("CLICKABLE"))]
+
+    prompt, report = build("TEST", _TEMPLATE, examples=examples, objective="it", unused="ignored")
+    assert prompt.count(slideable) == 1
+    assert report.examples == ["SLIDEABLE_X, SLIDEABLE_Y", "CLICKABLE"]
+    assert set(report.sections) == {
+        "instructions",
+        "objective",
+        "example (SLIDEABLE_X, SLIDEABLE_Y)",
+        "example (CLICKABLE)",
+    }
+    assert report.tokens == count_tokens(prompt)
+    assert not report.compacted and not report.dropped
+
+
+def test_build_compacts_then_drops_examples_to_fit_budget():
+    examples = [("CLICKABLE", Examples.get("CLICKABLE")), ("DRAGGABLE", Examples.get("DRAGGABLE"))]
+    _, full = build("TEST", _TEMPLATE, examples=examples, objective="it")
+
+    # Compaction alone is enough for a budget slightly under the full size
+    compacted = sum(count_tokens(compact(text)) for _, text in examples)
+    _, report = build("TEST", _TEMPLATE, examples=examples, objective="it", budget=full.tokens - 10)
+    assert report.compacted and not report.dropped
+    assert compacted < sum(count_tokens(text) for _, text in examples)
+
+    # The first example is kept even when it alone exceeds the budget
+    prompt, report = build("TEST", _TEMPLATE, examples=examples, objective="it", budget=1)
+    assert report.examples == ["CLICKABLE"] and report.dropped == ["DRAGGABLE"]
+    assert compact(Examples.get("CLICKABLE")) in prompt
+
+
+def test_stage_prompts_build_like_get():
+    kwargs = {"descriptions": "d", "relations": "r", "objective": "o"}
+    assert Prompts.build(Stage.STRUCTURE_ABSTRACTION, **kwargs) == Prompts.get(Stage.STRUCTURE_ABSTRACTION, **kwargs)
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import nbformat as nbf
+from PIL import Image
+
+from halligan.utils.logger import Trace, trace_path
+from halligan.utils.trace_writer import IMAGES_DIR, TraceWriter, assemble
+
+
+def test_trace_stores_images_once_and_references_them(tmp_path):
+    path = str(tmp_path / "trace.ipynb")
+    image = Image.new("RGB", (32, 32), "red")
+
+    Trace.start(image, path)
+    Trace.comment("hello")
+    Trace.session.put({"cell": "code", "source": "IMAGES = 2", "images": [image, image.copy()]})
+    Trace.summary("stage", {"ok": True})
+    Trace.stop()
+
+    notebook = nbf.read(path, as_version=4)
+    assert [cell.cell_type for cell in notebook.cells] == ["markdown", "markdown", "code"]
+    assert notebook.cells[1].source == "hello"
+    html = notebook.cells[2].outputs[0]["data"]["text/html"]
+    assert f'src="{IMAGES_DIR}/' in html and "base64" not in html
+
+    # The same pixels are stored once, and the cells log is removed once the notebook is written
+    assert len(os.listdir(tmp_path / IMAGES_DIR)) == 1
+    assert not os.path.exists(tmp_path / "trace.cells.jsonl")
+    assert json.loads((tmp_path / "trace.json").read_text()) == {"stage": {"ok": True}}
+    assert not Trace.tracing
+
+
+def test_traced_images_are_snapshots(tmp_path):
+    writer = TraceWriter(str(tmp_path / "trace.ipynb"))
+    # Hold the writer thread until the image was drawn on
+    drawn = threading.Event()
+    store = writer.images.put
+    writer.images.put = lambda image: drawn.wait() and store(image)
+
+    image = Image.new("RGB", (8, 8), "red")
+    writer.put({"cell": "markdown", "source": "before", "images": [image]})
+    # Drawn on after it was traced, like mark() does with its input
+    image.paste((0, 0, 255), (0, 0, 8, 8))
+    drawn.set()
+    writer.close()
+
+    (name,) = os.listdir(tmp_path / IMAGES_DIR)
+    assert Image.open(tmp_path / IMAGES_DIR / name).getpixel((0, 0)) == (255, 0, 0)
+
+
+def test_partial_trace_can_be_assembled(tmp_path):
+    writer = TraceWriter(str(tmp_path / "trace.ipynb"), thumbnail=16)
+    writer.put({"cell": "markdown", "source": "before the crash", "images": [Image.new("RGB", (64, 64))]})
+    writer.close()
+    assert os.listdir(tmp_path / IMAGES_DIR)[0].endswith(".jpg")
+
+    # A crash leaves the cells log, possibly with a partly written last line
+    cells = tmp_path / "partial.cells.jsonl"
+    cell = nbf.v4.new_markdown_cell("kept")
+    cells.write_text(json.dumps(cell) + "\n" + json.dumps(cell)[:10])
+    assemble(str(cells), str(tmp_path / "partial.ipynb"))
+    assert [c.source for c in nbf.read(str(tmp_path / "partial.ipynb"), as_version=4).cells] == ["kept"]
+
+
+def test_concurrent_sessions_trace_to_their_own_notebooks(tmp_path):
+    @Trace.section("Solve")
+    def solve(n: int) -> None:
+        for i in range(20):
+            Trace.comment(f"run {n} step {i}")
+
+    def run(n: int) -> str:
+        path = trace_path(str(tmp_path), "type/a", id=1, worker=f"w{n}")
+        Trace.start(Image.new("RGB", (8, 8)), path)
+        solve(n)
+        Trace.stop()
+        return path
+
+    with ThreadPoolExecutor(4) as pool:
+        paths = list(pool.map(run, range(4)))
+
+    assert len(set(paths)) == 4 and all(os.path.basename(p).startswith("type_a-1-w") for p in paths)
+    for n, path in enumerate(paths):
+        comments = [c.source for c in nbf.read(path, as_version=4).cells if c.source.startswith("run ")]
+        assert comments == [f"run {n} step {i}" for i in range(20)]
+
+    # Tracing was only active in the workers, and the next attempt of a run gets a new path
+    assert not Trace.tracing
+    assert trace_path(str(tmp_path), "type/a", id=1, worker="w0").endswith("type_a-1-w0-1.ipynb")
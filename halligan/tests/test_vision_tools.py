@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import random
+
+import pytest
+from PIL import Image, ImageDraw
+
+# The vision tools need the model dependencies
+vision_tools = pytest.importorskip("halligan.utils.vision_tools", exc_type=ImportError)
+
+from halligan.utils.layout import Element, Frame  # noqa: E402
+
+
+def test_descriptor_is_cached_until_the_image_is_replaced(monkeypatch):
+    monkeypatch.setattr(vision_tools, "_detect", lambda images, objects: [{"bus": [[4, 4, 28, 28]]} for _ in images])
+    image = Image.new("RGB", (32, 32), (0, 0, 255))
+    ImageDraw.Draw(image).ellipse((8, 8, 24, 24), fill=(255, 255, 0))
+    element = Element(0, 0, image, Frame(0, 0, Image.new("RGB", (32, 32))))
+
+    descriptor = vision_tools.describe(element)
+    assert vision_tools.describe(element) is descriptor
+
+    # mark() leaves the element image as it was, so the descriptor still describes it
+    (marked,) = vision_tools.mark([element.image], "bus")
+    assert vision_tools.describe(element) is descriptor
+
+    element.image = marked
+    assert vision_tools.describe(element) is not descriptor
+
+
+def test_mark_draws_on_copies(monkeypatch):
+    monkeypatch.setattr(vision_tools, "_detect", lambda images, objects: [{"bus": [[4, 4, 28, 28]]} for _ in images])
+    image = Image.new("RGB", (32, 32), (0, 0, 255))
+    original = image.copy()
+
+    (marked,) = vision_tools.mark([image], "bus")
+    assert marked is not image and marked.getpixel((4, 4)) == (255, 0, 0)
+    assert image.tobytes() == original.tobytes()
+
+
+class FakeRankAgent:
+    """Ranks images by brightness, answering with 1-indexed ids like the real agent."""
+
+    def __init__(self) -> None:
+        self.batches: list[int] = []
+
+    def fork(self) -> FakeRankAgent:
+        return self
+
+    def reset(self) -> None:
+        pass
+
+    def __call__(self, prompt, images, captions, policy=None):
+        self.batches.append(len(images))
+        order = sorted(range(len(images)), key=lambda i: images[i].getpixel((0, 0))[0], reverse=True)
+        return f"rank(ids={[i + 1 for i in order]})", None
+
+
+@pytest.mark.parametrize("seeding", ["single_elimination", "multi_round"])
+@pytest.mark.parametrize("count", [1, 2, 3, 5, 7, 11])
+def test_rank_orders_every_image_once(monkeypatch, seeding, count):
+    agent = FakeRankAgent()
+    monkeypatch.setattr(vision_tools, "_agent", agent)
+    brightness = random.Random(count).sample(range(count), count)
+    images = [Image.new("RGB", (4, 4), (value * 20,) * 3) for value in brightness]
+
+    ranking = vision_tools.rank(images, "brightest", max_images_per_call=3, seeding=seeding)
+
+    assert sorted(ranking) == list(range(count))
+    assert all(isinstance(i, int) for i in ranking)
+    assert brightness[ranking[0]] == count - 1
+    if count <= 3:
+        # One batch is ranked as a whole
+        assert [brightness[i] for i in ranking] == sorted(brightness, reverse=True)
+    assert all(size <= 3 for size in agent.batches)
+
+
+def test_multi_round_seeding_advances_runners_up(monkeypatch):
+    calls = {}
+    for seeding in ["single_elimination", "multi_round"]:
+        agent = FakeRankAgent()
+        monkeypatch.setattr(vision_tools, "_agent", agent)
+        images = [Image.new("RGB", (4, 4), (value * 20,) * 3) for value in range(9)]
+        assert vision_tools.rank(images, "brightest", max_images_per_call=3, seeding=seeding)[0] == 8
+        calls[seeding] = agent.batches
+
+    # 3 batches of 3, then the winners (and runners-up) compete
+    assert calls["single_elimination"] == [3, 3, 3, 3]
+    assert len(calls["multi_round"]) > 4